@@ -0,0 +1,102 @@
+"""Benchmark for message framing throughput.
+
+Measures the number of status response messages per second that can be
+constructed with construct_message, and parsed with read_message and with
+FrameParser, both from memory and from a socket.
+
+Usage: python benchmarks/framing.py
+"""
+import sys
+from collections import OrderedDict
+from io import BytesIO
+from os.path import dirname, join
+from socket import socketpair
+from threading import Thread
+from time import perf_counter
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from samil.inverter import construct_message, FrameParser, Inverter, read_message  # noqa: E402
+from samil.simulator import LAKE  # noqa: E402
+
+FRAMES = 50000
+message = construct_message(b'\x01\x82\x00', LAKE.status)
+data = message * FRAMES
+
+
+def construct():
+    """Constructs all frames."""
+    payload = LAKE.status
+    for i in range(FRAMES):
+        construct_message(b'\x01\x82\x00', payload)
+
+
+def read_message_memory():
+    """Parses all frames from a BytesIO stream with read_message."""
+    stream = BytesIO(data)
+    for i in range(FRAMES):
+        read_message(stream)
+
+
+def frame_parser_memory():
+    """Parses all frames with FrameParser, feeding 4096 byte chunks."""
+    parser = FrameParser()
+    n = 0
+    for i in range(0, len(data), 4096):
+        parser.feed(data[i:i + 4096])
+        while parser.next_message():
+            n += 1
+    assert n == FRAMES
+
+
+def _socket_benchmark(receive):
+    """Sends all frames over a socket pair and receives them with the given function."""
+    local, remote = socketpair()
+    sender = Thread(target=remote.sendall, args=(data,))
+    sender.start()
+    start = perf_counter()
+    receive(local)
+    duration = perf_counter() - start
+    sender.join()
+    local.close()
+    remote.close()
+    return duration
+
+
+def read_message_socket(sock):
+    """Receives all frames with read_message on a socket file."""
+    f = sock.makefile('rb')
+    for i in range(FRAMES):
+        read_message(f)
+    f.close()
+
+
+def inverter_receive_socket(sock):
+    """Receives all frames with Inverter.receive, which uses FrameParser."""
+    inverter = Inverter(sock, None)
+    for i in range(FRAMES):
+        inverter.receive()
+
+
+def run():
+    """Runs the benchmark and returns the results, in frames per second."""
+    results = OrderedDict()
+    for name, func in (('construct_message', construct), ('read_message_memory', read_message_memory),
+                       ('frame_parser_memory', frame_parser_memory)):
+        start = perf_counter()
+        func()
+        results[name] = FRAMES / (perf_counter() - start), 'frames/s'
+    for name, func in (('read_message_socket', read_message_socket),
+                       ('inverter_receive_socket', inverter_receive_socket)):
+        results[name] = FRAMES / _socket_benchmark(func), 'frames/s'
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results."""
+    for name, (value, unit) in run().items():
+        print("{:<28} {:>10.0f} {}".format(name, value, unit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark for encoding status data to MQTT payloads.
+
+Measures the cost per sample of the JSON payload that samil mqtt publishes
+and of the per-field payloads with a deadband filter, using the inverter
+profiles from samil/simulator.py.
+
+Usage: python benchmarks/jsonencode.py
+"""
+import json
+import sys
+from collections import OrderedDict
+from os.path import dirname, join
+from timeit import repeat
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from samil.cli import DecimalEncoder  # noqa: E402
+from samil.inverter import decode_status  # noqa: E402
+from samil.mqtt import DeadbandFilter  # noqa: E402
+from samil.simulator import LAKE, RIVER  # noqa: E402
+
+SAMPLES = 1000
+
+
+def bench(func, number=10):
+    """Returns the best time per sample in microseconds."""
+    return min(repeat(func, number=number, repeat=5)) / number / SAMPLES * 1e6
+
+
+def run():
+    """Runs the benchmark and returns the results, in microseconds per sample."""
+    results = OrderedDict()
+    for name, inverter in (('river', RIVER), ('lake', LAKE)):
+        status = decode_status(inverter.status_format, inverter.status)
+
+        def encode_json():
+            """Encodes all samples as compact JSON, like samil mqtt."""
+            for i in range(SAMPLES):
+                json.dumps(status, cls=DecimalEncoder, separators=(',', ':'))
+
+        def encode_fields():
+            """Filters and encodes the fields of all samples separately, all numbers change every sample."""
+            status_filter = DeadbandFilter()
+            samples = [OrderedDict((k, v if isinstance(v, str) else v + i) for k, v in status.items())
+                       for i in range(2)]
+            for i in range(SAMPLES):
+                [str(v) for v in status_filter.filter(samples[i % 2]).values()]
+
+        results[name + '.json'] = bench(encode_json), 'us'
+        results[name + '.fields'] = bench(encode_fields), 'us'
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results."""
+    results = run()
+    for name in ('river', 'lake'):
+        print("{}: JSON {:.1f} us, per field {:.1f} us per sample".format(
+            name, results[name + '.json'][0], results[name + '.fields'][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark for encoding status data to InfluxDB line protocol.
+
+Compares LineProtocolEncoder with building a Point using status_to_point
+and converting it to line protocol, using the inverter profiles from
+samil/simulator.py.
+
+Usage: python benchmarks/lineprotocol.py
+"""
+import sys
+from collections import OrderedDict
+from datetime import datetime, timezone
+from os.path import dirname, join
+from timeit import repeat
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from samil.influx import LineProtocolEncoder, status_to_point  # noqa: E402
+from samil.inverter import decode_status  # noqa: E402
+from samil.simulator import LAKE, RIVER  # noqa: E402
+
+SAMPLES = 1000
+
+
+def bench(func, number=10):
+    """Returns the best time per sample in microseconds."""
+    return min(repeat(func, number=number, repeat=5)) / number / SAMPLES * 1e6
+
+
+def run():
+    """Runs the benchmark and returns the results, in microseconds per sample."""
+    results = OrderedDict()
+    tags = {'serial_number': 'DW413B8080'}
+    timestamp = datetime.now(timezone.utc)
+    for name, inverter in (('river', RIVER), ('lake', LAKE)):
+        status = decode_status(inverter.status_format, inverter.status)
+        samples = [(status, timestamp)] * SAMPLES
+        encoder = LineProtocolEncoder('samil', tags=tags)
+        expected = status_to_point('samil', status, tags=tags, timestamp=timestamp).to_line_protocol().encode()
+        assert encoder.encode(status, timestamp) == expected
+
+        def point():
+            """Encodes all samples using Point."""
+            b'\n'.join(status_to_point('samil', s, tags=tags, timestamp=t).to_line_protocol().encode()
+                       for s, t in samples)
+
+        def encode():
+            """Encodes all samples one by one."""
+            b'\n'.join(encoder.encode(s, t) for s, t in samples)
+
+        def encode_many():
+            """Encodes all samples at once."""
+            encoder.encode_many(samples)
+
+        results[name + '.status_to_point'] = bench(point), 'us'
+        results[name + '.encode'] = bench(encode), 'us'
+        results[name + '.encode_many'] = bench(encode_many), 'us'
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results."""
+    results = run()
+    for name in ('river', 'lake'):
+        print("{}: Point {:.1f} us, encode {:.1f} us, encode_many {:.1f} us per sample".format(
+            name, *(results[name + '.' + k][0] for k in ('status_to_point', 'encode', 'encode_many'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark for polling the status of simulated inverters.
+
+Runs virtual inverters from samil/simulator.py in a background event loop,
+lets them connect to a local listener and measures the number of status
+polls per second: sequentially on a single Inverter and with StatusPoller
+for a fleet of inverters.
+
+Usage: python benchmarks/polling.py
+"""
+import asyncio
+import socket
+import sys
+from collections import OrderedDict
+from os.path import dirname, join
+from threading import Thread
+from time import perf_counter
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from samil.inverter import Inverter  # noqa: E402
+from samil.inverterutil import StatusPoller  # noqa: E402
+from samil.simulator import create_fleet, Simulator  # noqa: E402
+
+FLEET_SIZE = 50
+DURATION = 2.0  # Seconds per measurement
+
+
+def _connect_fleet(n: int):
+    """Starts n virtual inverters and returns the connected Inverter instances, the loop and the simulator."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(n)
+    loop = asyncio.new_event_loop()
+    simulator = Simulator(create_fleet(n), host='127.0.0.1', port=0, server_port=listener.getsockname()[1],
+                          connect_jitter=0.0)
+    Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(simulator.start(), loop).result()
+    loop.call_soon_threadsafe(simulator.connect_all, '127.0.0.1')
+    inverters = [Inverter(*listener.accept()) for i in range(n)]
+    listener.close()
+    return inverters, loop, simulator
+
+
+def _measure(func) -> float:
+    """Calls the function repeatedly for the duration, returns the number of calls per second."""
+    calls = 0
+    start = perf_counter()
+    while perf_counter() - start < DURATION:
+        func()
+        calls += 1
+    return calls / (perf_counter() - start)
+
+
+def run():
+    """Runs the benchmark and returns the results."""
+    results = OrderedDict()
+    inverters, loop, simulator = _connect_fleet(FLEET_SIZE)
+    try:
+        inverter = inverters[0]
+        inverter.status()  # Retrieves the status format
+        results['status'] = _measure(inverter.status), 'polls/s'
+        with StatusPoller(inverters) as poller:
+            poller.poll()
+            rate = _measure(poller.poll)
+        results['poller_{}'.format(FLEET_SIZE)] = rate, 'polls/s'
+        results['poller_{}_samples'.format(FLEET_SIZE)] = rate * FLEET_SIZE, 'samples/s'
+    finally:
+        for inverter in inverters:
+            inverter.disconnect()
+        asyncio.run_coroutine_threadsafe(simulator.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results."""
+    for name, (value, unit) in run().items():
+        print("{:<20} {:>10.0f} {}".format(name, value, unit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Runs all benchmarks and writes the results as JSON.
+
+The output contains the git commit, Python version and platform, and
+for each benchmark the value and unit. Rates (units ending in '/s') are
+better when higher, times are better when lower. When a baseline file from
+an earlier run is given, results that got worse by more than the threshold
+are reported and the exit code is 1.
+
+Usage: python benchmarks/run.py [-o results.json] [--baseline old.json] [--threshold 0.1] [benchmark ...]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from collections import OrderedDict
+from datetime import datetime, timezone
+from importlib import import_module
+from os.path import dirname, join
+
+sys.path.insert(0, dirname(__file__))
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+BENCHMARKS = ['framing', 'statusdecode', 'lineprotocol', 'jsonencode', 'polling', 'store']
+
+
+def _commit():
+    """Returns the git commit of the source tree, or None."""
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=dirname(__file__) or '.',
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(benchmarks) -> OrderedDict:
+    """Runs the benchmarks and returns the results document."""
+    results = OrderedDict()
+    for benchmark in benchmarks:
+        print("Running {}".format(benchmark), file=sys.stderr)
+        for name, (value, unit) in import_module(benchmark).run().items():
+            results['{}.{}'.format(benchmark, name)] = OrderedDict([('value', value), ('unit', unit)])
+    return OrderedDict([
+        ('commit', _commit()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('time', datetime.now(timezone.utc).isoformat()),
+        ('results', results),
+    ])
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns a description of each result that is worse than the baseline by more than the threshold."""
+    regressions = []
+    for name, result in results['results'].items():
+        old = baseline['results'].get(name)
+        if not old or old['unit'] != result['unit'] or not old['value']:
+            continue
+        change = result['value'] / old['value'] - 1
+        if not result['unit'].endswith('/s'):
+            change = -change  # Lower is better
+        if change < -threshold:
+            regressions.append("{}: {:.4g} {} -> {:.4g} {} ({:+.0%})".format(
+                name, old['value'], old['unit'], result['value'], result['unit'], change))
+    return regressions
+
+
+def main():
+    """Parses the arguments, runs the benchmarks and writes the results."""
+    parser = argparse.ArgumentParser(description="Runs the benchmarks and writes the results as JSON.")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help="Benchmarks to run, all when not given: {}.".format(', '.join(BENCHMARKS)))
+    parser.add_argument('-o', '--output', help="Output file, stdout when not given.")
+    parser.add_argument('--baseline', help="Results of an earlier run to compare with.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative change that counts as regression (default: 0.1).")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark(s): {}".format(', '.join(sorted(unknown))))
+
+    results = run(args.benchmarks or BENCHMARKS)
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print("Regression: {}".format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Benchmark for status payload decoding.
+
+Compares the compiled StatusDecoder with calling get_value for each status
+type, using the inverter profiles from samil/simulator.py.
+
+Usage: python benchmarks/statusdecode.py
+"""
+import sys
+from collections import OrderedDict
+from os.path import dirname, join
+from timeit import repeat
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from samil.simulator import LAKE, RIVER  # noqa: E402
+from samil.statustypes import StatusDecoder, get_status_decoder  # noqa: E402
+
+
+def bench(func, number=10000):
+    """Returns the best time per call in microseconds."""
+    return min(repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def run():
+    """Runs the benchmark and returns the results, in microseconds per status."""
+    results = OrderedDict()
+    for name, inverter in (('river', RIVER), ('lake', LAKE)):
+        status_format = inverter.status_format
+        payload = inverter.status
+        decoder = get_status_decoder(status_format)
+        assert decoder.decode(payload) == decoder.decode_slow(payload)
+
+        results[name + '.get_value'] = bench(lambda: decoder.decode_slow(payload)), 'us'
+        results[name + '.compiled'] = bench(lambda: get_status_decoder(status_format).decode(payload)), 'us'
+        results[name + '.compile'] = bench(lambda: StatusDecoder(status_format), number=1000), 'us'
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results."""
+    results = run()
+    for name in ('river', 'lake'):
+        slow = results[name + '.get_value'][0]
+        fast = results[name + '.compiled'][0]
+        print("{:<6} get_value: {:7.2f} us  compiled: {:7.2f} us  speedup: {:4.1f}x  (compile once: {:.2f} us)".format(
+            name, slow, fast, slow / fast, results[name + '.compile'][0]))
+
+
+if __name__ == '__main__':
+    main()
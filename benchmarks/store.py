@@ -0,0 +1,61 @@
+"""Benchmark for the local time series store.
+
+Appends a day of status samples, 10 seconds apart, of the river inverter
+profile from samil/simulator.py and measures the append rate, the time to
+query the whole day with all fields and with a single field, and the file
+size per sample.
+
+Usage: python benchmarks/store.py
+"""
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from os.path import dirname, join
+from time import perf_counter
+from timeit import repeat
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+from samil.inverter import decode_status  # noqa: E402
+from samil.simulator import RIVER  # noqa: E402
+from samil.store import TimeSeriesStore  # noqa: E402
+
+SAMPLES = 24 * 60 * 6  # A day at 10 second intervals
+START = datetime(2020, 6, 1, tzinfo=timezone.utc)
+END = START + timedelta(days=1)
+
+
+def run():
+    """Runs the benchmark and returns the results."""
+    status = decode_status(RIVER.status_format, RIVER.status)
+    times = [START + timedelta(seconds=10 * i) for i in range(SAMPLES)]
+    with tempfile.TemporaryDirectory() as directory, TimeSeriesStore(directory) as store:
+        start = perf_counter()
+        for t in times:
+            store.append('DW413B8080', t, status)
+        append = SAMPLES / (perf_counter() - start)
+        assert len(store.query('DW413B8080', START, END)) == SAMPLES
+        query = min(repeat(lambda: store.query('DW413B8080', START, END), number=1, repeat=5))
+        query_field = min(repeat(lambda: store.query('DW413B8080', START, END, fields=['output_power']),
+                                 number=1, repeat=5))
+        size = os.path.getsize(join(directory, 'DW413B8080', '20200601.ts')) / SAMPLES
+    return OrderedDict([
+        ('append', (append, 'samples/s')),
+        ('query_day', (query, 's')),
+        ('query_day_field', (query_field, 's')),
+        ('size', (size, 'bytes')),
+    ])
+
+
+def main():
+    """Runs the benchmark and prints the results."""
+    results = run()
+    print("Append {:.0f} samples/s, query a day {:.1f} ms, one field {:.1f} ms, {:.1f} bytes per sample".format(
+        results['append'][0], results['query_day'][0] * 1000, results['query_day_field'][0] * 1000,
+        results['size'][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Communicate with Samil Power inverters using asyncio."""
+
+import asyncio
+import logging
+import socket
+from typing import Tuple, Dict, Optional
+
+from samil.inverter import construct_message, decode_model, decode_status, FrameParser, InverterEOFError
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncInverter:
+    """Asyncio variant of the Inverter class.
+
+    Provides the same request methods as Inverter, but as coroutines on top of
+    an asyncio stream reader and writer. This makes it possible to communicate
+    with many inverters concurrently from a single event loop.
+
+    Multiple requests can be in flight at the same time, for instance using
+    asyncio.gather. Responses are routed to the requests like
+    Inverter.pipeline does.
+    """
+
+    # Caches the format for inverter status messages
+    _status_format = None
+
+    # Time of arrival (loop time) and payload of the most recent status response
+    last_status = None  # type: Optional[Tuple[float, bytes]]
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, addr, timeout: float = 30.0,
+                 max_framing_errors: Optional[int] = 10):
+        """Constructor.
+
+        Args:
+            reader: Stream reader of the inverter connection.
+            writer: Stream writer of the inverter connection.
+            addr: The inverter network address.
+            timeout: Maximum time in seconds to wait for a response. Inverters
+                should respond in around 1.5 seconds.
+            max_framing_errors: See Inverter.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.addr = addr
+        self.timeout = timeout
+        self._pending = []  # Identifier, expected response identifier and future of each pending request
+        self._router = None  # type: Optional[asyncio.Task]
+        self._closed = False
+        self.parser = FrameParser(max_errors=max_framing_errors)
+
+    @classmethod
+    async def from_socket(cls, sock: socket.socket, addr, **kwargs) -> 'AsyncInverter':
+        """Creates an instance from a connected socket.
+
+        The socket can be obtained using InverterFinder.find_inverter.
+        Additional keyword arguments are passed to the constructor.
+        """
+        sock.setblocking(False)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        return cls(reader, writer, addr, **kwargs)
+
+    async def __aenter__(self):
+        """Returns self."""
+        return self
+
+    async def __aexit__(self, *args):
+        """See self.disconnect."""
+        await self.disconnect()
+
+    async def disconnect(self) -> None:
+        """Closes the connection."""
+        if self._router:
+            self._router.cancel()
+        if self._closed:
+            return
+        self._closed = True
+        if self.writer.can_write_eof():
+            try:
+                self.writer.write_eof()
+            except OSError:
+                pass  # The connection might already be broken
+        self.writer.close()
+        if hasattr(self.writer, 'wait_closed'):  # Python 3.7+
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+
+    async def model(self) -> Dict:
+        """Gets model information from the inverter.
+
+        See Inverter.model.
+        """
+        ident, payload = await self.request(b'\x01\x03\x02', b'', b'\x01\x83')
+        return decode_model(payload)
+
+    async def status(self, max_age: float = None) -> Dict:
+        """Gets current status data from the inverter.
+
+        See Inverter.status.
+        """
+        if not self._status_format:
+            # Retrieve and cache status format, together with the status
+            self._status_format, (ident, payload) = await asyncio.gather(
+                self.status_format(), self.request(b'\x01\x02\x02', b'', b'\x01\x82'))
+        elif max_age is not None and self.last_status and self._time() - self.last_status[0] <= max_age:
+            payload = self.last_status[1]
+        else:
+            ident, payload = await self.request(b'\x01\x02\x02', b'', b'\x01\x82')
+        return decode_status(self._status_format, payload)
+
+    async def status_format(self) -> bytes:
+        """Gets the format used for the status data messages from the inverter.
+
+        See Inverter.status_format.
+        """
+        ident, payload = await self.request(b'\x01\x00\x02', b'', b'\x01\x80')
+        return payload
+
+    async def request(self, identifier: bytes, payload: bytes, expected_response_id=b"") -> Tuple[bytes, bytes]:
+        """Sends a message and returns the received response.
+
+        See Inverter.request.
+
+        Raises:
+            asyncio.TimeoutError: When no matching response arrived in time.
+        """
+        pending = (identifier, expected_response_id, asyncio.get_event_loop().create_future())
+        self._pending.append(pending)
+        try:
+            await self.send(identifier, payload)
+            if not self._router or self._router.done():
+                self._router = asyncio.ensure_future(self._route_responses())
+            return await asyncio.wait_for(pending[2], self.timeout)
+        finally:
+            if pending in self._pending:
+                self._pending.remove(pending)
+
+    async def _route_responses(self):
+        """Receives messages and hands them to the pending requests until none are left."""
+        try:
+            while self._pending:
+                response = await self.receive()
+                if response[0].startswith(b'\x01\x82'):
+                    self.last_status = (self._time(), response[1])
+                for pending in self._pending:
+                    identifier, expected_response_id, future = pending
+                    if response[0].startswith(expected_response_id) and not future.done():
+                        future.set_result(response)
+                        self._pending.remove(pending)
+                        break
+                else:
+                    if not response[0].startswith(b'\x01\x82'):
+                        logger.warning("Got unexpected inverter response {} for request(s) {}".format(
+                            response[0].hex(), ", ".join(p[0].hex() for p in self._pending)))
+        except Exception as e:
+            for identifier, expected_response_id, future in self._pending:
+                if not future.done():
+                    future.set_exception(e)
+
+    @staticmethod
+    def _time() -> float:
+        """Returns the event loop time."""
+        return asyncio.get_event_loop().time()
+
+    async def send(self, identifier: bytes, payload: bytes):
+        """Constructs and sends a message to the inverter."""
+        message = construct_message(identifier, payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Sending %s', message.hex())
+        self.writer.write(message)
+        await self.writer.drain()
+
+    async def receive(self) -> Tuple[bytes, bytes]:
+        """Reads and returns the next message from the inverter.
+
+        See Inverter.receive.
+        """
+        while True:
+            message = self.parser.next_message()
+            if message:
+                identifier, payload = message
+                return bytes(identifier), bytes(payload)
+            data = await self.reader.read(self.parser.max_payload_size)
+            if not data:
+                raise InverterEOFError
+            self.parser.feed(data)
@@ -0,0 +1,240 @@
+"""Background writer that groups records into batches."""
+import logging
+from collections import deque
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, List, Any, Optional
+
+from samil.spool import Spool
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """Writes records in batches from a background thread.
+
+    Records are added to a bounded queue and written when a full batch is
+    available or when the oldest record has waited for the flush interval.
+    Failed writes are retried with exponential backoff. When the queue is
+    full, the oldest record is dropped, so that adding records never blocks.
+
+    Optionally a spool can be given. Batches that fail are then stored in the
+    spool instead of being retried, and while the write keeps failing, new
+    batches go to the spool directly. Once writing succeeds again, the
+    spooled records are written one segment per replay interval, in between
+    the new batches. This requires the records to be bytes without newlines.
+
+    Needs to be closed after use, or used as context manager.
+    """
+
+    def __init__(self,
+                 write: Callable[[List[Any]], None],
+                 batch_size: int = 100,
+                 flush_interval: float = 10.0,
+                 queue_size: int = 10000,
+                 max_retries: int = 5,
+                 retry_interval: float = 5.0,
+                 max_retry_interval: float = 300.0,
+                 spool: Spool = None,
+                 replay_interval: float = 1.0):
+        """Constructor.
+
+        Args:
+            write: Function that writes a list of records, should raise an
+                exception when the write failed.
+            batch_size: Maximum number of records per write.
+            flush_interval: Maximum time in seconds that a record waits
+                before it is written.
+            queue_size: Maximum number of records waiting to be written.
+            max_retries: Number of retries for a failed write, after which
+                the batch is dropped.
+            retry_interval: Delay before the first retry, doubles for each
+                next retry.
+            max_retry_interval: Maximum delay between retries.
+            spool: Optional spool for records that could not be written. It
+                is closed when the writer is closed.
+            replay_interval: Minimum time in seconds between the writes of
+                two spool segments. Limits the load on the server after an
+                outage.
+        """
+        self._write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.spool = spool
+        self.replay_interval = replay_interval
+
+        self.written = 0  # Number of records written
+        self.dropped = 0  # Number of records dropped because of a full queue or failed writes
+        self.spooled = 0  # Number of records stored in the spool
+        self.replayed = 0  # Number of records written from the spool
+
+        self._queue = deque(maxlen=queue_size)
+        self._first_added = None  # Time at which the oldest record in the queue was added
+        self._closed = False
+        self._retry_delay = retry_interval  # Backoff delay when using a spool
+        self._next_attempt = float('-inf')  # No writes before this time when using a spool
+        self._last_replay = float('-inf')
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        """Returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def write(self, record):
+        """Adds a record to the queue, does not block."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Writer is closed")
+            if len(self._queue) == self._queue.maxlen:
+                logger.warning("Write queue is full, dropping oldest record")
+                self.dropped += 1
+            if not self._queue:
+                # Let the writer thread start the flush interval timer
+                self._first_added = monotonic()
+                self._condition.notify()
+            self._queue.append(record)
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+
+    def close(self, timeout: float = None):
+        """Writes the remaining records and stops the background thread.
+
+        Args:
+            timeout: Maximum time to wait for the remaining writes.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        if self.spool is not None:
+            self.spool.close()
+
+    def __len__(self):
+        """Returns the number of records waiting to be written."""
+        return len(self._queue)
+
+    def _next_batch(self, timeout: float = None) -> List:
+        """Waits until a batch is due and takes it from the queue.
+
+        Returns an empty list when closed and the queue is empty, or when no
+        batch was due within the timeout.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while not self._closed:
+                now = monotonic()
+                if len(self._queue) >= self.batch_size:
+                    break
+                wait = None
+                if self._queue:
+                    wait = self._first_added + self.flush_interval - now
+                    if wait <= 0:
+                        break
+                if deadline is not None:
+                    if deadline <= now:
+                        return []
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._condition.wait(wait)
+            batch = [self._queue.popleft() for i in range(min(self.batch_size, len(self._queue)))]
+            self._first_added = monotonic() if self._queue else None
+            return batch
+
+    def _run(self):
+        """Writes batches until closed."""
+        while True:
+            batch = self._next_batch(self._replay_wait())
+            if batch:
+                if self.spool is None:
+                    self._write_with_retries(batch)
+                else:
+                    self._write_or_spool(batch)
+            elif self._closed:
+                return
+            if not self._closed and self._replay_wait() == 0:
+                self._replay()
+
+    def _replay_wait(self) -> Optional[float]:
+        """Returns the time until the next spool segment can be written, or None if there is none."""
+        if self.spool is None or not len(self.spool):
+            return None
+        due = max(self._next_attempt, self._last_replay + self.replay_interval)
+        return max(due - monotonic(), 0)
+
+    def _write_or_spool(self, batch: List):
+        """Writes a batch, stores it in the spool if that fails or when backing off."""
+        if monotonic() < self._next_attempt:
+            self._spool(batch)
+            return
+        try:
+            self._write(batch)
+        except Exception:
+            self._failed(len(batch))
+            self._spool(batch)
+        else:
+            self.written += len(batch)
+            self._retry_delay = self.retry_interval
+
+    def _replay(self):
+        """Writes the oldest spool segment."""
+        self._last_replay = monotonic()
+        segment = self.spool.oldest()
+        lines = self.spool.read(segment)
+        if lines:
+            try:
+                self._write(lines)
+            except Exception:
+                self._failed(len(lines))
+                return
+        logger.info("Written %s records from spool, %s segment(s) left", len(lines), len(self.spool) - 1)
+        self.spool.remove(segment)
+        self.replayed += len(lines)
+        self._retry_delay = self.retry_interval
+
+    def _spool(self, batch: List):
+        """Stores a batch in the spool."""
+        self.spool.append(batch)
+        self.spooled += len(batch)
+
+    def _failed(self, n: int):
+        """Backs off after a failed write of n records."""
+        logger.warning("Writing batch of %s records failed, retrying in %s seconds", n, self._retry_delay,
+                       exc_info=True)
+        self._next_attempt = monotonic() + self._retry_delay
+        self._retry_delay = min(self._retry_delay * 2, self.max_retry_interval)
+
+    def _write_with_retries(self, batch: List):
+        """Writes a batch, retrying with exponential backoff.
+
+        When the writer is closed during the backoff, one final attempt is
+        made directly. Batches that are written after closing are not retried.
+        """
+        delay = self.retry_interval
+        retries = self.max_retries
+        while True:
+            try:
+                self._write(batch)
+                self.written += len(batch)
+                return
+            except Exception:
+                if retries <= 0:
+                    break
+                retries -= 1
+                with self._condition:
+                    if self._closed:
+                        break  # Do not delay the shutdown
+                    logger.warning("Writing batch of %s records failed, retrying in %s seconds", len(batch), delay,
+                                   exc_info=True)
+                    if self._condition.wait_for(lambda: self._closed, delay):
+                        retries = 0  # Closed while backing off, make a final attempt
+                delay = min(delay * 2, self.max_retry_interval)
+        logger.error("Writing batch of %s records failed, dropping it", len(batch))
+        self.dropped += len(batch)
@@ -1,19 +1,34 @@
 """Command-line interface."""
 import json
 import logging
-from collections import namedtuple
-from decimal import Decimal
+import os
+from collections import namedtuple, OrderedDict
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from functools import partial
 from time import time, sleep
+from typing import Dict, List, Optional, Tuple
 
 import click
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.write_api import SYNCHRONOUS
 from paho.mqtt.client import Client as MQTTClient
 
-from samil.influx import status_to_point
+from samil.batchwriter import BatchWriter
+from samil.influx import LineProtocolEncoder
 from samil.inverter import InverterNotFoundError, InverterFinder, KeepAliveInverter
-from samil.inverterutil import connect_inverters
-from samil.pvoutput import add_status, aggregate_statuses
+from samil.inverterutil import connect_inverters, StatusPoller
+from samil.metrics import MetricsCollector
+from samil.mqtt import BufferedPublisher, DeadbandFilter
+from samil.prometheus import MetricsServer, StatusCache
+from samil.proxy import connect as connect_proxy, InverterProxy, parse_address, ProxyServer, UNIX_SOCKETS
+from samil.pvoutput import aggregate_statuses, PVOutputClient, RequestBudget, StatusQueue, StatusUploader, \
+    UploadScheduler
+from samil.recorder import FrameRecorder
+from samil.sinks import FanOut, Sample, Sink
+from samil.spool import Spool
+from samil.store import TimeSeriesStore
 
 logger = logging.getLogger(__name__)
 
@@ -27,17 +42,32 @@ def cli(debug: bool):
         logging.basicConfig(level=logging.DEBUG)
 
 
+def _max_age(interval: float) -> float:
+    """Returns the max age of a status for polling at an interval, see Inverter.status.
+
+    A status that arrived in reply to a keep-alive message is used instead of
+    making a new request. Half the interval makes sure that the response to
+    the previous poll is never used again.
+    """
+    return interval / 2
+
+
 @cli.command()
 @click.option('--interval',
               default=5.0,
               help="Status interval.",
               show_default=True)
 @click.option('--interface', help="IP address of local network interface to bind to.")
-def monitor(interval: float, interface: str):
+@click.option('--record', type=click.Path(dir_okay=False, writable=True),
+              help="Record the raw inverter connection data to this file.")
+@click.option('--proxy', 'proxy_address', metavar='HOST:PORT|PATH',
+              help="Connect through a running proxy command instead of searching for the inverter.")
+def monitor(interval: float, interface: str, record: Optional[str], proxy_address: Optional[str]):
     """Print model and status info for an inverter.
 
     When you have multiple inverters, run this command multiple times to
-    connect to all inverters.
+    connect to all inverters. When the inverter is shared using the proxy
+    command, use --proxy to connect through the proxy.
     """
     _model_keys = {
         'device_type': 'Device type',
@@ -93,15 +123,20 @@ def monitor(interval: float, interface: str):
         t = [(form[0], '{}{}{}'.format(v, ' ' if form[1] else '', form[1])) for form, v in t]
         return _format_two_tuple(t)
 
-    with InverterFinder(interface_ip=interface or '') as finder:
-        print("Searching for inverter")
-        try:
-            inverter = KeepAliveInverter(*finder.find_inverter())
-        except InverterNotFoundError:
-            print("Could not find inverter")
-            return
-
-    with inverter:
+    with ExitStack() as stack:
+        recorder = stack.enter_context(FrameRecorder(record)) if record else None
+        if proxy_address:
+            address = parse_address(proxy_address)
+            inverter = KeepAliveInverter(connect_proxy(address), address, recorder=recorder)
+        else:
+            with InverterFinder(interface_ip=interface or '') as finder:
+                print("Searching for inverter")
+                try:
+                    inverter = KeepAliveInverter(*finder.find_inverter(), recorder=recorder)
+                except InverterNotFoundError:
+                    print("Could not find inverter")
+                    return
+        stack.enter_context(inverter)
         print("Found inverter on address {}".format(inverter.addr))
         model_dict = inverter.model()
         print()
@@ -110,7 +145,7 @@ def monitor(interval: float, interface: str):
         n = 1
         t = time()
         while True:
-            status_dict = inverter.status()
+            status_dict = inverter.status(max_age=_max_age(interval))
             print()
             print("Status data #{}".format(n))
             print(_format_status(status_dict))
@@ -132,6 +167,20 @@ class DecimalEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+def _parse_deadbands(ctx, param, value) -> Dict[str, Decimal]:
+    """Click callback that parses FIELD=VALUE deadband options."""
+    deadbands = OrderedDict()
+    for option in value:
+        field, sep, deadband = option.partition('=')
+        try:
+            if not field or not sep:
+                raise InvalidOperation
+            deadbands[field] = Decimal(deadband)
+        except InvalidOperation:
+            raise click.BadParameter("should be FIELD=VALUE, e.g. output_power=5, got {}".format(option))
+    return deadbands
+
+
 @cli.command()
 @click.option('-n', '--inverters', 'n', default=1, help="Number of inverters.", show_default=True)
 @click.option('-i', '--interval', default=10.0, help="Interval between status messages in seconds.", show_default=True)
@@ -145,7 +194,36 @@ class DecimalEncoder(json.JSONEncoder):
 @click.option('--password', help="MQTT password.")
 @click.option('--topic-prefix', help="MQTT topic prefix.", default='inverter', show_default=True)
 @click.option('--interface', help="IP address of local network interface to bind to.", default='')
-def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, password, interface, topic_prefix):
+@click.option('--serial', 'serial_numbers', multiple=True,
+              help="Only connect to the inverter with this serial number, can be given multiple times. "
+                   "Overrides -n.")
+@click.option('--per-field',
+              is_flag=True,
+              default=False,
+              help="Publish each status field to a separate topic, only when it has changed.")
+@click.option('--deadband', 'deadbands', multiple=True, metavar='FIELD=VALUE', callback=_parse_deadbands,
+              help="Minimum change before a field is published with --per-field, e.g. output_power=5. FIELD may "
+                   "contain wildcards, e.g. '*_voltage=0.1'. Can be given multiple times.")
+@click.option('--refresh',
+              default=60,
+              help="Publish all fields every this many intervals with --per-field, 0 to disable.",
+              show_default=True)
+@click.option('--qos', type=click.IntRange(0, 2), default=0, help="MQTT QoS level.", show_default=True)
+@click.option('--queue-size',
+              default=10000,
+              help="Maximum number of messages kept in memory while disconnected from the broker.",
+              show_default=True)
+@click.option('--spool-dir',
+              type=click.Path(file_okay=False),
+              help="Directory to store messages in when the memory queue is full. If not given, the oldest "
+                   "messages are dropped.")
+@click.option('--max-rate',
+              default=50.0,
+              help="Maximum number of queued messages per second that is published after reconnecting.",
+              show_default=True)
+def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, password, interface, topic_prefix,
+         serial_numbers, per_field: bool, deadbands, refresh: int, qos: int, queue_size: int, spool_dir: str,
+         max_rate: float):
     """Publish inverter data to an MQTT broker.
 
     The default topic format is inverter/<serial number>/status, e.g.
@@ -158,18 +236,34 @@ def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, pa
         "output_power":2589.0,"energy_today":21.2,"energy_total":77.0,
         "grid_voltage":242.6,"grid_current":3.6,"grid_frequency":50.01,
         "internal_temperature":35.0}
+
+    With --per-field, each field is published as a separate message to topic
+    inverter/<serial number>/<field>, e.g. inverter/DW413B8080/output_power,
+    with the plain value as message. A field is only published when it has
+    changed more than its deadband, which is 0 unless specified with
+    --deadband. All fields are published every --refresh intervals.
+
+    While the broker is unreachable, messages are queued and published in
+    order after reconnecting.
     """
-    MQTTInverter = namedtuple("MQTTInverter", ["inverter", "topic", "serial_number"])
+    MQTTInverter = namedtuple("MQTTInverter", ["inverter", "topic", "serial_number", "filter"])
 
-    print("Connecting to {} inverter(s)".format(n))
+    print("Connecting to {} inverter(s)".format(len(serial_numbers) or n))
     mqtt_inverters = []
-    with connect_inverters(interface, n) as inverters:
+    with connect_inverters(interface, n, serial_numbers=serial_numbers) as inverters:
         for i in inverters:
-            serial_number = i.model()["serial_number"]
+            serial_number = i.serial_number
             print("Connected to inverter {} on IP {}".format(serial_number, i.addr))
+            if per_field:
+                topic = "{}/{}".format(topic_prefix, serial_number)
+                status_filter = DeadbandFilter(deadbands, refresh_interval=refresh)
+            else:
+                topic = "{}/{}/status".format(topic_prefix, serial_number)
+                status_filter = None
             mqtt_inverters.append(MQTTInverter(inverter=i,
-                                               topic="{}/{}/status".format(topic_prefix, serial_number),
-                                               serial_number=serial_number))
+                                               topic=topic,
+                                               serial_number=serial_number,
+                                               filter=status_filter))
 
         print("Connecting to MQTT broker")
         client = MQTTClient(client_id=client_id)
@@ -177,35 +271,116 @@ def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, pa
             client.tls_set()
         if username:
             client.username_pw_set(username, password)
-        client.connect(host=host, port=port, bind_address=interface or '')
+        publisher = BufferedPublisher(client,
+                                      qos=qos,
+                                      queue_size=queue_size,
+                                      spool=Spool(spool_dir) if spool_dir else None,
+                                      max_rate=max_rate)
+        # Connects and reconnects in the background, messages are queued until connected
+        client.connect_async(host=host, port=port, bind_address=interface or '')
         client.loop_start()  # Starts handling MQTT traffic in separate thread
 
+        poller = StatusPoller(x.inverter for x in mqtt_inverters)
         try:
             # Startup done
-            topics = ", ".join(x.topic for x in mqtt_inverters)
+            topics = ", ".join(x.topic + ("/<field>" if per_field else "") for x in mqtt_inverters)
             print("Startup complete, now publishing status data every {} seconds to topic(s): {}".format(interval,
                                                                                                          topics))
 
             start_time = time()
             while True:
-                for mqtt_inverter in mqtt_inverters:
-                    status = mqtt_inverter.inverter.status()
-                    message = json.dumps(status,
-                                         cls=DecimalEncoder,
-                                         separators=(',', ':'))  # Compact encoding
-                    client.publish(topic=mqtt_inverter.topic, payload=message)
+                # Request all inverters at once, an inverter that is too late is skipped for this interval
+                statuses = poller.poll(timeout=interval, max_age=_max_age(interval))
+                for mqtt_inverter, status in zip(mqtt_inverters, statuses):
+                    if status is None:
+                        continue
+                    _publish_status(publisher, mqtt_inverter.topic, status, mqtt_inverter.filter)
 
                 # This doesn't suffer from drifting, however it will skip messages when
                 #  a message takes longer than the interval.
                 sleep(interval - ((time() - start_time) % interval))
         finally:
             # Disconnect MQTT on exception
+            publisher.close()
             client.disconnect()
+            client.loop_stop()
+            poller.close()
+            print("Published {} messages, {} acknowledged, {} queued, {} dropped".format(
+                publisher.published, publisher.acked, publisher.queued, publisher.dropped))
+
+
+def _publish_status(publisher: BufferedPublisher, topic: str, status: Dict, status_filter: DeadbandFilter = None):
+    """Publishes status as JSON, or the changed fields separately when a filter is given."""
+    if status_filter:
+        for field, value in status_filter.filter(status).items():
+            publisher.publish("{}/{}".format(topic, field), str(value))
+        return
+    message = json.dumps(status,
+                         cls=DecimalEncoder,
+                         separators=(',', ':'))  # Compact encoding
+    publisher.publish(topic, message)
+
+
+PVOutputSystem = namedtuple("PVOutputSystem", ["system_id", "api_key", "serial_numbers"])
+
+
+def _parse_systems(ctx, param, value, serials_required: bool = True) -> List[PVOutputSystem]:
+    """Click callback that parses SYSTEM_ID:API_KEY:SERIAL,... system options.
+
+    Without serials_required, the serial numbers may be left out, the system
+    then gets all inverters.
+    """
+    systems = []
+    for option in value:
+        parts = option.split(':')
+        if len(parts) not in ((3,) if serials_required else (2, 3)) or not parts[0].isdigit() or not all(parts[1:]):
+            raise click.BadParameter("should be {}, got {}".format(param.metavar, option))
+        systems.append(PVOutputSystem(parts[0], parts[1], tuple(parts[2].split(',')) if len(parts) == 3 else None))
+    return systems
+
+
+def _create_uploaders(systems: List[PVOutputSystem], queue_file: Optional[str], batch_size: int,
+                      rate_limit: int) -> List[StatusUploader]:
+    """Returns an uploader for each PVOutput system, systems with the same API key share the request budget."""
+    budgets = {}
+    uploaders = []
+    for s in systems:
+        budget = budgets.setdefault(s.api_key, RequestBudget(rate_limit))
+        client = PVOutputClient(s.system_id, s.api_key, budget=budget)
+        queue = StatusQueue(queue_file or ':memory:', name='system_{}'.format(s.system_id))
+        uploaders.append(StatusUploader(client, queue, batch_size=batch_size))
+    return uploaders
+
+
+def _resolve_systems(system_id, api_key, systems: List[PVOutputSystem]) -> List[PVOutputSystem]:
+    """Returns all systems, including the system from the arguments which gets all inverters."""
+    if system_id and api_key:
+        return [PVOutputSystem(system_id, api_key, None)] + systems
+    if system_id or not systems:
+        raise click.UsageError("Specify SYSTEM_ID and API_KEY, or --system")
+    return systems
+
+
+def _connect_serial_numbers(systems: List[PVOutputSystem], serial_numbers: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Returns the serial numbers of the inverters to connect to.
+
+    These are the inverters of all systems, unless there is a system that
+    gets all inverters. In that case the given serial numbers are returned.
+    """
+    if all(s.serial_numbers for s in systems):
+        return tuple(OrderedDict.fromkeys(sn for s in systems for sn in s.serial_numbers))
+    return serial_numbers
+
+
+def _system_statuses(system: PVOutputSystem, statuses: List[Optional[Dict]], serial_numbers: List[str]) -> List[Dict]:
+    """Returns the statuses of the inverters of a system, leaving out inverters that did not respond."""
+    return [status for status, serial_number in zip(statuses, serial_numbers)
+            if status is not None and (not system.serial_numbers or serial_number in system.serial_numbers)]
 
 
 @cli.command()
-@click.argument('system-id')
-@click.argument('api-key')
+@click.argument('system-id', required=False)
+@click.argument('api-key', required=False)
 @click.option('-n', help="Connect to n inverters.", type=int, default=1, show_default=True)
 @click.option('--dc-voltage',
               is_flag=True,
@@ -218,15 +393,34 @@ def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, pa
                    "If not specified, only does a single upload.")
 @click.option('--dry-run', is_flag=True, default=False, help="Do not upload data to PVOutput.org.")
 @click.option('--interface', default='', help="IP address of local network interface to bind to.")
-def pvoutput(system_id, api_key, interface, n: int, dc_voltage: bool, interval: int, dry_run: bool):
+@click.option('--serial', 'serial_numbers', multiple=True,
+              help="Only connect to the inverter with this serial number, can be given multiple times. "
+                   "Overrides -n.")
+@click.option('--queue', 'queue_file',
+              type=click.Path(dir_okay=False),
+              help="File to keep statuses in that are not yet uploaded, e.g. during a network outage.")
+@click.option('--batch-size',
+              default=30,
+              help="Maximum number of statuses per upload, 100 is allowed in donation mode.",
+              show_default=True)
+@click.option('--rate-limit',
+              default=60,
+              help="Maximum number of uploads per hour for each API key, 300 is allowed in donation mode.",
+              show_default=True)
+@click.option('--system', 'systems', multiple=True, metavar='SYSTEM_ID:API_KEY:SERIAL[,SERIAL...]',
+              callback=_parse_systems,
+              help="Upload the inverters with these serial numbers to another PVOutput system. Can be given "
+                   "multiple times.")
+def pvoutput(system_id, api_key, interface, n: int, dc_voltage: bool, interval: int, dry_run: bool,
+             serial_numbers, queue_file: str, batch_size: int, rate_limit: int, systems: List[PVOutputSystem]):
     """Upload inverter status to a PVOutput.org system.
 
     Specify the PVOutput system using the SYSTEM_ID and API_KEY arguments. The
     command will connect to the inverter, upload the current status data and
     exit. Use something like cron to upload status data every 5 minutes.
 
-    If you have multiple inverters, specify -n with the number of inverters.
-    Data of all inverters will be aggregated before uploading to
+    If you have multiple inverters, specify -n with the number of inverters
+    or --serial for each inverter. Data of all inverters will be aggregated before uploading to
     PVOutput, energy is summed, voltage and temperature are averaged. For
     temperature, the internal temperature is used, not the heatsink
     temperature. If the inverter uses three phases, the voltage of each phase
@@ -237,25 +431,53 @@ def pvoutput(system_id, api_key, interface, n: int, dc_voltage: bool, interval:
     This mode is not recommended. The application will stay connected to the
     inverters in between uploads and will crash when the connection is lost,
     thus you need a restart mechanism such as systemd.
+
+    Statuses are uploaded in batches. When an upload fails, the status is
+    kept and uploaded together with the next status. Specify a file with
+    --queue to keep these statuses across runs, which is needed when using
+    cron.
+
+    To upload groups of inverters to different PVOutput systems, specify
+    each system with --system SYSTEM_ID:API_KEY:SERIAL,SERIAL,... instead of
+    the arguments. The inverters are polled once and the data of each group
+    is uploaded to its system. Systems with the same API key share the
+    request rate limit. The arguments can be combined with --system, in that
+    case all inverters are uploaded to the system from the arguments.
     """
     # Print info messages (at least)
     if logging.root.level > logging.INFO:
         logging.basicConfig(level=logging.INFO)
 
+    systems = _resolve_systems(system_id, api_key, systems)
+    serial_numbers = _connect_serial_numbers(systems, serial_numbers)
+
+    uploaders = _create_uploaders(systems, queue_file, batch_size, rate_limit)
+    scheduler = UploadScheduler(uploaders)
+
     logger.info("Connecting to inverter(s)")
-    with connect_inverters(interface, n) as inverters:
+    with connect_inverters(interface, n, serial_numbers=serial_numbers) as inverters, \
+            StatusPoller(inverters) as poller, ExitStack() as stack:
+        for uploader in uploaders:
+            stack.callback(uploader.client.close)
+            stack.callback(uploader.queue.close)
+        inverter_serials = [inv.serial_number for inv in inverters]
+
         def upload():
             """Uploads status to PVOutput."""
-            # Todo: this should be asynchronous so that multiple inverters can be requested at once
-            status_data = aggregate_statuses([inv.status() for inv in inverters], dc_voltage=dc_voltage)
-            if not status_data:
-                logger.info("Not uploading, no inverter has operating mode normal")
-                return
-
-            # Upload
-            logger.info("Uploading status data: %s", status_data)
+            # All inverters are requested at once, inverters that do not respond in time are left out
+            statuses = poller.poll(max_age=_max_age(interval * 60) if interval else None)
+            now = datetime.now()
+            for system, uploader in zip(systems, uploaders):
+                status_data = aggregate_statuses(_system_statuses(system, statuses, inverter_serials),
+                                                 dc_voltage=dc_voltage)
+                if not status_data:
+                    logger.info("Not uploading to system %s, no inverter has operating mode normal", system.system_id)
+                    continue
+                logger.info("Uploading status data to system %s: %s", system.system_id, status_data)
+                if not dry_run:
+                    uploader.add(now, status_data)
             if not dry_run:
-                add_status(system_id, api_key, **status_data)
+                scheduler.flush()
 
         if not interval:
             # No interval specified, upload once and stop
@@ -270,26 +492,99 @@ def pvoutput(system_id, api_key, interface, n: int, dc_voltage: bool, interval:
             upload()
 
 
-#     # History
-#     parser_history = subparsers.add_parser('history', help='fetch historical generation data from inverter',
-#                                            description='Fetch historical generation data from inverter.')
-#     parser_history.add_argument('start', type=int, help='start year')
-#     parser_history.add_argument('end', type=int, help='end year')
-#     parser_history.add_argument('-i', '--interface', help='bind interface IP (default: all interfaces)', default='')
-#     matcher_group = parser_history.add_mutually_exclusive_group()
-#     matcher_group.add_argument('--serial', help='match only inverter with given serial number', dest='serial_number')
-#     matcher_group.add_argument('--ip', help='match only inverter with given IP address', dest='ip')
-#     parser_history.set_defaults(func=history)
-#
-#     args = parser.parse_args()
-#     # Debug output
-#     if args.debug:
-#         logging.basicConfig(level=logging.DEBUG)
-#
-#     if not args.subcommand:
-#         parser.print_help()
-#         parser.exit()
-#     args.func(args)
+@cli.command()
+@click.option('-n', '--inverters', 'n', default=1, help="Number of inverters.", show_default=True)
+@click.option('-i', '--interval', default=10.0, help="Interval between status polls in seconds.", show_default=True)
+@click.option('--interface', help="IP address of local network interface to bind to.", default='')
+@click.option('--serial', 'serial_numbers', multiple=True,
+              help="Only connect to the inverter with this serial number, can be given multiple times. "
+                   "Overrides -n.")
+@click.option('--address', default='', help="Address for the metrics endpoint, all interfaces by default.")
+@click.option('--port', default=9850, help="Port for the metrics endpoint.", show_default=True)
+def prometheus(n: int, interval: float, interface: str, serial_numbers, address: str, port: int):
+    """Serve inverter data to Prometheus.
+
+    The inverters are polled every interval and the latest status of each
+    inverter is served on http://<address>:<port>/metrics, so that scrapes
+    never cause inverter requests. Besides the status fields, the response
+    contains the poll and request durations and the communication error
+    counts.
+    """
+    metrics = MetricsCollector()
+    cache = StatusCache(metrics)
+    print("Connecting to {} inverter(s)".format(len(serial_numbers) or n))
+    with connect_inverters(interface, n, serial_numbers=serial_numbers, metrics=metrics) as inverters, \
+            StatusPoller(inverters) as poller, MetricsServer(cache, address, port) as server:
+        for inverter in inverters:
+            print("Connected to inverter {} on IP {}".format(inverter.serial_number, inverter.addr))
+        print("Serving metrics on port {}".format(server.server_address[1]))
+
+        start_time = time()
+        while True:
+            # Request all inverters at once, an inverter that is too late keeps its previous status
+            poll_start = time()
+            statuses = poller.poll(timeout=interval, max_age=_max_age(interval))
+            cache.poll_completed(time() - poll_start)
+            for inverter, status in zip(inverters, statuses):
+                if status is None:
+                    cache.missed(inverter.serial_number)
+                else:
+                    cache.update(inverter.serial_number, status, time())
+            sleep(interval - ((time() - start_time) % interval))
+
+
+@cli.command()
+@click.option('-n', '--inverters', 'n', default=1, help="Number of inverters.", show_default=True)
+@click.option('--interface', help="IP address of local network interface to bind to.", default='')
+@click.option('--serial', 'serial_numbers', multiple=True,
+              help="Only connect to the inverter with this serial number, can be given multiple times. "
+                   "Overrides -n.")
+@click.option('--address', default='127.0.0.1', help="Address to listen on for clients.", show_default=True)
+@click.option('--port', default=1201, help="Port for the first inverter, the next inverters get the next ports.",
+              show_default=True)
+@click.option('--socket-dir', type=click.Path(file_okay=False),
+              help="Listen on Unix socket <serial number>.sock in this directory instead of TCP, not on Windows.")
+@click.option('--max-age', default=5.0, help="Time in seconds that a status response is reused.", show_default=True)
+def proxy(n: int, interface: str, serial_numbers, address: str, port: int, socket_dir: Optional[str],
+          max_age: float):
+    """Share inverter connections between multiple clients.
+
+    An inverter accepts only one connection. This command connects to the
+    inverters and lets local clients talk to them through a TCP port or Unix
+    socket per inverter, using the inverter protocol. Use for instance
+    'samil monitor --proxy 127.0.0.1:1201' while another program is
+    collecting data through the proxy.
+
+    Model, status format and status requests of multiple clients are
+    combined. The model and status format are requested once and the status
+    is reused for --max-age seconds, so that more clients do not cause more
+    inverter requests.
+
+    The command stops when an inverter connection is lost, use systemd or
+    Docker to restart on failure.
+    """
+    if socket_dir and not UNIX_SOCKETS:
+        raise click.ClickException("Unix sockets are not supported on this platform, use --address and --port")
+    if logging.root.level > logging.INFO:
+        logging.basicConfig(level=logging.INFO)
+
+    logger.info("Connecting to %s inverter(s)", len(serial_numbers) or n)
+    with connect_inverters(interface, n, serial_numbers=serial_numbers) as inverters, ExitStack() as stack:
+        servers = []
+        for i, inverter in enumerate(sorted(inverters, key=lambda x: x.serial_number)):
+            if socket_dir:
+                from samil.proxy import UnixProxyServer  # Not defined on platforms without Unix sockets
+                server = UnixProxyServer(InverterProxy(inverter, max_age),
+                                         os.path.join(socket_dir, inverter.serial_number + '.sock'))
+            else:
+                server = ProxyServer(InverterProxy(inverter, max_age), (address, port + i))
+            servers.append(stack.enter_context(server))
+            logger.info("Serving inverter %s on %s", inverter.serial_number, server.server_address)
+
+        # A failed keep-alive also stops the keep-alive messages
+        while not any(s.error for s in servers) and all(i.scheduler.is_registered(i) for i in inverters):
+            sleep(1.0)
+        raise click.ClickException("Inverter connection failed, stopping")
 
 
 @cli.command()
@@ -299,7 +594,33 @@ def pvoutput(system_id, api_key, interface, n: int, dc_voltage: bool, interval:
 @click.option('--interface', default='', help="IP address of local network interface to bind to.")
 @click.option('--gzip', is_flag=True, default=False, help="Use GZip compression for the InfluxDB writes.")
 @click.option('--measurement', default='samil', help="InfluxDB measurement name.", show_default=True)
-def influx(bucket: str, c: str, interval: float, interface: str, gzip: bool, measurement: str):
+@click.option('-n', '--inverters', 'n', default=1, help="Number of inverters.", show_default=True)
+@click.option('--serial', 'serial_numbers', multiple=True,
+              help="Only connect to the inverter with this serial number, can be given multiple times. "
+                   "Overrides -n.")
+@click.option('--batch-size', default=100, help="Maximum number of points per write.", show_default=True)
+@click.option('--flush-interval',
+              default=10.0,
+              help="Maximum time in seconds that a point waits before it is written.",
+              show_default=True)
+@click.option('--queue-size',
+              default=10000,
+              help="Maximum number of points waiting to be written, the oldest points are dropped when full.",
+              show_default=True)
+@click.option('--spool-dir',
+              type=click.Path(file_okay=False),
+              help="Directory to store points in while the database is unreachable.")
+@click.option('--spool-size',
+              default=100,
+              help="Maximum size of the spool directory in MB, the oldest points are dropped when full.",
+              show_default=True)
+@click.option('--replay-interval',
+              default=1.0,
+              help="Minimum time in seconds between writes of spooled points, each write is about 1 MB.",
+              show_default=True)
+def influx(bucket: str, c: str, interval: float, interface: str, gzip: bool, measurement: str, n: int,
+           serial_numbers, batch_size: int, flush_interval: float, queue_size: int, spool_dir: str, spool_size: int,
+           replay_interval: float):
     """Writes system status data to an InfluxDB database.
 
     The InfluxDB instance can be specified using environment variables or a
@@ -309,13 +630,21 @@ def influx(bucket: str, c: str, interval: float, interface: str, gzip: bool, mea
     write to in the BUCKET argument. Each measurement will have the name
     'samil' by default.
 
-    Do you have multiple inverters? This command only supports 1 inverter
-    because I am lazy and only need 1, but if you need more, create an issue on
-    the GitHub project page. It is trivial to add.
+    If you have multiple inverters, specify -n with the number of inverters,
+    or --serial for each inverter. All inverters are requested at once and each point gets a serial_number
+    tag. With a single inverter no tag is added.
+
+    Points are written in batches from a background thread, so a slow
+    database does not delay the inverter polling. Failed writes are retried
+    with increasing delay, after 5 retries the batch is dropped.
+
+    To not lose points during a database outage, specify a spool directory
+    with --spool-dir. Points that can't be written are then stored on disk,
+    also across restarts, and written when the database is reachable again.
 
     This command has no built-in restart mechanism and will crash for instance
-    when the Influx or inverter connection is lost. This is again because I am
-    lazy, use systemd or Docker to restart on failure.
+    when the inverter connection is lost. This is because I am lazy, use
+    systemd or Docker to restart on failure.
 
     Status is not written when the inverter is powered off at night.
     """
@@ -328,18 +657,348 @@ def influx(bucket: str, c: str, interval: float, interface: str, gzip: bool, mea
     else:
         client = InfluxDBClient.from_env_properties(enable_gzip=gzip)
     write_client = client.write_api(write_options=SYNCHRONOUS)
+    writer = BatchWriter(lambda lines: write_client.write(bucket=bucket, record=b'\n'.join(lines)),
+                         batch_size=batch_size,
+                         flush_interval=flush_interval,
+                         queue_size=queue_size,
+                         spool=Spool(spool_dir, max_size=spool_size * 1000000) if spool_dir else None,
+                         replay_interval=replay_interval)
 
-    logger.info("Connecting to inverter")
-    with connect_inverters(interface, 1) as inverters:
-        inv = inverters[0]  # type: KeepAliveInverter
+    logger.info("Connecting to inverter(s)")
+    with writer, connect_inverters(interface, n, serial_numbers=serial_numbers) as inverters, \
+            StatusPoller(inverters) as poller:
+        if len(inverters) > 1:
+            tags = [{'serial_number': inv.serial_number} for inv in inverters]
+        else:
+            tags = [None]
+        encoders = [LineProtocolEncoder(measurement, tags=t) for t in tags]
 
         logger.info("Startup complete, will write every %s seconds to bucket %s with measurement name %s",
                     interval, bucket, measurement)
         start = time()
         while True:
-            p = status_to_point(measurement, inv.status())
-            logger.debug("Writing point: %s", p)
-            if p:
-                write_client.write(bucket=bucket, record=p)
+            timestamp = datetime.now(timezone.utc)
+            for status, encoder in zip(poller.poll(timeout=interval, max_age=_max_age(interval)), encoders):
+                if status is None:
+                    continue
+                line = encoder.encode(status, timestamp)
+                logger.debug("Writing line: %s", line)
+                if line:
+                    writer.write(line)
             # Sleep until the next interval boundary
             sleep(interval - (time() - start) % interval)
+
+
+class _MQTTSink(Sink):
+    """Publishes statuses to MQTT like the mqtt command."""
+
+    name = 'mqtt'
+
+    def __init__(self, publisher: BufferedPublisher, topic_prefix: str, per_field: bool, deadbands: Dict[str, Decimal],
+                 refresh: int):
+        """Constructor."""
+        self.publisher = publisher
+        self.topic_prefix = topic_prefix
+        self.per_field = per_field
+        self.deadbands = deadbands
+        self.refresh = refresh
+        self._filters = {}  # type: Dict[str, DeadbandFilter]  # By serial number
+
+    def handle(self, sample: Sample):
+        """See base class."""
+        for serial_number, status in sample.statuses.items():
+            if status is None:
+                continue
+            if not self.per_field:
+                _publish_status(self.publisher, "{}/{}/status".format(self.topic_prefix, serial_number), status)
+                continue
+            if serial_number not in self._filters:
+                self._filters[serial_number] = DeadbandFilter(self.deadbands, refresh_interval=self.refresh)
+            _publish_status(self.publisher, "{}/{}".format(self.topic_prefix, serial_number), status,
+                            self._filters[serial_number])
+
+
+class _InfluxSink(Sink):
+    """Writes statuses to InfluxDB like the influx command."""
+
+    name = 'influx'
+
+    def __init__(self, writer: BatchWriter, measurement: str, serial_numbers: List[str]):
+        """Constructor, the points get a serial_number tag when there are multiple inverters."""
+        self.writer = writer
+        self._encoders = {sn: LineProtocolEncoder(measurement,
+                                                  tags={'serial_number': sn} if len(serial_numbers) > 1 else None)
+                          for sn in serial_numbers}
+
+    def handle(self, sample: Sample):
+        """See base class."""
+        for serial_number, status in sample.statuses.items():
+            if status is None:
+                continue
+            line = self._encoders[serial_number].encode(status, sample.time)
+            if line:
+                self.writer.write(line)
+
+
+class _PVOutputSink(Sink):
+    """Uploads aggregated statuses to PVOutput.org systems on each interval boundary."""
+
+    name = 'pvoutput'
+
+    def __init__(self, systems: List[PVOutputSystem], interval: int, dc_voltage: bool, queue_file: Optional[str],
+                 batch_size: int, rate_limit: int):
+        """Constructor, interval is in minutes."""
+        self.systems = systems
+        self.interval = interval * 60
+        self.dc_voltage = dc_voltage
+        self.queue_file = queue_file
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.uploaders = []  # type: List[StatusUploader]
+        self._scheduler = None  # type: Optional[UploadScheduler]
+        self._period = None  # type: Optional[int]
+
+    def open(self):
+        """Creates the uploaders, their SQLite queues can only be used in this thread."""
+        self.uploaders = _create_uploaders(self.systems, self.queue_file, self.batch_size, self.rate_limit)
+        self._scheduler = UploadScheduler(self.uploaders)
+        # The first upload is at the next interval boundary
+        self._period = int(time() // self.interval)
+
+    def handle(self, sample: Sample):
+        """Uploads the first sample of each interval."""
+        period = int(sample.time.timestamp() // self.interval)
+        if period == self._period:
+            return
+        self._period = period
+        statuses = list(sample.statuses.values())
+        serial_numbers = list(sample.statuses)
+        date = sample.time.astimezone().replace(tzinfo=None)  # PVOutput.org uses local time
+        for system, uploader in zip(self.systems, self.uploaders):
+            status_data = aggregate_statuses(_system_statuses(system, statuses, serial_numbers),
+                                             dc_voltage=self.dc_voltage)
+            if not status_data:
+                logger.info("Not uploading to system %s, no inverter has operating mode normal", system.system_id)
+                continue
+            logger.info("Uploading status data to system %s: %s", system.system_id, status_data)
+            uploader.add(date, status_data)
+        self._scheduler.flush()
+
+    def close(self):
+        """Closes the clients and queues."""
+        for uploader in self.uploaders:
+            uploader.client.close()
+            uploader.queue.close()
+
+
+class _PrometheusSink(Sink):
+    """Stores statuses in the cache that is served to Prometheus."""
+
+    name = 'prometheus'
+
+    def __init__(self, cache: StatusCache):
+        """Constructor."""
+        self.cache = cache
+
+    def handle(self, sample: Sample):
+        """See base class."""
+        for serial_number, status in sample.statuses.items():
+            if status is None:
+                self.cache.missed(serial_number)
+            else:
+                self.cache.update(serial_number, status, sample.time.timestamp())
+
+
+class _StoreSink(Sink):
+    """Stores statuses in the local time series store."""
+
+    name = 'store'
+
+    def __init__(self, directory: str, retention: Optional[timedelta]):
+        """Constructor."""
+        self.directory = directory
+        self.retention = retention
+        self.store = None  # type: Optional[TimeSeriesStore]
+
+    def open(self):
+        """See base class."""
+        self.store = TimeSeriesStore(self.directory, retention=self.retention)
+
+    def handle(self, sample: Sample):
+        """See base class."""
+        for serial_number, status in sample.statuses.items():
+            if status is None:
+                continue
+            try:
+                self.store.append(serial_number, sample.time, status)
+            except ValueError as e:
+                logger.warning("Not storing sample: %s", e)
+
+    def close(self):
+        """See base class."""
+        self.store.close()
+
+
+def _start_mqtt(stack: ExitStack, host: str, port: int, client_id: str, tls: bool, username: str, password: str,
+                interface: str, qos: int, queue_size: int, spool_dir: Optional[str],
+                max_rate: float) -> BufferedPublisher:
+    """Connects to the MQTT broker in the background and returns the publisher, which is closed by the stack.
+
+    The arguments are the options of the mqtt command.
+    """
+    client = MQTTClient(client_id=client_id)
+    if tls:
+        client.tls_set()
+    if username:
+        client.username_pw_set(username, password)
+    publisher = BufferedPublisher(client,
+                                  qos=qos,
+                                  queue_size=queue_size,
+                                  spool=Spool(spool_dir) if spool_dir else None,
+                                  max_rate=max_rate)
+    client.connect_async(host=host, port=port, bind_address=interface or '')
+    client.loop_start()
+    stack.callback(client.loop_stop)
+    stack.callback(client.disconnect)
+    stack.callback(publisher.close)
+    return publisher
+
+
+def _start_influx(stack: ExitStack, bucket: str, config: Optional[str], gzip: bool,
+                  spool_dir: Optional[str]) -> BatchWriter:
+    """Returns a writer for the InfluxDB bucket, which is closed by the stack."""
+    if config:
+        client = InfluxDBClient.from_config_file(config, enable_gzip=gzip)
+    else:
+        client = InfluxDBClient.from_env_properties(enable_gzip=gzip)
+    write_client = client.write_api(write_options=SYNCHRONOUS)
+    return stack.enter_context(BatchWriter(lambda lines: write_client.write(bucket=bucket, record=b'\n'.join(lines)),
+                                           spool=Spool(spool_dir) if spool_dir else None))
+
+
+@cli.command()
+@click.option('-n', '--inverters', 'n', default=1, help="Number of inverters.", show_default=True)
+@click.option('-i', '--interval', default=10.0, help="Interval between status polls in seconds.", show_default=True)
+@click.option('--interface', default='', help="IP address of local network interface to bind to.")
+@click.option('--serial', 'serial_numbers', multiple=True,
+              help="Only connect to the inverter with this serial number, can be given multiple times. "
+                   "Overrides -n.")
+@click.option('--queue-size',
+              default=100,
+              help="Maximum number of polls waiting for each output, the oldest are dropped when full.",
+              show_default=True)
+@click.option('--mqtt-host', help="MQTT broker hostname or IP, enables publishing to MQTT.")
+@click.option('--mqtt-port', default=1883, help="MQTT broker port.", show_default=True)
+@click.option('--mqtt-client-id', default='', help="MQTT client ID. If not provided, one will be randomly generated.")
+@click.option('--mqtt-tls', is_flag=True, default=False, help="Enable MQTT SSL/TLS support.")
+@click.option('--mqtt-username', help="MQTT username.")
+@click.option('--mqtt-password', help="MQTT password.")
+@click.option('--mqtt-topic-prefix', default='inverter', help="MQTT topic prefix.", show_default=True)
+@click.option('--mqtt-per-field', is_flag=True, default=False,
+              help="Publish each status field to a separate topic, see the mqtt command.")
+@click.option('--mqtt-deadband', 'mqtt_deadbands', multiple=True, metavar='FIELD=VALUE', callback=_parse_deadbands,
+              help="Minimum change before a field is published with --mqtt-per-field, see the mqtt command.")
+@click.option('--mqtt-refresh', default=60, help="Publish all fields every this many intervals with --mqtt-per-field.",
+              show_default=True)
+@click.option('--mqtt-qos', type=click.IntRange(0, 2), default=0, help="MQTT QoS level.", show_default=True)
+@click.option('--mqtt-queue-size', default=10000,
+              help="Maximum number of messages kept in memory while disconnected from the broker.", show_default=True)
+@click.option('--mqtt-spool-dir', type=click.Path(file_okay=False),
+              help="Directory to store messages in when the memory queue is full. If not given, the oldest "
+                   "messages are dropped.")
+@click.option('--mqtt-max-rate', default=50.0,
+              help="Maximum number of queued messages per second that is published after reconnecting.",
+              show_default=True)
+@click.option('--influx-bucket', help="InfluxDB bucket, enables writing to InfluxDB.")
+@click.option('--influx-config', help="InfluxDB client configuration file, otherwise environment variables are used.")
+@click.option('--influx-measurement', default='samil', help="InfluxDB measurement name.", show_default=True)
+@click.option('--influx-gzip', is_flag=True, default=False, help="Use GZip compression for the InfluxDB writes.")
+@click.option('--influx-spool-dir', type=click.Path(file_okay=False),
+              help="Directory to store points in while the database is unreachable.")
+@click.option('--pvoutput', 'pvoutput_systems', multiple=True, metavar='SYSTEM_ID:API_KEY[:SERIAL,...]',
+              callback=partial(_parse_systems, serials_required=False),
+              help="Upload to this PVOutput.org system, only the given inverters when serial numbers are given. "
+                   "Can be given multiple times.")
+@click.option('--pvoutput-interval', default=5,
+              help="Interval between PVOutput.org uploads in minutes, should be 5, 10 or 15.", show_default=True)
+@click.option('--pvoutput-dc-voltage', is_flag=True, default=False, help="Upload DC voltage instead of AC voltage.")
+@click.option('--pvoutput-queue', type=click.Path(dir_okay=False),
+              help="File to keep statuses in that are not yet uploaded.")
+@click.option('--pvoutput-batch-size', default=30, help="Maximum number of statuses per upload.", show_default=True)
+@click.option('--pvoutput-rate-limit', default=60, help="Maximum number of uploads per hour for each API key.",
+              show_default=True)
+@click.option('--prometheus-port', type=int, help="Serve metrics to Prometheus on this port.")
+@click.option('--store', 'store_dir', type=click.Path(file_okay=False),
+              help="Keep all statuses in a local time series store in this directory.")
+@click.option('--store-retention', type=int, help="Number of days to keep in the local store, forever if not given.")
+def run(n: int, interval: float, interface: str, serial_numbers, queue_size: int, mqtt_host, mqtt_port: int,
+        mqtt_client_id: str, mqtt_tls: bool, mqtt_username, mqtt_password, mqtt_topic_prefix: str,
+        mqtt_per_field: bool, mqtt_deadbands, mqtt_refresh: int, mqtt_qos: int, mqtt_queue_size: int, mqtt_spool_dir,
+        mqtt_max_rate: float, influx_bucket, influx_config, influx_measurement: str, influx_gzip: bool,
+        influx_spool_dir, pvoutput_systems: List[PVOutputSystem], pvoutput_interval: int, pvoutput_dc_voltage: bool,
+        pvoutput_queue, pvoutput_batch_size: int, pvoutput_rate_limit: int, prometheus_port: Optional[int],
+        store_dir: Optional[str], store_retention: Optional[int]):
+    """Poll inverters once and send the data to multiple outputs.
+
+    An inverter accepts only one connection, so the mqtt, influx and
+    pvoutput commands can't run at the same time. This command connects to
+    the inverters once, polls them every interval and sends each status to
+    all enabled outputs: MQTT (--mqtt-host), InfluxDB (--influx-bucket),
+    PVOutput.org (--pvoutput), Prometheus (--prometheus-port) and a local
+    store (--store). The options work like those of the separate commands.
+
+    The local store keeps the statuses in files per inverter and day, which
+    can be read using samil.store.TimeSeriesStore. A status takes 61 bytes,
+    about 190 MB per inverter per year at a 10 second interval.
+
+    Each output has its own queue and thread, so a slow or unreachable
+    output does not delay the polling or the other outputs.
+
+    This command has no built-in restart mechanism and will crash when the
+    inverter connection is lost, use systemd or Docker to restart on failure.
+    """
+    if logging.root.level > logging.INFO:
+        logging.basicConfig(level=logging.INFO)
+    if not (mqtt_host or influx_bucket or pvoutput_systems or prometheus_port or store_dir):
+        raise click.UsageError("Enable at least one output: --mqtt-host, --influx-bucket, --pvoutput, "
+                               "--prometheus-port or --store")
+
+    metrics = MetricsCollector() if prometheus_port else None
+    logger.info("Connecting to %s inverter(s)", len(serial_numbers) or n)
+    with connect_inverters(interface, n, serial_numbers=serial_numbers, metrics=metrics) as inverters, \
+            StatusPoller(inverters) as poller, ExitStack() as stack:
+        inverter_serials = [inv.serial_number for inv in inverters]
+        logger.info("Connected to inverter(s) %s", ', '.join(inverter_serials))
+
+        sinks = []
+        cache = None
+        if mqtt_host:
+            publisher = _start_mqtt(stack, mqtt_host, mqtt_port, mqtt_client_id, mqtt_tls, mqtt_username,
+                                    mqtt_password, interface, mqtt_qos, mqtt_queue_size, mqtt_spool_dir, mqtt_max_rate)
+            sinks.append(_MQTTSink(publisher, mqtt_topic_prefix, mqtt_per_field, mqtt_deadbands, mqtt_refresh))
+        if influx_bucket:
+            writer = _start_influx(stack, influx_bucket, influx_config, influx_gzip, influx_spool_dir)
+            sinks.append(_InfluxSink(writer, influx_measurement, inverter_serials))
+        if pvoutput_systems:
+            sinks.append(_PVOutputSink(pvoutput_systems, pvoutput_interval, pvoutput_dc_voltage, pvoutput_queue,
+                                       pvoutput_batch_size, pvoutput_rate_limit))
+        if prometheus_port:
+            cache = StatusCache(metrics)
+            stack.enter_context(MetricsServer(cache, port=prometheus_port))
+            sinks.append(_PrometheusSink(cache))
+        if store_dir:
+            sinks.append(_StoreSink(store_dir, timedelta(days=store_retention) if store_retention else None))
+        # Closed first, so that the queued polls are delivered before the outputs close
+        fanout = stack.enter_context(FanOut(sinks, queue_size=queue_size))
+
+        logger.info("Startup complete, polling every %s seconds for output(s) %s", interval,
+                    ', '.join(s.name for s in sinks))
+        start = time()
+        while True:
+            # Request all inverters at once, an inverter that is too late is None in the sample
+            timestamp = datetime.now(timezone.utc)
+            statuses = poller.poll(timeout=interval, max_age=_max_age(interval))
+            if cache is not None:
+                cache.poll_completed((datetime.now(timezone.utc) - timestamp).total_seconds())
+            fanout.put(Sample(timestamp, OrderedDict(zip(inverter_serials, statuses))))
+            sleep(interval - (time() - start) % interval)
@@ -1,29 +1,164 @@
 """Utility functions for writing to InfluxDB."""
-from typing import Dict, Optional
+from datetime import datetime, timezone
+from decimal import Decimal
+from math import isfinite
+from typing import Dict, Optional, Iterable, Tuple, Union
 
 from influxdb_client import Point
 
+# Sometimes the inverter might return a value of 0 when no value is available
+# for a field, for instance when the inverter is powered off. Fields in this
+# set are filtered out when they have a value of 0, because that does not
+# make sense.
+ZERO_MEANS_UNAVAILABLE = frozenset({
+    'pv1_voltage', 'pv2_voltage', 'grid_voltage', 'grid_frequency',
+    'internal_temperature', 'heatsink_temperature',
+    'grid_voltage_r_phase', 'grid_voltage_s_phase', 'grid_voltage_t_phase',
+    'grid_frequency_r_phase', 'grid_frequency_s_phase', 'grid_frequency_t_phase',
+})
 
-def status_to_point(measurement_name: str, status: Dict) -> Optional[Point]:
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Escape tables, the same as used by influxdb_client
+_ESCAPE_MEASUREMENT = str.maketrans({',': r'\,', ' ': r'\ ', '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+_ESCAPE_KEY = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+_ESCAPE_STRING = str.maketrans({'"': r'\"', '\\': r'\\'})
+
+
+def status_to_point(measurement_name: str, status: Dict, tags: Dict = None,
+                    timestamp: datetime = None) -> Optional[Point]:
     """Returns a Point structure from inverter status data.
 
     Returns None when the inverter is powered off.
+
+    Args:
+        measurement_name: The measurement name.
+        status: Inverter status as returned by Inverter.status().
+        tags: Optional tags to add to the point.
+        timestamp: Optional time of the point, when not given the server
+            will use the time of writing.
     """
     if status['operation_mode'] == 'PV power off':
         # Do not write at night
         return None
     p = Point(measurement_name)
+    for k, v in (tags or {}).items():
+        p.tag(k, v)
+    if timestamp:
+        p.time(timestamp)
     for k, v in status.items():
-        # Sometimes the inverter might return a value of 0 when no value is
-        # available for a field, for instance when the inverter is powered off.
-        # I filter out fields if they have a value of 0 while that does not
-        # make sense.
-        if k in {
-            'pv1_voltage', 'pv2_voltage', 'grid_voltage', 'grid_frequency',
-            'internal_temperature', 'heatsink_temperature',
-            'grid_voltage_r_phase', 'grid_voltage_s_phase', 'grid_voltage_t_phase',
-            'grid_frequency_r_phase', 'grid_frequency_s_phase', 'grid_frequency_t_phase'
-        } and not v:
+        if k in ZERO_MEANS_UNAVAILABLE and not v:
             continue
         p.field(k, v)
     return p
+
+
+class LineProtocolEncoder:
+    """Encodes inverter status data directly to InfluxDB line protocol.
+
+    Faster alternative for status_to_point when writing many points. The
+    measurement name and tags are escaped once on construction and escaped
+    field keys are cached. The output is the same as the line protocol of
+    the Point returned by status_to_point.
+    """
+
+    def __init__(self, measurement_name: str, tags: Dict = None):
+        """Constructor.
+
+        Args:
+            measurement_name: The measurement name.
+            tags: Optional tags to add to each line.
+        """
+        prefix = str(measurement_name).translate(_ESCAPE_MEASUREMENT)
+        for k, v in sorted((tags or {}).items()):
+            if v is None:
+                continue
+            key = str(k).translate(_ESCAPE_KEY)
+            value = str(v).translate(_ESCAPE_KEY)
+            if value.endswith('\\'):
+                value += ' '
+            if key and value:
+                prefix += ',{}={}'.format(key, value)
+        self._prefix = prefix + ' '
+        self._keys = {}  # Field name to escaped key followed by '='
+
+    def encode(self, status: Dict, timestamp: Union[datetime, int] = None) -> Optional[bytes]:
+        """Returns a single line for the status data, without newline.
+
+        Returns None when the inverter is powered off or when there are no
+        fields to write.
+
+        Args:
+            status: Inverter status as returned by Inverter.status().
+            timestamp: Optional time of the line, as datetime or as integer
+                nanoseconds since epoch. Naive datetimes are taken as UTC.
+        """
+        line = self._encode(status, timestamp)
+        return line.encode() if line else None
+
+    def encode_many(self, samples: Iterable[Tuple[Dict, Union[datetime, int, None]]]) -> bytes:
+        """Encodes multiple status samples into one newline separated buffer.
+
+        Samples that would not give a line are left out.
+
+        Args:
+            samples: Iterable of status and timestamp pairs, see encode.
+        """
+        lines = [self._encode(status, timestamp) for status, timestamp in samples]
+        return '\n'.join(line for line in lines if line).encode()
+
+    def _encode(self, status: Dict, timestamp) -> Optional[str]:
+        """Returns the line as string, see encode."""
+        if status['operation_mode'] == 'PV power off':
+            # Do not write at night
+            return None
+        keys = self._keys
+        fields = []
+        for k in sorted(status):
+            v = status[k]
+            if v is None or (k in ZERO_MEANS_UNAVAILABLE and not v):
+                continue
+            try:
+                key = keys[k]
+            except KeyError:
+                key = keys[k] = str(k).translate(_ESCAPE_KEY) + '='
+            value = _format_value(k, v)
+            if value is not None:
+                fields.append(key + value)
+        if not fields:
+            return None
+        line = self._prefix + ','.join(fields)
+        if timestamp is not None:
+            line += ' ' + str(timestamp_to_ns(timestamp))
+        return line
+
+
+def _format_value(name: str, v) -> Optional[str]:
+    """Returns the line protocol field value, or None if it can't be written."""
+    t = type(v)
+    if t is Decimal or t is float:
+        if not isfinite(v):
+            return None
+        s = str(v)
+        # Trim the trailing '.0' of whole numbers, like influxdb_client does
+        return s[:-2] if s.endswith('.0') else s
+    elif t is int:
+        return str(v) + 'i'
+    elif t is bool:
+        return 'true' if v else 'false'
+    elif t is str:
+        return '"' + v.translate(_ESCAPE_STRING) + '"'
+    raise ValueError('Type {} of field {} is not supported'.format(t, name))
+
+
+def timestamp_to_ns(timestamp: Union[datetime, int]) -> int:
+    """Returns the timestamp as integer nanoseconds since epoch.
+
+    Integers are returned as is, naive datetimes are taken as UTC.
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
@@ -1,14 +1,21 @@
 """Communicate with Samil Power inverters."""
 
+import heapq
 import logging
 import socket
 import sys
-from collections import OrderedDict
-from threading import Event, Thread
-from time import sleep
-from typing import Tuple, Dict, BinaryIO, Any, Optional
-
-from samil.statustypes import status_types
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from itertools import count
+from struct import Struct
+from threading import Condition, RLock, Thread
+from time import sleep, monotonic
+from typing import Tuple, Dict, BinaryIO, Any, Optional, Callable, Sequence, List, Iterator
+
+from samil.metrics import Metrics
+from samil.recorder import FrameRecorder
+from samil.statustypes import get_status_decoder
 
 logger = logging.getLogger(__name__)
 
@@ -28,16 +35,37 @@ class Inverter:
     # Caches the format for inverter status messages
     _status_format = None
 
-    def __init__(self, sock: socket, addr):
+    # Time of arrival (time.monotonic) and payload of the most recent status response
+    last_status = None  # type: Optional[Tuple[float, bytes]]
+
+    # Serial number of the inverter, set when the model is requested
+    serial_number = None  # type: Optional[str]
+
+    # Most recent model information, set when the model is requested
+    last_model = None  # type: Optional[Dict]
+
+    def __init__(self, sock: socket, addr, max_framing_errors: Optional[int] = 10, recorder: FrameRecorder = None,
+                 metrics: Metrics = None):
         """Constructor.
 
         Args:
             sock: The inverter socket, which is assumed to be connected.
             addr: The inverter network address (currently not used).
+            max_framing_errors: Number of consecutive invalid messages that
+                are skipped before giving up, see FrameParser. With None,
+                the first invalid message raises an exception.
+            recorder: Optional recorder that logs all sent and received
+                data, e.g. to reproduce issues with ReplaySocket.
+            metrics: Optional receiver of round-trip times and other
+                measurements of the communication.
         """
         self.sock = sock
         self.sock_file = sock.makefile('rwb')
         self.addr = addr
+        self.parser = FrameParser(max_errors=max_framing_errors)
+        self.recorder = recorder
+        self.metrics = metrics
+        self._recv_into = sock.recv_into if recorder is None else recorder.wrap_recv_into(sock.recv_into)
         # Inverters should respond in around 1.5 seconds, setting a timeout
         #  above that value will ensure that the application won't hang too
         #  long when the inverter doesn't send anything.
@@ -74,54 +102,39 @@ class Inverter:
     def model(self) -> Dict:
         """Gets model information from the inverter.
 
-        For all possible dictionary items, see the implementation.
+        For all possible dictionary items, see the implementation. The result
+        is also kept in last_model and its serial number in serial_number.
         """
         ident, payload = self.request(b'\x01\x03\x02', b'', b'\x01\x83')
-        device_types = {
-            '1': 'Single-phase inverter',
-            '2': 'Three-phase inverter',
-            '3': 'SolarEnvi Monitor',
-            '4': 'R-phase inverter of the three combined single-phase ones',
-            '5': 'S-phase inverter of the three combined single-phase ones',
-            '6': 'T-phase inverter of the three combined single-phase ones',
-        }
-        return OrderedDict(
-            device_type=device_types[decode_string(payload[0:1])],
-            va_rating=decode_string(payload[1:7]),
-            firmware_version=decode_string(payload[7:12]),
-            model_name=decode_string(payload[12:28]),
-            manufacturer=decode_string(payload[28:44]),
-            serial_number=decode_string(payload[44:60]),
-            communication_version=decode_string(payload[60:65]),
-            other_version=decode_string(payload[65:70]),
-            general=decode_string(payload[70:71]),
-        )
-
-    def status(self) -> Dict:
+        model = decode_model(payload)
+        self.last_model = model
+        if self.serial_number != model['serial_number']:
+            self.serial_number = model['serial_number']
+            if self.metrics is not None:
+                self.metrics.identified(self)
+        return model
+
+    def status(self, max_age: float = None) -> Dict:
         """Gets current status data from the inverter.
 
         Example dictionary keys are pv1_input_power, output_power,
         energy_today. Values are usually of type int or decimal.Decimal.
         For all possible values, see statustypes.py.
+
+        Args:
+            max_age: When given, a status response that was received at most
+                this many seconds ago, for instance in reply to a keep-alive
+                message, is used instead of making a new request.
         """
         if not self._status_format:
-            # Retrieve and cache status format
-            self._status_format = self.status_format()
-
-        ident, payload = self.request(b'\x01\x02\x02', b'', b'\x01\x82')
-
-        # Payload should be twice the size of the status format
-        if 2 * len(self._status_format) != len(payload):
-            logger.warning("Size of status payload and format differs, format %s, payload %s",
-                           self._status_format.hex(), payload.hex())
-
-        # Retrieve all status data type values
-        status_values = OrderedDict()
-        for name, type_def in status_types.items():
-            val = type_def.get_value(self._status_format, payload)
-            if val is not None:
-                status_values[name] = val
-        return status_values
+            # Retrieve and cache status format, together with the status
+            (_, self._status_format), (_, payload) = self.pipeline([(b'\x01\x00\x02', b'', b'\x01\x80'),
+                                                                    (b'\x01\x02\x02', b'', b'\x01\x82')])
+        elif max_age is not None and self.last_status and monotonic() - self.last_status[0] <= max_age:
+            payload = self.last_status[1]
+        else:
+            ident, payload = self.request(b'\x01\x02\x02', b'', b'\x01\x82')
+        return decode_status(self._status_format, payload)
 
     def status_format(self):
         """Gets the format used for the status data messages from the inverter.
@@ -131,9 +144,29 @@ class Inverter:
         ident, payload = self.request(b'\x01\x00\x02', b'', b'\x01\x80')
         return payload
 
-    def history(self, start, end):
-        """Requests historical data from the inverter."""
-        raise NotImplementedError('Not yet implemented')
+    def history(self, start: int, end: int) -> Iterator['HistoryRecord']:
+        """Yields the monthly energy generation for a range of years.
+
+        The years are requested one at a time and the records of a year are
+        yielded as soon as its response arrives. Stopping the iteration early
+        does not leave a request in flight. To resume, call again with the
+        year of the last record as start, see also HistoryRecord.
+
+        Experimental: the history messages are not documented and this
+        request and response layout has not been confirmed with a recorded
+        exchange of a real inverter, see decode_history for the assumed
+        format. For that reason there is no CLI command for it.
+
+        Args:
+            start: First year, 2000 or later.
+            end: Last year (inclusive).
+        """
+        for year in range(start, end + 1):
+            if not 2000 <= year <= 2255:
+                raise ValueError("Year out of range: {}".format(year))
+            ident, payload = self.request(b'\x06\x01\x02', bytes([year - 2000, year - 2000]), b'\x06\x81')
+            for record in decode_history(payload):
+                yield record
 
     def request(self, identifier: bytes, payload: bytes, expected_response_id=b"") -> Tuple[bytes, bytes]:
         """Sends a message and returns the received response.
@@ -142,19 +175,65 @@ class Inverter:
             identifier: The message identifier (header).
             payload: The message payload.
             expected_response_id: The response identifier is checked to see
-                whether it starts with the value given here. If it does not, an
-                exception is raised.
+                whether it starts with the value given here. Other messages
+                are skipped, see pipeline.
 
         Returns:
             A tuple with identifier and payload.
         """
-        self.send(identifier, payload)
-        response_id, response_payload = self.receive()
-        while not response_id.startswith(expected_response_id):
-            logger.warning("Got unexpected inverter response {} for request {}".format(
-                response_id.hex(), identifier.hex()))
-            response_id, response_payload = self.receive()
-        return response_id, response_payload
+        return self.pipeline([(identifier, payload, expected_response_id)])[0]
+
+    def pipeline(self, requests: Sequence[Tuple[bytes, bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+        """Sends multiple requests at once and returns all responses.
+
+        All requests are sent before waiting for the responses, so that they
+        are in flight together. Each received message is routed to the
+        earliest sent request whose expected response identifier is a prefix
+        of the message identifier. A status response that does not belong to
+        any request, e.g. the reply to a keep-alive message, is stored in
+        last_status. Other messages are logged and skipped.
+
+        Args:
+            requests: Sequence of identifier, payload and expected response
+                identifier tuples, see request.
+
+        Returns:
+            The identifier and payload of the response of each request, in the
+            same order as the requests.
+        """
+        return self._pipeline(requests)
+
+    def _pipeline(self, requests: Sequence[Tuple[bytes, bytes, bytes]], record: bool = True) \
+            -> List[Tuple[bytes, bytes]]:
+        """See pipeline, the round-trip times are only reported to metrics when record is True."""
+        start = monotonic()
+        for identifier, payload, expected_response_id in requests:
+            self.send(identifier, payload)
+
+        responses = [None] * len(requests)  # type: List[Optional[Tuple[bytes, bytes]]]
+        waiting = list(range(len(requests)))
+        while waiting:
+            response = self.receive()
+            self._record_status(response)
+            for i in waiting:
+                if response[0].startswith(requests[i][2]):
+                    responses[i] = response
+                    waiting.remove(i)
+                    if record and self.metrics is not None:
+                        self.metrics.request_completed(self, requests[i][0], monotonic() - start)
+                    break
+            else:
+                if not response[0].startswith(b'\x01\x82'):
+                    logger.warning("Got unexpected inverter response %s for request(s) %s",
+                                   response[0].hex(), ", ".join(requests[i][0].hex() for i in waiting))
+                    if self.metrics is not None:
+                        self.metrics.unexpected_response(self, response[0])
+        return responses
+
+    def _record_status(self, response: Tuple[bytes, bytes]):
+        """Stores the payload of a status response together with the time of arrival."""
+        if response[0].startswith(b'\x01\x82'):
+            self.last_status = (monotonic(), response[1])
 
     def send(self, identifier: bytes, payload: bytes):
         """Constructs and sends a message to the inverter.
@@ -165,16 +244,45 @@ class Inverter:
                 'write to closed file'.
         """
         message = construct_message(identifier, payload)
-        logger.debug('Sending %s', message.hex())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Sending %s', message.hex())
         self.sock_file.write(message)
         self.sock_file.flush()
+        if self.recorder is not None:
+            self.recorder.sent(message)
+        if self.metrics is not None:
+            self.metrics.bytes_sent(self, len(message))
 
     def receive(self) -> Tuple[bytes, bytes]:
         """Reads and returns the next message from the inverter.
 
-        See read_message.
+        Invalid messages are skipped until the error budget is spent.
+
+        Raises:
+            InverterEOFError: When the connection is lost.
+            ValueError: When too many invalid messages were received, see
+                FrameParser.
         """
-        return read_message(self.sock_file)
+        metrics = self.metrics
+        parser = self.parser
+        errors = parser.checksum_errors + parser.format_errors
+        while True:
+            message = parser.next_message()
+            if message:
+                if metrics is not None and parser.checksum_errors + parser.format_errors != errors:
+                    metrics.frames_discarded(self, parser.checksum_errors + parser.format_errors - errors)
+                identifier, payload = message
+                return bytes(identifier), bytes(payload)
+            try:
+                n = parser.recv_into(self._recv_into)
+            except socket.timeout:
+                if metrics is not None:
+                    metrics.timeout(self)
+                raise
+            if not n:
+                raise InverterEOFError
+            if metrics is not None:
+                metrics.bytes_received(self, n)
 
 
 class InverterFinder:
@@ -282,25 +390,102 @@ class InverterFinder:
             InverterNotFoundError: When no inverter was found after all search
                 messages have been sent.
         """
+        for i in range(advertisements):
+            self.advertise()
+            conn = self.accept(interval)
+            if conn:
+                # Wait before sending identification request
+                sleep(1.0)
+                return conn
+        raise InverterNotFoundError
+
+    def advertise(self):
+        """Broadcasts a single search message/advertisement.
+
+        Inverters that receive it will connect to the listener socket.
+        """
         message = construct_message(b'\x00\x40\x02', b'I AM SERVER')
-        self.listen_sock.settimeout(interval)
         # Broadcast socket
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as bc:
             bc.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             bc.bind((self.interface_ip, 0))
+            logger.debug('Sending server broadcast message')
+            bc.sendto(message, ('<broadcast>', 1300))
+
+    def accept(self, timeout: float) -> Optional[Tuple[socket.socket, Any]]:
+        """Waits for an inverter to connect.
+
+        Args:
+            timeout: Maximum time to wait.
+
+        Returns:
+            A tuple with the inverter socket and address like socket.accept(),
+            or None when no inverter connected in time.
+        """
+        self.listen_sock.settimeout(timeout)
+        try:
+            sock, addr = self.listen_sock.accept()
+        except socket.timeout:
+            return None
+        logger.info('Connected with inverter on address %s', addr)
+        return sock, addr
+
+
+# Energy generation of a month, in kWh
+HistoryRecord = namedtuple('HistoryRecord', ['year', 'month', 'energy'])
+
+
+def decode_history(payload: bytes) -> List[HistoryRecord]:
+    """Decodes the payload of a history response.
+
+    The format is not documented. This assumes that the response covers one
+    year: the first byte is the year minus 2000, followed by a 16-bit
+    unsigned big-endian integer for each month with the energy in 0.1 kWh.
+    Months that are missing from a short payload are left out.
+    """
+    if not payload:
+        return []
+    year = 2000 + payload[0]
+    months = min((len(payload) - 1) // 2, 12)
+    words = Struct('>{}H'.format(months)).unpack_from(payload, 1)
+    return [HistoryRecord(year, month, Decimal(word).scaleb(-1)) for month, word in enumerate(words, 1)]
 
-            for i in range(advertisements):
-                logger.debug('Sending server broadcast message')
-                bc.sendto(message, ('<broadcast>', 1300))
-                try:
-                    sock, addr = self.listen_sock.accept()
-                    logger.info('Connected with inverter on address %s', addr)
-                    # Wait before sending identification request
-                    sleep(1.0)
-                    return sock, addr
-                except socket.timeout:
-                    pass
-        raise InverterNotFoundError
+
+def decode_model(payload: bytes) -> Dict:
+    """Decodes the payload of a model response.
+
+    For all possible dictionary items, see the implementation.
+    """
+    device_types = {
+        '1': 'Single-phase inverter',
+        '2': 'Three-phase inverter',
+        '3': 'SolarEnvi Monitor',
+        '4': 'R-phase inverter of the three combined single-phase ones',
+        '5': 'S-phase inverter of the three combined single-phase ones',
+        '6': 'T-phase inverter of the three combined single-phase ones',
+    }
+    return OrderedDict(
+        device_type=device_types[decode_string(payload[0:1])],
+        va_rating=decode_string(payload[1:7]),
+        firmware_version=decode_string(payload[7:12]),
+        model_name=decode_string(payload[12:28]),
+        manufacturer=decode_string(payload[28:44]),
+        serial_number=decode_string(payload[44:60]),
+        communication_version=decode_string(payload[60:65]),
+        other_version=decode_string(payload[65:70]),
+        general=decode_string(payload[70:71]),
+    )
+
+
+def decode_status(status_format: bytes, payload: bytes) -> Dict:
+    """Decodes the payload of a status response using the given status format."""
+    # Payload should be twice the size of the status format
+    if 2 * len(status_format) != len(payload):
+        logger.warning("Size of status payload and format differs, format %s, payload %s",
+                       status_format.hex(), payload.hex())
+
+    # Retrieve all status data type values
+    return get_status_decoder(status_format).decode(payload)
 
 
 def decode_string(val: bytes) -> str:
@@ -339,30 +524,191 @@ def read_message(stream: BinaryIO) -> Tuple[bytes, bytes]:
         ValueError: When the message has an incorrect format, e.g. checksum is
             invalid or the first two bytes are not '55 aa'.
     """
-    # Message start + check for EOF
-    start = stream.read(2)
-    if start == b"":
+    # Message start, identifier and payload size + check for EOF
+    header = stream.read(7)
+    if header == b"":
         raise InverterEOFError
-    if start != b"\x55\xaa":
-        raise ValueError("Invalid start of message")
+    payload_size = parse_header(header)
+
+    # Payload and checksum
+    rest = stream.read(payload_size + 2)
+    return verify_message(header, rest[:-2], rest[-2:])
 
-    # Identifier
-    identifier = stream.read(3)
 
-    # Payload
-    payload_size_bytes = stream.read(2)
-    payload_size = int.from_bytes(payload_size_bytes, byteorder='big')
+def parse_header(header: bytes) -> int:
+    """Checks the first 7 bytes of a message and returns the payload size.
+
+    Raises:
+        ValueError: When the first two bytes are not '55 aa' or the payload
+            size is invalid.
+    """
+    if header[0:2] != b"\x55\xaa":
+        raise ValueError("Invalid start of message")
+    payload_size = int.from_bytes(header[5:7], byteorder='big')
     if payload_size < 0 or payload_size > 4096:  # Sanity check for strange payload size values
         raise ValueError("Unexpected payload size value")
-    payload = stream.read(payload_size)
+    return payload_size
+
+
+def verify_message(header: bytes, payload: bytes, checksum: bytes) -> Tuple[bytes, bytes]:
+    """Validates the checksum of a message and returns identifier and payload.
+
+    Raises:
+        ValueError: When the checksum is invalid.
+    """
+    if len(checksum) != 2 or int.from_bytes(checksum, byteorder='big') != (sum(header) + sum(payload)) & 0xffff:
+        raise ValueError('Checksum invalid for message %s', (header + payload).hex())
+    return header[2:5], payload
+
+
+# Message start and payload size, and message checksum
+_header_struct = Struct('>H3xH')
+_checksum_struct = Struct('>H')
+
+
+class FrameParser:
+    """Incremental parser for inverter messages.
+
+    Received data is written directly into a reusable buffer, using for
+    instance socket.recv_into, or copied into it using feed for transports
+    that hand out bytes objects. Messages are parsed in place, the identifier
+    and payload are returned as memoryview slices of the buffer. These slices
+    are only valid until the next call to recv_into or feed.
+
+    When an error budget is given, the parser resynchronizes on invalid
+    data: it skips to the next '55 aa' start marker and parses again. The
+    number of discarded bytes and errors are kept in the attributes
+    discarded_bytes, checksum_errors and format_errors.
+    """
+
+    max_payload_size = 4096
+
+    def __init__(self, buffer_size: int = 16384, max_errors: Optional[int] = None):
+        """Constructor.
+
+        Args:
+            buffer_size: Initial size of the receive buffer, should fit at
+                least one message of the maximum size.
+            max_errors: Number of consecutive invalid messages that are
+                skipped before ValueError is raised. Every valid message
+                resets the count. With None, resynchronization is disabled
+                and the first invalid message raises ValueError.
+        """
+        self.buffer = bytearray(buffer_size)
+        self._view = memoryview(self.buffer)
+        self._start = 0  # Start of the data that is not yet parsed
+        self._end = 0  # End of the received data
+        self.max_errors = max_errors
+        self.errors = 0  # Consecutive errors
+        self.discarded_bytes = 0
+        self.checksum_errors = 0
+        self.format_errors = 0
+
+    def __len__(self):
+        """Returns the number of bytes that are received but not yet parsed."""
+        return self._end - self._start
+
+    def recv_into(self, recv_into: Callable[[memoryview], int]) -> int:
+        """Receives data into the free space of the buffer.
+
+        Args:
+            recv_into: Function that writes data into the given buffer and
+                returns the number of bytes written, e.g. socket.recv_into.
+
+        Returns:
+            The number of bytes received, 0 means EOF.
+        """
+        self._reserve(self.max_payload_size)
+        n = recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def feed(self, data: bytes):
+        """Appends received data to the buffer."""
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
 
-    # Checksum
-    checksum = stream.read(2)
-    message = start + identifier + payload_size_bytes + payload
-    if checksum != calculate_checksum(message):
-        raise ValueError('Checksum invalid for message %s', message.hex())
+    def next_message(self) -> Optional[Tuple[memoryview, memoryview]]:
+        """Parses the next message from the buffer.
 
-    return identifier, payload
+        Returns:
+            Tuple with identifier and payload of the message, or None when
+            no complete message has been received yet.
+
+        Raises:
+            ValueError: When the message has an incorrect format, see
+                read_message, and the error budget is spent.
+        """
+        while True:
+            try:
+                message = self._parse()
+            except ValueError as e:
+                if self.max_errors is None:
+                    raise
+                self.errors += 1
+                if self.errors > self.max_errors:
+                    raise ValueError("Too many invalid messages, last error: {}".format(e.args[0]))
+                self._resync(e)
+                continue
+            if message:
+                self.errors = 0
+            return message
+
+    def _parse(self) -> Optional[Tuple[memoryview, memoryview]]:
+        """Parses a single message at the start of the unparsed data."""
+        start = self._start
+        if self._end - start < 7:
+            return None
+        marker, payload_size = _header_struct.unpack_from(self.buffer, start)
+        if marker != 0x55aa:
+            raise ValueError("Invalid start of message")
+        if payload_size > self.max_payload_size:
+            raise ValueError("Unexpected payload size value")
+        checksum_start = start + 7 + payload_size
+        if checksum_start + 2 > self._end:
+            return None
+        # Summing a bytearray slice is a lot faster than summing a memoryview
+        checksum = sum(self.buffer[start:checksum_start]) & 0xffff
+        if checksum != _checksum_struct.unpack_from(self.buffer, checksum_start)[0]:
+            raise _ChecksumError('Checksum invalid for message {}'.format(self._view[start:checksum_start].hex()))
+        self._start = checksum_start + 2
+        view = self._view
+        return view[start + 2:start + 5], view[start + 7:checksum_start]
+
+    def _resync(self, error: ValueError):
+        """Skips to the next start marker after an invalid message."""
+        if isinstance(error, _ChecksumError):
+            self.checksum_errors += 1
+        else:
+            self.format_errors += 1
+        start = self.buffer.find(b'\x55\xaa', self._start + 1, self._end)
+        if start == -1:
+            # Keep the last byte if it might be the first half of a marker
+            start = self._end - 1 if self.buffer[self._end - 1] == 0x55 else self._end
+        logger.warning("Invalid message from inverter (%s), skipping %s bytes", error.args[0], start - self._start)
+        self.discarded_bytes += start - self._start
+        self._start = start
+
+    def _reserve(self, size: int):
+        """Makes room for at least size bytes after the received data."""
+        if self._start == self._end:
+            # Everything is parsed, start at the beginning of the buffer
+            self._start = self._end = 0
+        if self._end + size <= len(self.buffer):
+            return
+        remaining = bytes(self._view[self._start:self._end])
+        if len(remaining) + size > len(self.buffer):
+            # Replace the buffer, existing slices keep referring to the old one
+            self.buffer = bytearray(max(2 * len(self.buffer), len(remaining) + size))
+            self._view = memoryview(self.buffer)
+        self._view[:len(remaining)] = remaining
+        self._start, self._end = 0, len(remaining)
+
+
+class _ChecksumError(ValueError):
+    """Used by FrameParser to tell checksum errors apart."""
+    pass
 
 
 class InverterNotFoundError(Exception):
@@ -378,15 +724,99 @@ class InverterEOFError(Exception):
     pass
 
 
+class KeepAliveScheduler:
+    """Sends keep-alive messages for any number of inverters.
+
+    A single thread keeps a heap of the moments at which each registered
+    inverter needs a keep-alive message, based on the time of its last
+    activity. Only when a keep-alive is actually due, it is handed to a small
+    worker pool, which waits for the response.
+    """
+
+    def __init__(self, workers: int = 16):
+        """Constructor.
+
+        Args:
+            workers: Maximum number of keep-alive requests that are handled
+                at the same time.
+        """
+        self._workers = workers
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._thread = None  # type: Optional[Thread]
+        self._condition = Condition()
+        self._heap = []  # Items are (due time, registration, inverter)
+        self._registrations = {}  # Maps inverter to current registration number
+        self._counter = count()
+
+    def register(self, inverter: 'KeepAliveInverter'):
+        """Starts sending keep-alive messages for an inverter.
+
+        Raises:
+            RuntimeError: When the inverter is already registered.
+        """
+        with self._condition:
+            if inverter in self._registrations:
+                raise RuntimeError("Inverter is already registered")
+            registration = next(self._counter)
+            self._registrations[inverter] = registration
+            heapq.heappush(self._heap, (inverter.last_activity + inverter.keep_alive_period, registration, inverter))
+            if not self._thread:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers)
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, inverter: 'KeepAliveInverter'):
+        """Stops sending keep-alive messages for an inverter, no-op if not registered."""
+        with self._condition:
+            self._registrations.pop(inverter, None)
+
+    def is_registered(self, inverter: 'KeepAliveInverter') -> bool:
+        """Returns whether keep-alive messages are sent for the inverter."""
+        with self._condition:
+            return inverter in self._registrations
+
+    def _run(self):
+        """Hands out keep-alive messages when they are due."""
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, registration, inverter = self._heap[0]
+                now = monotonic()
+                if due > now:
+                    self._condition.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                if self._registrations.get(inverter) != registration:
+                    continue  # Unregistered in the meantime
+
+                # Activity since scheduling postpones the keep-alive
+                due = inverter.last_activity + inverter.keep_alive_period
+                if due <= now:
+                    self._executor.submit(inverter.keep_alive_if_due)
+                    due = now + inverter.keep_alive_period
+                heapq.heappush(self._heap, (due, registration, inverter))
+
+
+# Shared by all KeepAliveInverter instances unless another scheduler is given
+keep_alive_scheduler = KeepAliveScheduler()
+
+
 class KeepAliveInverter(Inverter):
     """Inverter that is kept alive by sending a request every couple seconds.
 
     Keep-alive messages are only sent when the last sent message became too
     long ago. When the program makes requests quicker than the keep-alive
     period, no keep-alive messages will be sent.
+
+    The keep-alive messages of all instances are sent by a shared
+    KeepAliveScheduler.
     """
 
-    def __init__(self, sock: socket, addr, keep_alive: float = 11.0):
+    def __init__(self, sock: socket, addr, keep_alive: float = 11.0, scheduler: KeepAliveScheduler = None,
+                 **kwargs):
         """See base class.
 
         Args:
@@ -396,13 +826,17 @@ class KeepAliveInverter(Inverter):
                 message is triggered. The default of 11 seconds is chosen such
                 that keep-alive messages will not be sent when status is
                 retrieved every 10 seconds.
+            scheduler: The scheduler that sends the keep-alive messages,
+                defaults to the shared scheduler.
+            **kwargs: See base class.
         """
-        super().__init__(sock, addr)
+        super().__init__(sock, addr, **kwargs)
         self.keep_alive_period = keep_alive
-        self.keep_alive_timer = None
+        self.scheduler = scheduler or keep_alive_scheduler
+        self.last_activity = monotonic()
 
-        self._ka_thread = None  # Keep-alive thread
-        self._ka_stop = Event()  # Used for stopping keep-alive messages
+        # Held while communicating, so that keep-alive messages do not interfere with requests
+        self._lock = RLock()
         self.start_keep_alive()
 
     def stop_keep_alive(self) -> None:
@@ -410,49 +844,65 @@ class KeepAliveInverter(Inverter):
 
         Blocks for a moment if a keep-alive request is currently being handled.
         """
-        if not self._ka_thread:
-            return  # No-op if already stopped
-        self._ka_stop.set()
-        self._ka_thread.join()
-        self._ka_thread = None
+        self.scheduler.unregister(self)
+        with self._lock:
+            pass
 
     def start_keep_alive(self):
         """Starts sending keep-alive messages periodically."""
-        if self._ka_thread:
-            raise RuntimeError("Keep-alive thread already exists")
-        self._ka_stop.clear()
-        self._ka_thread = Thread(target=self._ka_runner, daemon=True)
-        self._ka_thread.start()
-
-    def _ka_runner(self):
-        """Sends a keep-alive periodically until stopped."""
-        while True:
-            # stopped will be False when the timeout occurred
-            stopped = self._ka_stop.wait(timeout=self.keep_alive_period)
-            if stopped:
-                return
-            self.keep_alive()
+        if self.scheduler.is_registered(self):
+            raise RuntimeError("Keep-alive is already started")
+        self.scheduler.register(self)
+
+    def keep_alive_if_due(self):
+        """Sends a keep-alive message unless there was recent activity or a request is in progress.
+
+        Called by the scheduler. When the keep-alive fails, no more keep-alive
+        messages will be sent.
+        """
+        if not self._lock.acquire(blocking=False):
+            return  # Busy communicating
+        try:
+            if monotonic() - self.last_activity >= self.keep_alive_period:
+                self.keep_alive()
+        except Exception:
+            logger.warning("Keep-alive message failed for inverter on address %s, stopping keep-alive", self.addr,
+                           exc_info=True)
+            self.scheduler.unregister(self)
+        finally:
+            self._lock.release()
 
     def keep_alive(self):
-        """Sends a keep-alive message."""
-        # We have to call the superclass because self.send/self.receive
-        #  interfere with the keep-alive runner.
-        super().send(b"\x01\x02\x02", b"")  # Status message
-        # super().send(b"\x01\x09\x02", b"")  # Unknown message
-        super().receive()
+        """Sends a keep-alive message.
+
+        Any message is accepted as response. A status response is kept in
+        last_status and can be used by status().
+        """
+        with self._lock:
+            start = monotonic()
+            # Status message, not reported as status request to the metrics
+            self._pipeline([(b"\x01\x02\x02", b"", b"")], record=False)
+        if self.metrics is not None:
+            self.metrics.keep_alive_completed(self, monotonic() - start)
+        # self.request(b"\x01\x09\x02", b"")  # Unknown message
+
+    def pipeline(self, requests: Sequence[Tuple[bytes, bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+        """See base class."""
+        with self._lock:
+            return super().pipeline(requests)
 
     def send(self, identifier: bytes, payload: bytes):
         """See base class."""
-        self.stop_keep_alive()
-        super().send(identifier, payload)
-        self.start_keep_alive()
+        with self._lock:
+            super().send(identifier, payload)
+            self.last_activity = monotonic()
 
     def receive(self) -> Tuple[bytes, bytes]:
         """See base class."""
-        self.stop_keep_alive()
-        msg = super().receive()
-        self.start_keep_alive()
-        return msg
+        with self._lock:
+            msg = super().receive()
+            self.last_activity = monotonic()
+            return msg
 
     def disconnect(self):
         """See base class."""
@@ -1,21 +1,224 @@
 """Higher-level utility functions."""
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from contextlib import contextmanager
+from time import monotonic, sleep
+from typing import Iterable, List, Optional, Tuple, Dict
 
-from samil.inverter import InverterFinder, KeepAliveInverter
+from samil.inverter import Inverter, InverterFinder, KeepAliveInverter, InverterNotFoundError
+from samil.metrics import Metrics
+
+logger = logging.getLogger(__name__)
 
 
 @contextmanager
-def connect_inverters(interface: str = '', n: int = 1):
+def connect_inverters(interface: str = '', n: int = 1, serial_numbers: Iterable[str] = None, timeout: float = 50.0,
+                      metrics: Metrics = None):
     """Finds and connects to inverters.
 
     Needs to be used as context manager. Disconnects the inverters after exit
     of the with statement.
+
+    Args:
+        interface: Bind interface IP.
+        n: Number of inverters to connect to.
+        serial_numbers: Only connect to the inverters with these serial
+            numbers, n is ignored when given.
+        timeout: Maximum time for finding all inverters.
+        metrics: Optional receiver of measurements for all inverters, see
+            Inverter.
+
+    Raises:
+        InverterNotFoundError: When not all inverters were found in time.
     """
     with InverterFinder(interface_ip=interface) as finder:
-        inverters = [KeepAliveInverter(*finder.find_inverter()) for i in range(n)]
+        inverters = find_inverters(finder, n, serial_numbers=serial_numbers, timeout=timeout, metrics=metrics)
 
     try:
         yield inverters
     finally:
         for i in inverters:
             i.disconnect()
+
+
+def find_inverters(finder: InverterFinder,
+                   n: int = 1,
+                   serial_numbers: Iterable[str] = None,
+                   timeout: float = 50.0,
+                   interval: float = 5.0,
+                   handshake_delay: float = 1.0,
+                   metrics: Metrics = None) -> List[KeepAliveInverter]:
+    """Searches for multiple inverters at once.
+
+    Advertisements are broadcast every interval, not once per inverter, and
+    every inverter that connects is accepted. The model of each inverter is
+    requested in a separate thread so that the handshakes run in parallel, it
+    is kept in the serial_number and last_model attributes of the inverter.
+    Returns as soon as the requested inverters have connected.
+
+    Args:
+        finder: An opened inverter finder.
+        n: Number of inverters to find.
+        serial_numbers: Only accept the inverters with these serial numbers,
+            n is ignored when given. Other inverters are disconnected.
+        timeout: Maximum time for finding all inverters.
+        interval: Time between each advertisement.
+        handshake_delay: Time to wait after an inverter connected before
+            sending the model request.
+        metrics: Optional receiver of measurements for all inverters, see
+            Inverter.
+
+    Returns:
+        The connected inverters, in order of completed handshake.
+
+    Raises:
+        InverterNotFoundError: When not all inverters were found in time.
+    """
+    wanted = set(serial_numbers) if serial_numbers else None
+    if wanted:
+        n = len(wanted)
+    found = []  # type: List[KeepAliveInverter]
+    deadline = monotonic() + timeout
+    next_advertisement = float('-inf')
+    handshakes = set()
+
+    executor = ThreadPoolExecutor(max_workers=max(n, 1) * 2)
+    try:
+        while len(found) < n and monotonic() < deadline:
+            if monotonic() >= next_advertisement:
+                finder.advertise()
+                next_advertisement = monotonic() + interval
+
+            if handshakes:
+                # Keep the wait short so that finished handshakes are processed in time
+                wait_time = 0.1
+            else:
+                wait_time = min(next_advertisement, deadline) - monotonic()
+            conn = finder.accept(max(wait_time, 0.001))
+            if conn:
+                handshakes.add(executor.submit(_handshake, *conn, delay=handshake_delay, metrics=metrics))
+
+            done = {f for f in handshakes if f.done()}
+            handshakes -= done
+            for f in done:
+                _accept_handshake(f, found, wanted)
+    finally:
+        # Inverters that are still in the handshake are not needed anymore
+        for f in handshakes:
+            f.add_done_callback(_discard_handshake)
+        executor.shutdown(wait=False)
+        if len(found) < n:
+            for i in found:
+                i.disconnect()
+    if len(found) < n:
+        raise InverterNotFoundError("Found {} out of {} inverters".format(len(found), n))
+    return found
+
+
+def _handshake(sock, addr, delay: float, metrics: Metrics = None) -> Tuple[KeepAliveInverter, Dict]:
+    """Requests the model of a newly connected inverter, which sets its serial_number and last_model."""
+    sleep(delay)
+    inverter = KeepAliveInverter(sock, addr, metrics=metrics)
+    try:
+        return inverter, inverter.model()
+    except Exception:
+        inverter.disconnect()
+        raise
+
+
+def _accept_handshake(future, found: List[KeepAliveInverter], wanted: Optional[set]):
+    """Adds the inverter of a finished handshake to found if it is wanted, else disconnects it."""
+    try:
+        inverter, model = future.result()
+    except Exception:
+        logger.warning("Handshake with inverter failed", exc_info=True)
+        return
+    serial_number = model['serial_number']
+    if wanted is not None and serial_number not in wanted:
+        logger.info("Ignoring inverter %s on address %s", serial_number, inverter.addr)
+        inverter.disconnect()
+        return
+    if wanted:
+        wanted.discard(serial_number)
+    found.append(inverter)
+
+
+def _discard_handshake(future):
+    """Disconnects the inverter of a finished handshake."""
+    if not future.cancelled() and not future.exception():
+        inverter, model = future.result()
+        inverter.disconnect()
+
+
+class StatusPoller:
+    """Requests the status of multiple inverters at once.
+
+    Each inverter is requested in its own thread, so a poll takes one
+    round-trip regardless of the number of inverters. Needs to be closed after
+    use, or used as context manager.
+    """
+
+    def __init__(self, inverters: Iterable[Inverter]):
+        """Constructor.
+
+        Args:
+            inverters: The inverters to poll.
+        """
+        self.inverters = list(inverters)
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.inverters), 1))
+        # Requests that did not finish before the deadline of an earlier poll
+        self._pending = {}
+
+    def __enter__(self):
+        """Returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def close(self):
+        """Stops the poller threads, does not disconnect the inverters."""
+        self._executor.shutdown(wait=False)
+
+    def poll(self, timeout: float = 10.0, max_age: float = None) -> List[Optional[Dict]]:
+        """Requests the status of all inverters.
+
+        When the request of an inverter has not finished in time, the next
+        poll will use that same request instead of making a new one, because
+        the inverter methods are not thread-safe. Its result is used also when
+        it finished in the meantime, so that a slow inverter does not get two
+        status requests right after each other.
+
+        Args:
+            timeout: Maximum time to wait for the responses.
+            max_age: See Inverter.status. A status that arrived in reply to
+                a keep-alive message at most this many seconds ago is used
+                instead of making a new request.
+
+        Returns:
+            The status of each inverter in the same order as the inverters
+            list, or None for an inverter that did not respond in time.
+
+        Raises:
+            Exception: The exception raised by a failed status request, e.g.
+                when the connection is lost.
+        """
+        futures = []
+        for inverter in self.inverters:
+            future = self._pending.pop(inverter, None)
+            if not future:
+                future = self._executor.submit(inverter.status, max_age)
+            futures.append(future)
+
+        wait(futures, timeout=timeout)
+
+        results = []
+        for inverter, future in zip(self.inverters, futures):
+            if future.done():
+                results.append(future.result())
+            else:
+                logger.warning("Inverter on address %s did not respond in time", inverter.addr)
+                self._pending[inverter] = future
+                results.append(None)
+        return results
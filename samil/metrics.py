@@ -0,0 +1,184 @@
+"""Instrumentation of the inverter communication."""
+from bisect import bisect_left
+from copy import deepcopy
+from threading import Lock
+from typing import Dict, List, Sequence, Tuple
+
+# Upper bounds in seconds of the round-trip time histogram buckets, inverters usually respond in around 1.5 seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """Receives measurements of the communication with inverters.
+
+    Pass an instance to Inverter to enable the measurements, without one
+    the measurements are skipped. All methods do nothing, subclass and
+    override the methods that are needed. The methods are called from the
+    thread that communicates with the inverter and should return quickly.
+
+    The inverter argument is the Inverter instance that made the measurement.
+    Its serial_number attribute is set once the model has been requested.
+    """
+
+    def request_completed(self, inverter, identifier: bytes, duration: float):
+        """Called when the response to a request arrived.
+
+        Not called for keep-alive messages, see keep_alive_completed.
+
+        Args:
+            inverter: The inverter.
+            identifier: Identifier of the request message.
+            duration: Time in seconds from sending the request until the
+                response arrived. For pipelined requests, the time is
+                measured from sending the first request.
+        """
+
+    def keep_alive_completed(self, inverter, duration: float):
+        """Called after a keep-alive message was answered, with the time it took in seconds."""
+
+    def bytes_sent(self, inverter, n: int):
+        """Called after data was sent."""
+
+    def bytes_received(self, inverter, n: int):
+        """Called after data was received."""
+
+    def frames_discarded(self, inverter, n: int):
+        """Called when invalid messages were skipped, e.g. because of a wrong checksum."""
+
+    def unexpected_response(self, inverter, identifier: bytes):
+        """Called when a message arrived that did not match any request and was skipped."""
+
+    def timeout(self, inverter):
+        """Called when receiving timed out."""
+
+    def identified(self, inverter):
+        """Called when the serial number of the inverter became known."""
+
+
+class Histogram:
+    """Counts values in buckets, like a Prometheus histogram."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Constructor.
+
+        Args:
+            buckets: Increasing bucket upper bounds, a bucket for larger
+                values is added.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Adds a value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Returns each upper bound, ending with infinity, with the number of values up to it."""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class InverterStats:
+    """Measurements of a single inverter, see MetricsCollector."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Constructor."""
+        self.requests = {}  # type: Dict[bytes, Histogram]  # Round-trip times by request identifier
+        self.keep_alives = Histogram(buckets)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_discarded = 0
+        self.unexpected_responses = 0
+        self.timeouts = 0
+        self._buckets = buckets
+
+    def request_histogram(self, identifier: bytes) -> Histogram:
+        """Returns the round-trip time histogram for a request identifier."""
+        try:
+            return self.requests[identifier]
+        except KeyError:
+            histogram = self.requests[identifier] = Histogram(self._buckets)
+            return histogram
+
+
+class MetricsCollector(Metrics):
+    """Keeps the measurements in memory, per inverter.
+
+    Inverters are identified by serial number, or by network address as long
+    as the serial number is not known. The measurements by address are moved
+    to the serial number once it is known. Thread-safe.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Constructor.
+
+        Args:
+            buckets: Round-trip time histogram bucket upper bounds in seconds.
+        """
+        self.buckets = tuple(buckets)
+        self._stats = {}  # type: Dict[str, InverterStats]
+        self._lock = Lock()
+
+    def snapshot(self) -> Dict[str, InverterStats]:
+        """Returns a copy of the measurements by inverter."""
+        with self._lock:
+            return deepcopy(self._stats)
+
+    def _get(self, inverter) -> InverterStats:
+        """Returns the measurements of an inverter, the lock must be held."""
+        key = inverter.serial_number or str(inverter.addr)
+        try:
+            return self._stats[key]
+        except KeyError:
+            stats = self._stats[key] = InverterStats(self.buckets)
+            return stats
+
+    def request_completed(self, inverter, identifier: bytes, duration: float):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).request_histogram(identifier).observe(duration)
+
+    def keep_alive_completed(self, inverter, duration: float):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).keep_alives.observe(duration)
+
+    def bytes_sent(self, inverter, n: int):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).bytes_sent += n
+
+    def bytes_received(self, inverter, n: int):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).bytes_received += n
+
+    def frames_discarded(self, inverter, n: int):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).frames_discarded += n
+
+    def unexpected_response(self, inverter, identifier: bytes):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).unexpected_responses += 1
+
+    def timeout(self, inverter):
+        """See base class."""
+        with self._lock:
+            self._get(inverter).timeouts += 1
+
+    def identified(self, inverter):
+        """Moves the measurements by network address to the serial number."""
+        with self._lock:
+            stats = self._stats.pop(str(inverter.addr), None)
+            if stats is not None and inverter.serial_number not in self._stats:
+                self._stats[inverter.serial_number] = stats
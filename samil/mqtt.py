@@ -0,0 +1,253 @@
+"""Utility functions for publishing to MQTT."""
+import json
+import logging
+from collections import OrderedDict, deque
+from decimal import Decimal
+from fnmatch import fnmatchcase
+from threading import Condition, Thread
+from time import sleep
+from typing import Dict, Optional, Tuple
+
+from samil.spool import Spool
+
+logger = logging.getLogger(__name__)
+
+# Same as paho.mqtt.client.MQTT_ERR_SUCCESS, paho is not imported here
+_MQTT_ERR_SUCCESS = 0
+
+
+class DeadbandFilter:
+    """Selects the status fields that changed more than a deadband.
+
+    A field is selected when its value differs more than the deadband from
+    the value that was last selected. Comparing with the last selected value
+    instead of the previous value prevents slow drifts from going unnoticed.
+    Fields with a string value are selected on any change.
+
+    Use one instance per inverter.
+    """
+
+    def __init__(self, deadbands: Dict[str, Decimal] = None, refresh_interval: int = None):
+        """Constructor.
+
+        Args:
+            deadbands: Deadband per field name. The field names may contain
+                shell-style wildcards, e.g. '*_voltage'. An exact match takes
+                precedence, otherwise the first matching pattern is used.
+                Fields without a deadband are selected on any change.
+            refresh_interval: When given, all fields are selected every this
+                many calls, e.g. to refresh subscribers that missed a message.
+        """
+        self.deadbands = OrderedDict(deadbands or {})
+        self.refresh_interval = refresh_interval
+        self._selected = {}  # Last selected value for each field
+        self._calls = 0
+        self._field_deadbands = {}  # Caches the deadband for each field name
+
+    def deadband(self, field: str) -> Decimal:
+        """Returns the deadband for a field."""
+        try:
+            return self._field_deadbands[field]
+        except KeyError:
+            pass
+        deadband = self.deadbands.get(field)
+        if deadband is None:
+            deadband = next((v for k, v in self.deadbands.items() if fnmatchcase(field, k)), Decimal(0))
+        self._field_deadbands[field] = deadband
+        return deadband
+
+    def filter(self, status: Dict) -> Dict:
+        """Returns the fields of the status that should be published."""
+        refresh = bool(self.refresh_interval) and self._calls % self.refresh_interval == 0
+        self._calls += 1
+        selected = OrderedDict()
+        for k, v in status.items():
+            if refresh or k not in self._selected or self._changed(k, v, self._selected[k]):
+                selected[k] = v
+                self._selected[k] = v
+        return selected
+
+    def _changed(self, field: str, value, last) -> bool:
+        """Returns whether a value moved beyond the deadband of the field."""
+        if isinstance(value, str) or isinstance(last, str):
+            return value != last
+        return abs(value - last) > self.deadband(field)
+
+
+class BufferedPublisher:
+    """Publishes MQTT messages, buffering them while the broker is unreachable.
+
+    While the client is connected, messages are published directly. While it
+    is disconnected, messages are queued in memory. When the memory queue is
+    full, it is moved to the spool if one is given, otherwise the oldest
+    message is dropped. After reconnecting, the spool and then the memory
+    queue are published in order from a background thread, at most max_rate
+    messages per second. New messages are queued behind them, to keep the
+    order.
+
+    Sets the on_connect, on_disconnect and on_publish callbacks of the
+    client, so create it before connecting. The client should run its network
+    loop in a thread, e.g. using loop_start, and reconnect by itself.
+
+    QoS 1 and 2 messages that are in flight when the connection drops are
+    kept and retransmitted by the client itself.
+    """
+
+    def __init__(self, client, qos: int = 0, queue_size: int = 10000, spool: Spool = None,
+                 max_rate: float = None):
+        """Constructor.
+
+        Args:
+            client: paho.mqtt.client.Client instance.
+            qos: QoS level for all messages.
+            queue_size: Maximum number of messages in the memory queue.
+            spool: Optional spool for messages that don't fit in the memory
+                queue. It is closed when the publisher is closed.
+            max_rate: Maximum number of queued messages per second that is
+                published after reconnecting. No limit when None.
+        """
+        self.client = client
+        self.qos = qos
+        self.queue_size = queue_size
+        self.spool = spool
+        self.max_rate = max_rate
+
+        self.published = 0  # Number of messages handed to the client
+        self.acked = 0  # Number of messages that are sent (QoS 0) or acknowledged (QoS 1 and 2)
+        self.queued = 0  # Number of messages that were queued because the client was disconnected
+        self.dropped = 0  # Number of messages dropped because the queue was full
+
+        self.connected = False
+        self._queue = deque()  # Messages not yet published, all are newer than the spooled messages
+        self._replaying = deque()  # Messages of the spool segment that is being published
+        self._segment = None  # Spool segment that is being published
+        self._closed = False
+        self._condition = Condition()
+
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        """Returns the number of messages waiting in memory and in the segment that is being published."""
+        return len(self._queue) + len(self._replaying)
+
+    def __enter__(self):
+        """Returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def publish(self, topic: str, payload: str):
+        """Publishes or queues a message, does not block."""
+        with self._condition:
+            if self.connected and not self._has_backlog() and self._publish(topic, payload):
+                return
+            self.queued += 1
+            if len(self._queue) >= self.queue_size:
+                if self.spool is not None:
+                    self._spool_queue()
+                else:
+                    logger.warning("MQTT queue is full, dropping oldest message")
+                    self._queue.popleft()
+                    self.dropped += 1
+            self._queue.append((topic, payload))
+            self._condition.notify()
+
+    def close(self):
+        """Stops publishing queued messages.
+
+        Messages in the memory queue are moved to the spool if there is one,
+        otherwise they are lost. A spool segment that was partly published is
+        kept, so those messages will be published again.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        if self.spool is not None:
+            self._spool_queue()
+            self.spool.close()
+
+    def _has_backlog(self) -> bool:
+        """Returns whether there are queued or spooled messages."""
+        return bool(self._queue or self._replaying or (self.spool is not None and len(self.spool)))
+
+    def _publish(self, topic: str, payload: str) -> bool:
+        """Hands a message to the client, returns False if that failed."""
+        info = self.client.publish(topic, payload, qos=self.qos)
+        if info.rc != _MQTT_ERR_SUCCESS and self.qos == 0:
+            # QoS 1 and 2 messages are kept by the client and sent after reconnecting
+            self.connected = False  # Wait for the next connect
+            return False
+        self.published += 1
+        return True
+
+    def _spool_queue(self):
+        """Moves the memory queue to the spool."""
+        if self._queue:
+            self.spool.append([json.dumps(message).encode() for message in self._queue])
+            self._queue.clear()
+
+    def _next_message(self) -> Optional[Tuple[str, str]]:
+        """Returns the oldest message of the backlog, without removing it."""
+        if not self._replaying and self._segment:
+            # Segment is completely published, it might already be removed when the spool was full
+            if self._segment in self.spool:
+                self.spool.remove(self._segment)
+            self._segment = None
+        while not self._replaying and self.spool is not None and len(self.spool):
+            self._segment = self.spool.oldest()
+            self._replaying.extend(tuple(json.loads(line.decode())) for line in self.spool.read(self._segment))
+            if not self._replaying:
+                self.spool.remove(self._segment)
+                self._segment = None
+        if self._replaying:
+            return self._replaying[0]
+        if self._queue:
+            return self._queue[0]
+        return None
+
+    def _run(self):
+        """Publishes the backlog while connected, until closed."""
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    message = self._next_message() if self.connected else None
+                    if message:
+                        break
+                    self._condition.wait()
+                if not self._publish(*message):
+                    continue
+                if self._replaying:
+                    self._replaying.popleft()
+                else:
+                    self._queue.popleft()
+            if self.max_rate:
+                sleep(1 / self.max_rate)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        """Starts publishing the backlog."""
+        with self._condition:
+            self.connected = rc == _MQTT_ERR_SUCCESS
+            if self.connected:
+                logger.info("Connected to MQTT broker, %s message(s) queued in memory, %s spool segment(s)",
+                            len(self), len(self.spool) if self.spool is not None else 0)
+                self._condition.notify()
+
+    def _on_disconnect(self, client, userdata, rc):
+        """Starts queueing new messages."""
+        with self._condition:
+            self.connected = False
+        logger.warning("Disconnected from MQTT broker (%s)", rc)
+
+    def _on_publish(self, client, userdata, mid):
+        """Counts acknowledged messages."""
+        self.acked += 1
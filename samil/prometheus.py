@@ -0,0 +1,212 @@
+"""Serves inverter status and communication metrics to Prometheus."""
+import logging
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from typing import Dict, List, Tuple
+
+from samil.metrics import Histogram, MetricsCollector
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Counters of MetricsCollector, by InverterStats attribute
+_COUNTERS = (
+    ('bytes_sent', 'samil_bytes_sent_total', 'Bytes sent to the inverter.'),
+    ('bytes_received', 'samil_bytes_received_total', 'Bytes received from the inverter.'),
+    ('frames_discarded', 'samil_frames_discarded_total', 'Invalid messages from the inverter that were skipped.'),
+    ('unexpected_responses', 'samil_unexpected_responses_total', 'Messages that did not match a request.'),
+    ('timeouts', 'samil_receive_timeouts_total', 'Receive timeouts.'),
+)
+
+
+class StatusCache:
+    """Keeps the latest status of each inverter and renders it for Prometheus.
+
+    The cache is updated by the polling loop and read by the HTTP server, so
+    a scrape never causes an inverter request. Thread-safe.
+    """
+
+    def __init__(self, metrics: MetricsCollector = None):
+        """Constructor.
+
+        Args:
+            metrics: Optional collector of the inverter communication
+                metrics, which are rendered as well.
+        """
+        self.metrics = metrics
+        self.poll_durations = Histogram()
+        self._statuses = {}  # type: Dict[str, Tuple[float, Dict]]  # Time and status by serial number
+        self._up = {}  # type: Dict[str, bool]  # Whether the last poll got a response, by serial number
+        self._missed = {}  # type: Dict[str, int]  # Number of polls without response, by serial number
+        self._lock = Lock()
+
+    def update(self, serial_number: str, status: Dict, timestamp: float):
+        """Stores the status of an inverter, timestamp in seconds since epoch."""
+        with self._lock:
+            self._statuses[serial_number] = (timestamp, status)
+            self._up[serial_number] = True
+            self._missed.setdefault(serial_number, 0)
+
+    def missed(self, serial_number: str):
+        """Records a poll that got no response in time, the previous status is kept."""
+        with self._lock:
+            self._up[serial_number] = False
+            self._missed[serial_number] = self._missed.get(serial_number, 0) + 1
+
+    def poll_completed(self, duration: float):
+        """Records the time in seconds that a poll of all inverters took."""
+        with self._lock:
+            self.poll_durations.observe(duration)
+
+    def render(self) -> bytes:
+        """Returns all metrics in the Prometheus text format."""
+        with self._lock:
+            statuses = dict(self._statuses)
+            up = dict(self._up)
+            missed = dict(self._missed)
+            lines = _histogram('samil_poll_duration_seconds', 'Time to poll the status of all inverters.',
+                               [({}, self.poll_durations)])
+        lines += _metric('samil_up', 'gauge', 'Whether the last poll of the inverter got a response.',
+                         [({'serial_number': k}, int(v)) for k, v in sorted(up.items())])
+        lines += _metric('samil_poll_missed_total', 'counter', 'Polls that got no response in time.',
+                         [({'serial_number': k}, v) for k, v in sorted(missed.items())])
+        lines += _metric('samil_last_status_timestamp_seconds', 'gauge', 'Time of the last status.',
+                         [({'serial_number': k}, v[0]) for k, v in sorted(statuses.items())])
+        lines += _status_metrics(statuses)
+        if self.metrics is not None:
+            lines += _communication_metrics(self.metrics)
+        return ('\n'.join(lines) + '\n').encode()
+
+
+def _status_metrics(statuses: Dict[str, Tuple[float, Dict]]) -> List[str]:
+    """Returns a gauge for each status field and the operation mode as labelled gauge."""
+    fields = {}  # type: Dict[str, List[Tuple[Dict, object]]]
+    modes = []
+    for serial_number, (timestamp, status) in sorted(statuses.items()):
+        labels = {'serial_number': serial_number}
+        for field, value in status.items():
+            if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+                fields.setdefault(field, []).append((labels, value))
+            elif field == 'operation_mode':
+                modes.append((dict(labels, mode=value), 1))
+    lines = _metric('samil_operation_mode', 'gauge', 'Operation mode of the inverter, the mode is in a label.',
+                    modes)
+    for field in sorted(fields):
+        lines += _metric('samil_' + field, 'gauge', 'Status value {}.'.format(field), fields[field])
+    return lines
+
+
+def _communication_metrics(metrics: MetricsCollector) -> List[str]:
+    """Returns the request durations, keep-alive durations and counters of the collector."""
+    snapshot = sorted(metrics.snapshot().items())
+    requests = [({'serial_number': k, 'request': identifier.hex()}, histogram)
+                for k, stats in snapshot for identifier, histogram in sorted(stats.requests.items())]
+    lines = _histogram('samil_request_duration_seconds', 'Time from sending a request until the response.',
+                       requests)
+    lines += _histogram('samil_keep_alive_duration_seconds', 'Time of keep-alive exchanges.',
+                        [({'serial_number': k}, stats.keep_alives) for k, stats in snapshot])
+    for attribute, name, description in _COUNTERS:
+        lines += _metric(name, 'counter', description,
+                         [({'serial_number': k}, getattr(stats, attribute)) for k, stats in snapshot])
+    return lines
+
+
+def _metric(name: str, metric_type: str, description: str, samples: List[Tuple[Dict, object]]) -> List[str]:
+    """Returns the lines of a metric, or no lines when there are no samples."""
+    if not samples:
+        return []
+    lines = ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, metric_type)]
+    lines += ['{}{} {}'.format(name, _labels(labels), value) for labels, value in samples]
+    return lines
+
+
+def _histogram(name: str, description: str, samples: List[Tuple[Dict, Histogram]]) -> List[str]:
+    """Returns the lines of a histogram metric, or no lines when there are no samples."""
+    if not samples:
+        return []
+    lines = ['# HELP {} {}'.format(name, description), '# TYPE {} histogram'.format(name)]
+    for labels, histogram in samples:
+        for bound, count in histogram.cumulative():
+            lines.append('{}_bucket{} {}'.format(name, _labels(dict(labels, le=_format_bound(bound))), count))
+        lines.append('{}_sum{} {}'.format(name, _labels(labels), histogram.sum))
+        lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+    return lines
+
+
+def _format_bound(bound: float) -> str:
+    """Formats a bucket upper bound."""
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _labels(labels: Dict) -> str:
+    """Formats labels, with escaped values."""
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                          for k, v in sorted(labels.items())) + '}'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the rendered status cache on /metrics."""
+
+    def do_GET(self):
+        """Responds with the metrics."""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.cache.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Logs requests at debug level."""
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """HTTP server for the Prometheus metrics endpoint.
+
+    Serves from a background thread once started. Needs to be closed after
+    use, or used as context manager.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, cache: StatusCache, address: str = '', port: int = 9850):
+        """Constructor, binds the server socket.
+
+        Args:
+            cache: The status cache to serve.
+            address: Address to listen on, all interfaces by default.
+            port: TCP port to listen on, 0 picks a free port.
+        """
+        super().__init__((address, port), _MetricsHandler)
+        self.cache = cache
+        self._thread = None
+
+    def __enter__(self):
+        """Starts serving and returns self."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def start(self):
+        """Starts serving from a background thread."""
+        self._thread = Thread(target=self.serve_forever, args=(0.1,), daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops serving and closes the server socket."""
+        if self._thread:
+            self.shutdown()
+            self._thread.join()
+        self.server_close()
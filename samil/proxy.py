@@ -0,0 +1,248 @@
+"""Proxy that shares inverter connections between multiple clients.
+
+An inverter talks to only one client at a time. The proxy owns the inverter
+connection and listens on a local TCP or Unix socket for clients, which use
+the same message format as the inverter itself. A client can therefore use
+the Inverter class on a socket connected to the proxy, see connect.
+"""
+import logging
+import os
+import socket
+import stat
+from concurrent.futures import Future
+import socketserver
+from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+from threading import Lock, Thread
+from time import monotonic
+from typing import Tuple, Union
+
+from samil.inverter import construct_message, Inverter, InverterEOFError, read_message
+
+logger = logging.getLogger(__name__)
+
+# Requests without payload of which the response is shared by all clients. The
+# value is the time in seconds that a response stays fresh, None to use the
+# max age of the proxy.
+SHARED_REQUESTS = {
+    b'\x01\x03\x02': float('inf'),  # Model
+    b'\x01\x00\x02': float('inf'),  # Status format
+    b'\x01\x02\x02': None,  # Status
+}
+
+
+def response_identifier(identifier: bytes) -> bytes:
+    """Returns the start of the response identifier for a request identifier, e.g. 01 82 for 01 02 02."""
+    return bytes([identifier[0], identifier[1] | 0x80])
+
+
+class InverterProxy:
+    """Handles client requests using a single inverter connection.
+
+    Concurrent requests for the model, status format or status are
+    coalesced into a single inverter request. Their responses are cached:
+    the model and status format for the lifetime of the connection and the
+    status for max_age seconds. Other requests are forwarded as-is.
+    Thread-safe, when the inverter is, e.g. KeepAliveInverter.
+    """
+
+    def __init__(self, inverter: Inverter, max_age: float = 5.0):
+        """Constructor.
+
+        Args:
+            inverter: The inverter connection, a KeepAliveInverter keeps it
+                alive while no client makes requests.
+            max_age: Time in seconds that a status response is reused.
+        """
+        self.inverter = inverter
+        self.max_age = max_age
+        self.requests = 0  # Number of client requests
+        self.forwarded = 0  # Number of requests sent to the inverter
+        self._cache = {}  # Time and response by request identifier
+        self._in_flight = {}  # Future response of the pending request by identifier
+        self._lock = Lock()
+
+    def request(self, identifier: bytes, payload: bytes) -> Tuple[bytes, bytes]:
+        """Returns the identifier and payload of the inverter response to a request.
+
+        Raises:
+            Exception: The exceptions of Inverter.request.
+        """
+        with self._lock:
+            self.requests += 1
+            if payload or identifier not in SHARED_REQUESTS:
+                future = None
+            else:
+                cached = self._cache.get(identifier)
+                max_age = SHARED_REQUESTS[identifier]
+                if cached and monotonic() - cached[0] <= (self.max_age if max_age is None else max_age):
+                    return cached[1]
+                future = self._in_flight.get(identifier)
+                leader = future is None
+                if leader:
+                    future = self._in_flight[identifier] = Future()
+        if future is None:
+            return self._forward(identifier, payload)
+        if not leader:
+            # Wait for the request of another client
+            return future.result()
+        try:
+            response = self._forward(identifier, payload)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[identifier]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._cache[identifier] = (monotonic(), response)
+            del self._in_flight[identifier]
+        future.set_result(response)
+        return response
+
+    def _forward(self, identifier: bytes, payload: bytes) -> Tuple[bytes, bytes]:
+        """Sends a request to the inverter and returns the response."""
+        with self._lock:
+            self.forwarded += 1
+        return self.inverter.request(identifier, payload, response_identifier(identifier))
+
+
+def _connection_lost(error: Exception) -> bool:
+    """Returns whether an exception of an inverter request means that the inverter connection is lost."""
+    return isinstance(error, (InverterEOFError, OSError)) and not isinstance(error, socket.timeout)
+
+
+class _ProxyHandler(StreamRequestHandler):
+    """Answers the requests of a client connection, one at a time."""
+
+    def handle(self):
+        """Reads requests until the client disconnects."""
+        while True:
+            try:
+                identifier, payload = read_message(self.rfile)
+            except InverterEOFError:
+                return
+            except ValueError as e:
+                logger.warning("Invalid message from client %s, disconnecting: %s", self.client_address, e)
+                return
+            try:
+                response = self.server.proxy.request(identifier, payload)
+            except Exception as e:
+                if _connection_lost(e):
+                    logger.error("Connection to inverter %s lost", self.server.proxy.inverter.addr, exc_info=True)
+                    self.server.error = e
+                else:
+                    # E.g. a request that the inverter does not answer, only this client is affected
+                    logger.error("Request %s for inverter %s failed, disconnecting client %s", identifier.hex(),
+                                 self.server.proxy.inverter.addr, self.client_address, exc_info=True)
+                return
+            self.wfile.write(construct_message(*response))
+
+
+class _ProxyServerMixIn(ThreadingMixIn):
+    """Serves an InverterProxy from a background thread, see ProxyServer."""
+
+    daemon_threads = True
+    error = None  # The exception when the inverter connection was lost
+    _thread = None
+
+    def __enter__(self):
+        """Starts serving and returns self."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def start(self):
+        """Starts serving from a background thread."""
+        self._thread = Thread(target=self.serve_forever, args=(0.1,), daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops serving and closes the server socket."""
+        if self._thread:
+            self.shutdown()
+            self._thread.join()
+        self.server_close()
+
+
+class ProxyServer(_ProxyServerMixIn, TCPServer):
+    """TCP server for an InverterProxy.
+
+    Each client is handled in a separate thread. Needs to be closed after
+    use, or used as context manager. The error attribute is set when the
+    inverter connection is lost. When a request fails for another reason,
+    e.g. a timeout, only the connection of that client is closed.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, proxy: InverterProxy, address: Tuple[str, int]):
+        """Constructor, binds the server socket.
+
+        Args:
+            proxy: The proxy to serve.
+            address: Host and port to listen on, port 0 picks a free port.
+        """
+        super().__init__(address, _ProxyHandler)
+        self.proxy = proxy
+
+
+# Unix sockets are not available on Windows
+UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+if UNIX_SOCKETS:
+    class UnixProxyServer(_ProxyServerMixIn, socketserver.UnixStreamServer):
+        """Unix socket server for an InverterProxy, see ProxyServer.
+
+        Only defined when the platform supports Unix sockets, see
+        UNIX_SOCKETS.
+        """
+
+        def __init__(self, proxy: InverterProxy, path: str):
+            """Constructor, binds the server socket.
+
+            Args:
+                proxy: The proxy to serve.
+                path: Path of the socket, an existing socket is replaced.
+            """
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.remove(path)  # Left behind by an earlier run
+            super().__init__(path, _ProxyHandler)
+            self.proxy = proxy
+
+        def server_close(self):
+            """Closes and removes the socket."""
+            super().server_close()
+            try:
+                os.remove(self.server_address)
+            except OSError:
+                pass
+
+
+def parse_address(value: str) -> Union[str, Tuple[str, int]]:
+    """Returns the address for a HOST:PORT string, or the value itself as Unix socket path when it has no port."""
+    host, sep, port = value.rpartition(':')
+    if sep and port.isdigit() and '/' not in value:
+        return host or '127.0.0.1', int(port)
+    return value
+
+
+def connect(address: Union[str, Tuple[str, int]]) -> socket.socket:
+    """Returns a socket connected to a proxy at a Unix socket path or a host and port.
+
+    Raises:
+        OSError: When the connection failed, or for a Unix socket path on a
+            platform without Unix sockets.
+    """
+    if isinstance(address, str):
+        if not UNIX_SOCKETS:
+            raise OSError("Unix sockets are not supported on this platform, use HOST:PORT")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    return socket.create_connection(address)
@@ -1,10 +1,18 @@
 """PVOutput.org methods."""
+import json
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional
-from urllib.parse import urlencode
+import re
+import sqlite3
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from time import time
+from typing import List, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
 from urllib.request import Request, urlopen
 
+logger = logging.getLogger(__name__)
+
 
 def add_status(system, api_key, date: datetime = None, energy_gen=None, power_gen=None, energy_con=None,
                power_con=None, temp=None, voltage=None, cumulative=False, net=False):
@@ -107,3 +115,392 @@ def aggregate_statuses(statuses: List[Dict], dc_voltage=False) -> Optional[Dict]
         'temp': round(avg(v['temp'] for v in values), 1),
         'voltage': round(avg(v['voltage'] for v in values), 1),
     }
+
+
+class PVOutputError(Exception):
+    """PVOutput.org returned an error response."""
+
+    def __init__(self, status: int, message: str):
+        """Constructor."""
+        super().__init__("{} {}".format(status, message))
+        self.status = status
+        self.message = message
+
+
+class RequestBudget:
+    """Keeps track of the PVOutput.org requests that can be made.
+
+    Counts the requests in the last hour and uses the rate limit information
+    returned by PVOutput.org. The rate limit applies per API key, clients
+    that use the same key should share the budget.
+    """
+
+    def __init__(self, limit: int = 60):
+        """Constructor.
+
+        Args:
+            limit: Maximum number of requests per hour, 60 normally and 300
+                in donation mode.
+        """
+        self.limit = limit
+        self._requests = deque()  # Times of the requests in the last hour
+        self.remaining = None  # Remaining requests as reported by PVOutput.org
+        self.reset = None  # Time at which the remaining requests are reset
+
+    def record(self):
+        """Records a request."""
+        self._requests.append(time())
+
+    def update(self, remaining: int, reset: int):
+        """Stores the rate limit information returned by PVOutput.org."""
+        self.remaining = remaining
+        self.reset = reset
+
+    def available(self) -> int:
+        """Returns the number of requests that can be made now."""
+        now = time()
+        while self._requests and self._requests[0] <= now - 3600:
+            self._requests.popleft()
+        available = self.limit - len(self._requests)
+        if self.remaining is not None and self.reset is not None and now < self.reset:
+            available = min(available, self.remaining)
+        return max(available, 0)
+
+    def wait_time(self) -> float:
+        """Returns the number of seconds until a request can be made."""
+        if self.available():
+            return 0.0
+        now = time()
+        wait = 0.0
+        if len(self._requests) >= self.limit:
+            wait = self._requests[len(self._requests) - self.limit] + 3600 - now
+        if self.remaining is not None and self.remaining <= 0 and self.reset is not None:
+            wait = max(wait, self.reset - now)
+        return max(wait, 0.0)
+
+
+class PVOutputClient:
+    """PVOutput.org API client which reuses a single keep-alive connection.
+
+    Not thread-safe.
+    """
+
+    def __init__(self, system_id, api_key, url: str = 'https://pvoutput.org', rate_limit: int = 60,
+                 timeout: float = 30.0, budget: RequestBudget = None):
+        """Constructor.
+
+        Args:
+            system_id: PVOutput.org system ID.
+            api_key: PVOutput.org API key.
+            url: Base URL of the API.
+            rate_limit: Maximum number of requests per hour, 60 normally and
+                300 in donation mode. Not used when a budget is given.
+            timeout: Connection timeout in seconds.
+            budget: Request budget, to share it with other clients that use
+                the same API key.
+        """
+        self.system_id = system_id
+        self.api_key = api_key
+        parts = urlsplit(url)
+        self._connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+        self._host = parts.netloc
+        self._path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.budget = budget if budget is not None else RequestBudget(rate_limit)
+        self._connection = None
+
+    def close(self):
+        """Closes the connection, a new one is made for the next request."""
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def wait_time(self) -> float:
+        """Returns the number of seconds until a request can be made without exceeding the rate limit."""
+        return self.budget.wait_time()
+
+    def post(self, path: str, data: Dict) -> str:
+        """Does a POST request and returns the response body.
+
+        Raises:
+            PVOutputError: When PVOutput.org returns a non-200 status code.
+            OSError: On connection errors.
+            HTTPException: On protocol errors.
+        """
+        body = urlencode(data)
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-Pvoutput-SystemId': str(self.system_id),
+            'X-Pvoutput-Apikey': self.api_key,
+            'X-Rate-Limit': '1',
+        }
+        logger.debug("PVOutput.org request: %s %s", path, body)
+        # A kept-alive connection might have been closed by the server, retry once on a new connection
+        reused = self._connection is not None
+        while True:
+            if not self._connection:
+                self._connection = self._connection_class(self._host, timeout=self.timeout)
+            try:
+                self._connection.request('POST', self._path + path, body, headers)
+                response = self._connection.getresponse()
+                # Only requests that reached PVOutput.org count, not a failed attempt on a stale connection
+                self.budget.record()
+                text = response.read().decode('utf-8', 'replace').strip()
+                break
+            except (OSError, HTTPException):
+                self.close()
+                if not reused:
+                    raise
+                reused = False
+        self._update_rate_limit(response)
+        if response.will_close:
+            self.close()
+        if response.status != 200:
+            raise PVOutputError(response.status, text)
+        return text
+
+    def _update_rate_limit(self, response):
+        """Stores the rate limit information from the response headers."""
+        try:
+            self.budget.update(int(response.getheader('X-Rate-Limit-Remaining')),
+                               int(response.getheader('X-Rate-Limit-Reset')))
+        except (TypeError, ValueError):
+            pass  # Headers not present
+
+    def add_batch_status(self, statuses: List[Tuple[datetime, Dict]], cumulative=False, net=False) -> List[bool]:
+        """Uploads multiple statuses in one request.
+
+        See API doc: https://pvoutput.org/help/api_specification.html#add-batch-status-service.
+
+        Args:
+            statuses: List of date and status data pairs, the status data has
+                the keyword arguments of add_status. At most 30 statuses, or
+                100 in donation mode.
+            cumulative: See add_status.
+            net: See add_status.
+
+        Returns:
+            For each status whether it was added. A status is not added for
+            instance when it already exists.
+        """
+        def value(v):
+            """Formats a value, None becomes empty."""
+            return '' if v is None else str(v)
+
+        items = []
+        for date, data in statuses:
+            items.append(','.join([date.strftime('%Y%m%d'), date.strftime('%H:%M')] + [
+                value(data.get(k)) for k in ('energy_gen', 'power_gen', 'energy_con', 'power_con', 'temp', 'voltage')
+            ]))
+        data = {'data': ';'.join(items)}
+        if cumulative:
+            data['c1'] = '1'
+        if net:
+            data['n'] = '1'
+        response = self.post('/service/r2/addbatchstatus.jsp', data)
+        # Response has date, time and added flag for each status, e.g. 20110112,10:00,1;20110112,10:05,0
+        results = [item.split(',') for item in response.split(';') if item]
+        return [len(r) >= 3 and r[2] == '1' for r in results]
+
+
+class StatusQueue:
+    """Queue of statuses waiting to be uploaded, stored in SQLite.
+
+    There is at most one status per minute, a later status with the same
+    time replaces the earlier one.
+    """
+
+    def __init__(self, path: str = ':memory:', name: str = 'status'):
+        """Constructor.
+
+        Args:
+            path: SQLite database file, created if it does not exist. By
+                default the queue is kept in memory.
+            name: Name of the queue, multiple queues can be stored in the same
+                file. Should consist of letters, digits and underscores.
+        """
+        if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+            raise ValueError("Invalid queue name: {}".format(name))
+        self._table = name
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS {} (time TEXT PRIMARY KEY, data TEXT NOT NULL)'.format(name))
+
+    def __len__(self):
+        """Returns the number of queued statuses."""
+        return self._db.execute('SELECT COUNT(*) FROM {}'.format(self._table)).fetchone()[0]
+
+    def close(self):
+        """Closes the database."""
+        self._db.close()
+
+    def put(self, date: datetime, status_data: Dict):
+        """Adds a status, see add_status for the status data."""
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(self._table),
+                             (self._key(date), json.dumps(status_data, default=str)))
+
+    def peek(self, n: int) -> List[Tuple[datetime, Dict]]:
+        """Returns the n oldest statuses, without removing them."""
+        rows = self._db.execute('SELECT time, data FROM {} ORDER BY time LIMIT ?'.format(self._table), (n,))
+        return [(datetime.strptime(key, '%Y%m%d %H:%M'), json.loads(data)) for key, data in rows]
+
+    def remove(self, dates: List[datetime]):
+        """Removes the statuses with the given dates."""
+        with self._db:
+            self._db.executemany('DELETE FROM {} WHERE time = ?'.format(self._table), [(self._key(d),) for d in dates])
+
+    def remove_before(self, date: datetime) -> int:
+        """Removes statuses older than the given date and returns the number removed."""
+        with self._db:
+            return self._db.execute('DELETE FROM {} WHERE time < ?'.format(self._table), (self._key(date),)).rowcount
+
+    @staticmethod
+    def _key(date: datetime) -> str:
+        """Returns the key for a date, which sorts chronologically."""
+        return date.strftime('%Y%m%d %H:%M')
+
+
+class StatusUploader:
+    """Queues statuses and uploads them in batches.
+
+    Statuses that could not be uploaded, for instance because of a network
+    outage, stay in the queue and are uploaded by a later flush. When
+    PVOutput.org rejects a batch, it is split in halves until the rejected
+    status is found, so that only that status is dropped.
+    """
+
+    def __init__(self, client: PVOutputClient, queue: StatusQueue = None, batch_size: int = 30,
+                 max_age: timedelta = timedelta(days=14), cumulative=False, net=False):
+        """Constructor.
+
+        Args:
+            client: The client to upload with.
+            queue: The queue to use, by default an in-memory queue.
+            batch_size: Maximum number of statuses per request, 30 normally
+                and 100 in donation mode.
+            max_age: Statuses older than this are dropped, as PVOutput.org
+                does not accept them. This is 14 days normally and 90 days in
+                donation mode.
+            cumulative: See add_status.
+            net: See add_status.
+        """
+        self.client = client
+        self.queue = queue if queue is not None else StatusQueue()
+        self.batch_size = batch_size
+        self._size = batch_size  # Smaller while searching for a status that PVOutput.org rejects
+        self.max_age = max_age
+        self.cumulative = cumulative
+        self.net = net
+
+    def add(self, date: datetime, status_data: Dict):
+        """Adds a status to the queue, see add_status for the status data."""
+        self.queue.put(date, status_data)
+
+    def flush(self, max_requests: int = None) -> int:
+        """Uploads queued statuses as long as the rate limit allows.
+
+        Errors are logged, the statuses then stay in the queue.
+
+        Args:
+            max_requests: Maximum number of requests to make.
+
+        Returns:
+            Number of statuses that were uploaded.
+        """
+        removed = self.queue.remove_before(datetime.now() - self.max_age)
+        if removed:
+            logger.warning("Dropped %s queued status(es) which are too old to upload", removed)
+        uploaded = 0
+        requests = 0
+        while max_requests is None or requests < max_requests:
+            batch = self.queue.peek(self._size)
+            if not batch:
+                return uploaded
+            wait = self.client.wait_time()
+            if wait > 0:
+                logger.info("Rate limit reached, %s status(es) stay queued for at least %.0f seconds",
+                            len(self.queue), wait)
+                return uploaded
+            requests += 1
+            try:
+                added = self._upload(batch)
+            except PVOutputError as e:
+                logger.warning("Uploading to PVOutput.org failed: %s", e)
+                return uploaded
+            except (OSError, HTTPException) as e:
+                logger.warning("Uploading to PVOutput.org failed, %s status(es) queued: %s", len(self.queue), e)
+                return uploaded
+            if added is None:
+                continue  # Retry with a smaller batch
+            if added.count(False):
+                logger.info("PVOutput.org did not add %s status(es), these probably already existed",
+                            added.count(False))
+            self.queue.remove([date for date, data in batch])
+            uploaded += added.count(True)
+        return uploaded
+
+    def _upload(self, batch: List[Tuple[datetime, Dict]]) -> Optional[List[bool]]:
+        """Uploads a batch, see add_batch_status.
+
+        Returns:
+            For each status whether it was added, an empty list when the
+            status was rejected and needs to be dropped, or None when the
+            batch was rejected and needs to be retried in smaller batches.
+
+        Raises:
+            PVOutputError: When PVOutput.org returns an error other than 400.
+            OSError: On connection errors.
+            HTTPException: On protocol errors.
+        """
+        try:
+            return self.client.add_batch_status(batch, cumulative=self.cumulative, net=self.net)
+        except PVOutputError as e:
+            if e.status != 400:
+                raise
+            if len(batch) > 1:
+                # One of the statuses is probably invalid, retry with the first half to find it
+                logger.warning("PVOutput.org rejected a batch of %s statuses, retrying in smaller batches: %s",
+                               len(batch), e)
+                self._size = len(batch) // 2
+                return None
+            # The status is invalid, retrying won't help
+            logger.error("PVOutput.org rejected the status of %s, dropping it: %s", batch[0][0], e)
+            self._size = self.batch_size
+            return []
+
+
+class UploadScheduler:
+    """Flushes the queues of multiple uploaders without exceeding rate limits.
+
+    The available requests of each request budget are divided evenly among
+    the uploaders that share it and have statuses queued. Which uploader
+    gets the remainder rotates on each flush. Statuses that don't fit in
+    the budget stay queued and are uploaded in a later flush, batched with
+    newer statuses.
+    """
+
+    def __init__(self, uploaders: List[StatusUploader]):
+        """Constructor."""
+        self.uploaders = list(uploaders)
+        self._rotation = 0
+
+    def flush(self) -> int:
+        """Flushes all uploaders, returns the number of uploaded statuses."""
+        groups = OrderedDict()  # Uploaders grouped by budget
+        for uploader in self.uploaders:
+            groups.setdefault(id(uploader.client.budget), []).append(uploader)
+        self._rotation += 1
+        uploaded = 0
+        for group in groups.values():
+            pending = [u for u in group if len(u.queue)]
+            if not pending:
+                continue
+            offset = self._rotation % len(pending)
+            pending = pending[offset:] + pending[:offset]
+            available = pending[0].client.budget.available()
+            for i, uploader in enumerate(pending):
+                share = available // len(pending) + (1 if i < available % len(pending) else 0)
+                if share:
+                    uploaded += uploader.flush(max_requests=share)
+        return uploaded
@@ -0,0 +1,204 @@
+"""Recording and replaying of the raw inverter connection traffic."""
+import logging
+import socket
+from collections import namedtuple
+from struct import Struct
+from threading import Lock
+from time import monotonic, sleep
+from typing import BinaryIO, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Direction of a recorded chunk of data, seen from the application
+SENT = 0
+RECEIVED = 1
+
+_MAGIC = b'SAMILREC\x01'  # File signature followed by the format version
+_RECORD = Struct('>BdI')  # Direction, seconds since start of the recording, data length
+
+RecordedData = namedtuple('RecordedData', ['direction', 'time', 'data'])
+
+
+class FrameRecorder:
+    """Writes the raw data of an inverter connection to a binary log file.
+
+    Each chunk of data is stored with its direction and the monotonic time
+    since the recorder was created. Sent data is recorded per message,
+    received data per chunk as returned by the socket, so that a replay also
+    reproduces messages that arrived chopped or several at once.
+
+    Pass an instance to Inverter to record its connection. Thread-safe, but
+    use one recorder per connection. Needs to be closed after use, or used as
+    context manager.
+    """
+
+    def __init__(self, path: str):
+        """Constructor.
+
+        Args:
+            path: Log file path, an existing file is overwritten.
+        """
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._start = monotonic()
+        self._lock = Lock()
+
+    def __enter__(self):
+        """Returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def sent(self, data: bytes):
+        """Records data that was sent to the inverter."""
+        self._record(SENT, data)
+
+    def received(self, data: bytes):
+        """Records data that was received from the inverter."""
+        self._record(RECEIVED, data)
+
+    def wrap_recv_into(self, recv_into: Callable[[memoryview], int]) -> Callable[[memoryview], int]:
+        """Returns a recv_into function that records all received data.
+
+        Args:
+            recv_into: Function that writes data into the given buffer and
+                returns the number of bytes written, e.g. socket.recv_into.
+        """
+        def recording_recv_into(buffer: memoryview) -> int:
+            n = recv_into(buffer)
+            if n:
+                self.received(buffer[:n])
+            return n
+        return recording_recv_into
+
+    def close(self):
+        """Closes the log file."""
+        with self._lock:
+            self._file.close()
+
+    def _record(self, direction: int, data: bytes):
+        """Appends a record to the log file and flushes it."""
+        with self._lock:
+            self._file.write(_RECORD.pack(direction, monotonic() - self._start, len(data)))
+            self._file.write(data)
+            self._file.flush()
+
+
+def read_recording(file: BinaryIO) -> Iterator[RecordedData]:
+    """Reads the records of a log file written by FrameRecorder.
+
+    A record that was not completely written, because of a crash, is left
+    out.
+
+    Raises:
+        ValueError: When the file is not a recording.
+    """
+    if file.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError("Not a recording or unsupported version")
+    while True:
+        header = file.read(_RECORD.size)
+        if not header:
+            return
+        if len(header) == _RECORD.size:
+            direction, time, length = _RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) == length:
+                yield RecordedData(direction, time, data)
+                continue
+        logger.warning("Incomplete record at the end of recording %s", getattr(file, 'name', ''))
+        return
+
+
+class ReplaySocket:
+    """Socket replacement that replays the received data of a recording.
+
+    Use it in place of a connected socket to feed a recorded session into
+    Inverter. The data received in the recording is returned in the same
+    chunks, either at the recorded times or as fast as possible. Data sent to
+    it is discarded, so the application should make the same requests as in
+    the recording. After the last chunk, EOF is returned.
+
+    With a timeout set, receiving raises socket.timeout when the next chunk is
+    due later than the timeout, like the recorded connection would have done.
+    """
+
+    def __init__(self, path: str, speed: Optional[float] = 1.0):
+        """Constructor.
+
+        Args:
+            path: Log file written by FrameRecorder.
+            speed: Replay speed relative to the recording, e.g. 60 replays an
+                hour in a minute. None replays as fast as possible.
+        """
+        self.speed = speed
+        self._file = open(path, 'rb')
+        self._records = (r for r in read_recording(self._file) if r.direction == RECEIVED)
+        self._next = None  # Next chunk, when it was not yet due
+        self._pending = memoryview(b'')  # Part of the current chunk that is not yet returned
+        self._start = monotonic()
+        self._timeout = None
+
+    def makefile(self, mode: str = 'rwb'):
+        """Returns a file object that discards written data."""
+        return _DiscardFile()
+
+    def settimeout(self, timeout: Optional[float]):
+        """Sets the receive timeout in seconds, None blocks."""
+        self._timeout = timeout
+
+    def recv_into(self, buffer: memoryview, nbytes: int = 0) -> int:
+        """Writes the next recorded data into the buffer.
+
+        Returns:
+            The number of bytes written, 0 when the recording has ended.
+
+        Raises:
+            socket.timeout: When the next chunk is not due within the timeout.
+        """
+        if not self._pending:
+            record = self._next or next(self._records, None)
+            if record is None:
+                return 0
+            self._next = record
+            self._wait(record.time)
+            self._next = None
+            self._pending = memoryview(record.data)
+        n = min(nbytes or len(buffer), len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def shutdown(self, how: int):
+        """Does nothing, for compatibility with socket."""
+
+    def close(self):
+        """Closes the recording."""
+        self._file.close()
+
+    def _wait(self, time: float):
+        """Sleeps until the recorded time is reached."""
+        if not self.speed:
+            return
+        wait = self._start + time / self.speed - monotonic()
+        if self._timeout is not None and wait > self._timeout:
+            sleep(self._timeout)
+            raise socket.timeout('timed out')
+        if wait > 0:
+            sleep(wait)
+
+
+class _DiscardFile:
+    """Writable file object that discards all data."""
+
+    def write(self, data: bytes) -> int:
+        """Returns the length of the data."""
+        return len(data)
+
+    def flush(self):
+        """Does nothing."""
+
+    def close(self):
+        """Does nothing."""
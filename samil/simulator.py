@@ -0,0 +1,443 @@
+"""Simulates a fleet of inverters for testing without hardware.
+
+Each virtual inverter behaves like the real hardware: it waits for the
+server advertisement broadcast on UDP port 1300 and then connects back to
+the advertising host on TCP port 1200, where it answers requests. All
+inverters run in one asyncio event loop, so that a single process can
+simulate thousands of them. Mind the open file limit (ulimit -n) when
+simulating many inverters.
+
+Faults like dropped responses, corrupted frames and silent connections can
+be injected to test the recovery of the application, see Faults.
+
+Usage: python -m samil.simulator --help
+"""
+import asyncio
+import logging
+import socket
+from collections import Counter, namedtuple, OrderedDict
+from math import cos, pi, sin
+from random import expovariate, gauss, Random, uniform
+from struct import Struct
+from time import localtime, time
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import click
+
+from samil.inverter import construct_message, FrameParser
+
+logger = logging.getLogger(__name__)
+
+# Fixed payloads of an inverter type, the status payload is used as a template
+InverterProfile = namedtuple('InverterProfile', ['model', 'status_format', 'status', 'peak_power'])
+
+# SolarRiver 4500 TL-D
+RIVER = InverterProfile(
+    model=b'1  4500V1.30River 4500TL-D\x00 SamilPower\x00     DW413B8080\x00\x00\x00\x00\x00\x00V1.30V1.302',
+    status_format=b'\x00\x01\x02\x04\x05\x09\x0a\x0c\x11\x17\x18\x1b\x1c\x1d\x1e\x1f\x20\x21\x22\x27\x28\x31\x32'
+                  b'\x33\x34\x35\x36',
+    status=bytes(
+        [1, 119, 11, 159, 11, 246, 0, 21, 0, 20, 0, 0, 40, 64, 0, 1, 1, 218, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+         0, 0, 0, 0, 0, 0, 0, 0, 2, 136, 2, 111, 0, 55, 9, 20, 19, 134, 4, 238, 0, 1, 177, 204]),
+    peak_power=4500,
+)
+
+# SolarLake 17K
+LAKE = InverterProfile(
+    model=b'2 170002.11\x00SolarLake17K    SamilPower      T1712CC008\x00\x00\x00\x00\x00\x002.11\x002.11\x001',
+    status_format=b'\x00\x01\x02\x04\x05\x07\x08\x09\x0a\x0b\x0c\x11\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x21\x22\x27'
+                  b'\x28\x2f\x31\x32\x33\x51\x52\x53\x71\x72\x73',
+    status=bytes(
+        [1, 94, 22, 233, 0, 67, 0, 48, 0, 1, 0, 0, 3, 2, 0, 0, 0, 45, 10, 29, 0, 1, 8, 72, 0, 0, 0, 0, 0, 0, 0, 0,
+         0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 11, 6, 0, 0, 2, 18, 0, 36, 9, 122, 19, 137, 0, 37, 9, 141, 19, 137,
+         0, 36, 9, 121, 19, 137]),
+    peak_power=17000,
+)
+
+PROFILES = {'river': RIVER, 'lake': LAKE}
+
+_ADVERTISEMENT = construct_message(b'\x00\x40\x02', b'I AM SERVER')
+_UNKNOWN_PAYLOAD = b'\x02' + 160 * b'\x00'  # Response to request 04 00 02, meaning unknown
+_SERIAL_NUMBER = slice(44, 60)  # Position of the serial number in the model payload
+_PV_VOLTAGE = 300.0  # PV voltage while producing
+_EFFICIENCY = 0.97  # Output power relative to PV input power
+
+# Faults that can be injected in a response
+DROP = 'drop'  # No response is sent
+CORRUPT = 'corrupt'  # The checksum is wrong
+TRUNCATE = 'truncate'  # Only the first part of the message is sent
+UNEXPECTED = 'unexpected'  # A message with another identifier is sent instead
+SILENCE = 'silence'  # No response is sent and the connection stays open without sending anything anymore
+
+
+class Faults:
+    """Injects faults in the responses of virtual inverters.
+
+    For each response at most one fault is chosen at random, with the given
+    probabilities. An instance can be shared by multiple inverters and can be
+    changed or replaced while they are connected.
+    """
+
+    def __init__(self, drop: float = 0.0, corrupt: float = 0.0, truncate: float = 0.0, unexpected: float = 0.0,
+                 silence: float = 0.0, seed=None):
+        """Constructor.
+
+        Args:
+            drop: Probability that a response is dropped.
+            corrupt: Probability that a response has an invalid checksum.
+            truncate: Probability that a response is cut off.
+            unexpected: Probability that a response has an identifier that
+                was not requested.
+            silence: Probability that the inverter stops responding, while
+                keeping the connection open.
+            seed: Seed for the random generator, for reproducible faults.
+        """
+        self.probabilities = OrderedDict([(DROP, drop), (CORRUPT, corrupt), (TRUNCATE, truncate),
+                                          (UNEXPECTED, unexpected), (SILENCE, silence)])
+        if sum(self.probabilities.values()) > 1:
+            raise ValueError("Sum of fault probabilities is larger than 1")
+        self.random = Random(seed)
+        self.injected = Counter()  # Number of injected faults by fault
+
+    def choose(self) -> Optional[str]:
+        """Returns the fault for the next response, or None."""
+        r = self.random.random()
+        for fault, probability in self.probabilities.items():
+            if r < probability:
+                self.injected[fault] += 1
+                return fault
+            r -= probability
+        return None
+
+    def apply(self, fault: str, message: bytes) -> bytes:
+        """Returns the message with a corrupt, truncate or unexpected fault applied."""
+        if fault == CORRUPT:
+            return message[:-1] + bytes([message[-1] ^ 0xff])
+        if fault == TRUNCATE:
+            return message[:self.random.randint(1, len(message) - 1)]
+        if fault == UNEXPECTED:
+            return construct_message(b'\x04\x80\x00', _UNKNOWN_PAYLOAD)
+        return message
+
+
+def parse_latency(spec: str) -> Union[float, Callable[[], float]]:
+    """Parses a response latency distribution.
+
+    The specification is a number of seconds, 'uniform:LOW,HIGH',
+    'exp:MEAN' or 'normal:MEAN,STDDEV'. Negative samples of the normal
+    distribution are taken as 0.
+
+    Raises:
+        ValueError: When the specification is invalid.
+    """
+    name, sep, args = spec.partition(':')
+    if not sep:
+        return float(spec)
+    params = [float(v) for v in args.split(',')]
+    if name == 'uniform' and len(params) == 2:
+        return lambda: uniform(*params)
+    if name == 'exp' and len(params) == 1 and params[0] > 0:
+        return lambda: expovariate(1 / params[0])
+    if name == 'normal' and len(params) == 2:
+        return lambda: max(gauss(*params), 0.0)
+    raise ValueError("Invalid latency distribution: {}".format(spec))
+
+
+class VirtualInverter:
+    """Simulated inverter with a synthetic diurnal power curve.
+
+    The output power follows a half sine between sunrise and sunset, peaking
+    at the peak power at noon. Outside of that the inverter reports 'PV power
+    off'. The other status values are taken from the profile.
+    """
+
+    def __init__(self, serial_number: str, profile: InverterProfile = RIVER, peak_power: float = None,
+                 latency: Union[float, Callable[[], float]] = 0.0, sunrise: float = 6.0, sunset: float = 20.0,
+                 energy_total: float = 1000.0, faults: Faults = None, clock: Callable[[], float] = time):
+        """Constructor.
+
+        Args:
+            serial_number: Serial number reported in the model, at most 16
+                characters.
+            profile: Model, status format and status template.
+            peak_power: Output power in W at noon, defaults to the peak power
+                of the profile.
+            latency: Time in seconds before each response is sent, or a
+                function that returns it for each response, see
+                parse_latency.
+            sunrise: Local time of day in hours at which production starts.
+            sunset: Local time of day in hours at which production stops.
+            energy_total: Total energy in kWh at the start of the day.
+            faults: Optional faults to inject in the responses.
+            clock: Returns the current time as seconds since epoch.
+        """
+        self.serial_number = serial_number
+        self.profile = profile
+        self.peak_power = profile.peak_power if peak_power is None else peak_power
+        self.latency = latency
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.energy_total = energy_total
+        self.faults = faults
+        self.clock = clock
+        self.connected = False
+        self.requests = 0  # Number of requests answered
+
+        model = bytearray(profile.model)
+        model[_SERIAL_NUMBER] = serial_number.encode('ascii')[:16].ljust(16, b'\x00')
+        self.model = bytes(model)
+        self._struct = Struct('>{}H'.format(len(profile.status_format)))
+        self._template = self._struct.unpack_from(profile.status)
+
+    def power(self, now: float) -> Tuple[float, float]:
+        """Returns the output power in W and the energy produced today in kWh at the given time."""
+        t = localtime(now)
+        hour = t.tm_hour + t.tm_min / 60 + t.tm_sec / 3600
+        length = self.sunset - self.sunrise
+        x = min(max((hour - self.sunrise) / length, 0.0), 1.0)
+        power = self.peak_power * sin(pi * x)
+        energy = self.peak_power / 1000 * length / pi * (1 - cos(pi * x))
+        return power, energy
+
+    def status(self, now: float) -> bytes:
+        """Returns the status payload at the given time."""
+        power, energy = self.power(now)
+        words = list(self._template)
+        producing = power >= 1.0
+        values = {
+            (0x0c,): 1 if producing else 5,  # Normal or PV power off
+            (0x0b,): power,
+            (0x34,): power,
+            (0x27,): power / _EFFICIENCY,
+            (0x01,): _PV_VOLTAGE * 10 if producing else 0,
+            (0x04,): power / _EFFICIENCY / _PV_VOLTAGE * 10,
+            (0x11,): energy * 100,
+            (0x07, 0x08): (self.energy_total + energy) * 10,
+            (0x35, 0x36): (self.energy_total + energy) * 10,
+        }
+        status_format = self.profile.status_format
+        for type_ids, value in values.items():
+            indices = [status_format.find(type_id) for type_id in type_ids]
+            if -1 in indices:
+                continue
+            value = int(round(value))
+            for i in reversed(indices):
+                words[i] = value & 0xffff
+                value >>= 16
+        return self._struct.pack(*words)
+
+    def history(self, year: int) -> bytes:
+        """Returns the history payload for a year, with the same energy every month."""
+        month = self.peak_power / 1000 * (self.sunset - self.sunrise) * 2 / pi * 30
+        return bytes([year - 2000]) + min(int(month * 10), 0xffff).to_bytes(2, 'big') * 12
+
+    def respond(self, identifier: bytes, payload: bytes) -> Optional[Tuple[bytes, bytes]]:
+        """Returns the response identifier and payload for a request, or None for no response."""
+        if identifier == b'\x01\x03\x02':
+            return b'\x01\x83\x00', self.model
+        if identifier == b'\x01\x00\x02':
+            return b'\x01\x80\x00', self.profile.status_format
+        if identifier == b'\x01\x02\x02':
+            return b'\x01\x82\x00', self.status(self.clock())
+        if identifier == b'\x04\x00\x02':
+            return b'\x04\x80\x00', _UNKNOWN_PAYLOAD
+        if identifier == b'\x06\x01\x02' and payload:
+            return b'\x06\x81\x00', self.history(2000 + payload[0])
+        logger.debug('%s: no response for identifier %s', self.serial_number, identifier.hex())
+        return None
+
+    async def connect(self, host: str, port: int = 1200):
+        """Connects to the server and answers requests until the connection is closed."""
+        self.connected = True
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            logger.warning('%s: could not connect to %s:%s (%s)', self.serial_number, host, port, e)
+            self.connected = False
+            return
+        try:
+            await self.serve(reader, writer)
+        except (ConnectionError, ValueError) as e:
+            logger.info('%s: connection lost (%s)', self.serial_number, e)
+        finally:
+            writer.close()
+            self.connected = False
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answers requests on a connection until EOF."""
+        parser = FrameParser()
+        silent = False
+        while True:
+            message = parser.next_message()
+            if not message:
+                data = await reader.read(4096)
+                if not data:
+                    return
+                parser.feed(data)
+                continue
+            response = self.respond(bytes(message[0]), bytes(message[1]))
+            if response is None or silent:
+                continue
+            fault = self.faults.choose() if self.faults else None
+            if fault == SILENCE:
+                logger.info('%s: going silent', self.serial_number)
+                silent = True
+            if fault == DROP or fault == SILENCE:
+                continue
+            latency = self.latency() if callable(self.latency) else self.latency
+            if latency:
+                await asyncio.sleep(latency)
+            message = construct_message(*response)
+            writer.write(self.faults.apply(fault, message) if fault else message)
+            self.requests += 1
+
+
+class Simulator:
+    """Runs a fleet of virtual inverters that connect on server advertisements.
+
+    A single UDP listener receives the advertisements for all inverters.
+    Inverters that are not connected connect to the advertising host, spread
+    over the connect jitter to avoid a burst of connections.
+    """
+
+    def __init__(self, inverters: Sequence[VirtualInverter], host: str = '', port: int = 1300,
+                 server_port: int = 1200, connect_jitter: float = 1.0):
+        """Constructor.
+
+        Args:
+            inverters: The virtual inverters.
+            host: Address to receive advertisements on.
+            port: Port to receive advertisements on.
+            server_port: TCP port of the server to connect to.
+            connect_jitter: Maximum random delay in seconds before connecting.
+        """
+        self.inverters = list(inverters)
+        self.host = host
+        self.port = port
+        self.server_port = server_port
+        self.connect_jitter = connect_jitter
+        self.transport = None  # type: Optional[asyncio.DatagramTransport]
+        self._tasks = set()
+
+    async def start(self):
+        """Starts listening for advertisements."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        loop = asyncio.get_event_loop()
+        self.transport, protocol = await loop.create_datagram_endpoint(lambda: _AdvertisementProtocol(self), sock=sock)
+
+    def connect_all(self, host: str):
+        """Lets all inverters that are not connected connect to the host."""
+        for inverter in self.inverters:
+            if not inverter.connected:
+                inverter.connected = True  # Prevents a second connection on the next advertisement
+                task = asyncio.ensure_future(self._connect(inverter, host))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _connect(self, inverter: VirtualInverter, host: str):
+        """Connects an inverter after a random delay."""
+        await asyncio.sleep(uniform(0, self.connect_jitter))
+        await inverter.connect(host, self.server_port)
+
+    async def close(self):
+        """Stops listening and closes all connections."""
+        if self.transport:
+            self.transport.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def connected(self) -> int:
+        """Returns the number of connected inverters."""
+        return sum(1 for inverter in self.inverters if inverter.connected)
+
+
+class _AdvertisementProtocol(asyncio.DatagramProtocol):
+    """Receives server advertisements."""
+
+    def __init__(self, simulator: Simulator):
+        """Constructor."""
+        self.simulator = simulator
+
+    def datagram_received(self, data: bytes, addr):
+        """Connects the inverters when the message is an advertisement."""
+        if data != _ADVERTISEMENT:
+            logger.debug('Ignoring datagram from %s', addr)
+            return
+        logger.info('Advertisement from %s', addr[0])
+        self.simulator.connect_all(addr[0])
+
+
+def create_fleet(n: int, profile: InverterProfile = RIVER, serial_prefix: str = 'SIM',
+                 **kwargs) -> List[VirtualInverter]:
+    """Returns n virtual inverters.
+
+    The serial numbers consist of the prefix followed by a sequence number.
+    Additional keyword arguments are passed to VirtualInverter.
+    """
+    return [VirtualInverter('{}{:06d}'.format(serial_prefix, i), profile, **kwargs) for i in range(n)]
+
+
+async def _report(simulator: Simulator, faults: Faults, interval: float):
+    """Logs the number of connected inverters, answered requests and injected faults."""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info('%s of %s inverters connected, %s requests answered, faults: %s', simulator.connected,
+                    len(simulator.inverters), sum(i.requests for i in simulator.inverters),
+                    dict(faults.injected) or 'none')
+
+
+def _parse_latency_option(ctx, param, value):
+    """Click callback for the latency option."""
+    try:
+        return parse_latency(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@click.command()
+@click.option('-n', '--count', default=1, help="Number of inverters.", show_default=True)
+@click.option('--profile', type=click.Choice(sorted(PROFILES)), default='river', help="Inverter type.",
+              show_default=True)
+@click.option('--peak-power', type=float, help="Output power at noon in W, defaults to the inverter rating.")
+@click.option('--latency', default='0', callback=_parse_latency_option,
+              help="Response delay in seconds, or a distribution: uniform:LOW,HIGH, exp:MEAN or normal:MEAN,STDDEV.",
+              show_default=True)
+@click.option('--serial-prefix', default='SIM', help="Serial number prefix.", show_default=True)
+@click.option('--interface', default='', help="IP address to receive advertisements on.")
+@click.option('--connect', metavar='HOST', help="Connect to this host directly, without waiting for an advertisement.")
+@click.option('--drop', default=0.0, help="Probability that a response is dropped.", show_default=True)
+@click.option('--corrupt', default=0.0, help="Probability of an invalid checksum.", show_default=True)
+@click.option('--truncate', default=0.0, help="Probability that a response is cut off.", show_default=True)
+@click.option('--unexpected', default=0.0, help="Probability of a response with another identifier.",
+              show_default=True)
+@click.option('--silence', default=0.0, help="Probability that a connection goes silent.", show_default=True)
+@click.option('--seed', type=int, help="Random seed for the faults.")
+def main(count: int, profile: str, peak_power: Optional[float], latency, serial_prefix: str, interface: str,
+         connect: Optional[str], drop: float, corrupt: float, truncate: float, unexpected: float, silence: float,
+         seed: Optional[int]):
+    """Simulates inverters that connect to the samil command on this network."""
+    logging.basicConfig(level=logging.INFO)
+    faults = Faults(drop=drop, corrupt=corrupt, truncate=truncate, unexpected=unexpected, silence=silence,
+                    seed=seed)
+    inverters = create_fleet(count, PROFILES[profile], serial_prefix=serial_prefix, peak_power=peak_power,
+                             latency=latency, faults=faults)
+    simulator = Simulator(inverters, host=interface)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(simulator.start())
+    if connect:
+        simulator.connect_all(connect)
+    reporter = asyncio.ensure_future(_report(simulator, faults, 10.0))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    reporter.cancel()
+    loop.run_until_complete(simulator.close())
+
+
+if __name__ == '__main__':
+    main()
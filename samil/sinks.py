@@ -0,0 +1,166 @@
+"""Delivery of polled inverter status to multiple destinations."""
+import logging
+from collections import deque, namedtuple
+from threading import Condition, Event, Thread
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+# A poll of all inverters. The time is a timezone-aware datetime, statuses is
+# an OrderedDict of serial number to status, or None for an inverter that did
+# not respond in time. The statuses are shared by all sinks and must not be
+# modified.
+Sample = namedtuple('Sample', ['time', 'statuses'])
+
+
+class Sink:
+    """Destination for samples, see SinkWorker.
+
+    Subclass and override handle. All methods are called from the thread of
+    the worker, so a sink can keep state without locking.
+    """
+
+    name = 'sink'
+
+    def open(self):
+        """Called before the first sample, e.g. to open thread-bound resources."""
+
+    def handle(self, sample: Sample):
+        """Delivers a sample, may block and may raise an exception."""
+        raise NotImplementedError
+
+    def close(self):
+        """Called after the last sample."""
+
+
+class SinkWorker:
+    """Delivers samples to a sink from a background thread.
+
+    Samples are added to a bounded queue, so adding never blocks. When the
+    queue is full, the oldest sample is dropped. Exceptions of the sink are
+    logged and the sample is skipped.
+
+    Needs to be closed after use.
+    """
+
+    def __init__(self, sink: Sink, queue_size: int = 100):
+        """Constructor, opens the sink in the background thread.
+
+        Args:
+            sink: The sink.
+            queue_size: Maximum number of samples waiting to be delivered.
+
+        Raises:
+            Exception: The exception of Sink.open when that failed.
+        """
+        self.sink = sink
+        self.handled = 0  # Number of samples delivered
+        self.failed = 0  # Number of samples for which the sink raised an exception
+        self.dropped = 0  # Number of samples dropped because of a full queue
+
+        self._queue = deque(maxlen=queue_size)
+        self._closed = False
+        self._condition = Condition()
+        self._opened = Event()
+        self._open_error = None
+        self._thread = Thread(target=self._run, name='sink-{}'.format(sink.name), daemon=True)
+        self._thread.start()
+        self._opened.wait()
+        if self._open_error is not None:
+            raise self._open_error
+
+    def __len__(self):
+        """Returns the number of samples waiting to be delivered."""
+        return len(self._queue)
+
+    def put(self, sample: Sample):
+        """Adds a sample to the queue, does not block."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Worker is closed")
+            if len(self._queue) == self._queue.maxlen:
+                logger.warning("Queue of sink %s is full, dropping oldest sample", self.sink.name)
+                self.dropped += 1
+            self._queue.append(sample)
+            self._condition.notify()
+
+    def close(self, timeout: float = None):
+        """Delivers the remaining samples, closes the sink and stops the thread.
+
+        Args:
+            timeout: Maximum time to wait for the remaining samples.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        """Opens the sink and delivers samples until closed."""
+        try:
+            self.sink.open()
+        except Exception as e:
+            self._open_error = e
+            return
+        finally:
+            self._opened.set()
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._queue or self._closed)
+                    if not self._queue:
+                        return
+                    sample = self._queue.popleft()
+                try:
+                    self.sink.handle(sample)
+                    self.handled += 1
+                except Exception:
+                    logger.exception("Sink %s failed to handle sample", self.sink.name)
+                    self.failed += 1
+        finally:
+            self.sink.close()
+
+
+class FanOut:
+    """Delivers each sample to multiple sinks, each with its own queue and thread.
+
+    A slow or failing sink does not delay the caller or the other sinks.
+    Needs to be closed after use, or used as context manager.
+    """
+
+    def __init__(self, sinks: Iterable[Sink], queue_size: int = 100):
+        """Constructor, opens all sinks.
+
+        Args:
+            sinks: The sinks.
+            queue_size: Maximum number of samples waiting for each sink.
+        """
+        self.workers = []
+        try:
+            for sink in sinks:
+                self.workers.append(SinkWorker(sink, queue_size))
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        """Returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def put(self, sample: Sample):
+        """Adds a sample to the queue of each sink, does not block."""
+        for worker in self.workers:
+            worker.put(sample)
+
+    def close(self, timeout: float = None):
+        """Delivers the remaining samples and closes all sinks.
+
+        Args:
+            timeout: Maximum time to wait for each sink.
+        """
+        for worker in self.workers:
+            worker.close(timeout)
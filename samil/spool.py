@@ -0,0 +1,113 @@
+"""Durable on-disk queue for records that could not be written."""
+import logging
+import os
+import re
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_NAME = re.compile(r'^(\d{12})\.spool$')
+
+
+class Spool:
+    """Stores lines in append-only segment files in a directory.
+
+    Lines are appended to the newest segment, which is rotated when it
+    exceeds the segment size. Segments are read back oldest first, one
+    complete segment at a time, and removed after they have been processed.
+    Lines should be bytes and may not contain newlines, e.g. InfluxDB line
+    protocol.
+
+    Segments left over by a previous process are picked up on construction.
+    Not thread-safe.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 1 << 20, max_size: int = None):
+        """Constructor.
+
+        Args:
+            directory: Directory for the segment files, created if it does not
+                exist.
+            segment_size: Size in bytes after which a new segment is started.
+                This is also roughly the amount of data returned by read.
+            max_size: Maximum total size in bytes, when exceeded the oldest
+                segments are removed. No limit when None.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        names = sorted(name for name in os.listdir(directory) if _SEGMENT_NAME.match(name))
+        self._segments = deque(os.path.join(directory, name) for name in names)
+        self._next_number = int(_SEGMENT_NAME.match(names[-1]).group(1)) + 1 if names else 0
+        self.size = sum(os.path.getsize(path) for path in self._segments)  # Total size in bytes
+        self._file = None  # Segment that is being appended to, always the newest segment
+
+    def __len__(self):
+        """Returns the number of segments."""
+        return len(self._segments)
+
+    def __contains__(self, segment: str):
+        """Returns whether the segment exists."""
+        return segment in self._segments
+
+    def append(self, lines: List[bytes]):
+        """Appends lines and flushes them to disk."""
+        if self._file is None:
+            path = os.path.join(self.directory, '{:012d}.spool'.format(self._next_number))
+            self._next_number += 1
+            self._file = open(path, 'ab')
+            self._segments.append(path)
+        data = b''.join(line + b'\n' for line in lines)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.size += len(data)
+        if self._file.tell() >= self.segment_size:
+            self._close_segment()
+        while self.max_size is not None and self.size > self.max_size and len(self._segments) > 1:
+            logger.warning("Spool is full, removing oldest segment")
+            self.remove(self.oldest())
+
+    def oldest(self) -> Optional[str]:
+        """Returns the path of the oldest segment, or None when empty.
+
+        When the oldest segment is still being appended to, it is closed so
+        that new lines go to a new segment.
+        """
+        if not self._segments:
+            return None
+        if self._file and self._file.name == self._segments[0]:
+            self._close_segment()
+        return self._segments[0]
+
+    def read(self, segment: str) -> List[bytes]:
+        """Returns the lines of a segment.
+
+        A line that was not completely written, because of a crash, is left
+        out.
+        """
+        with open(segment, 'rb') as f:
+            lines = f.read().split(b'\n')
+        if lines[-1]:
+            logger.warning("Incomplete line in spool segment %s", segment)
+        return [line for line in lines[:-1] if line]
+
+    def remove(self, segment: str):
+        """Removes a segment, after it has been processed."""
+        if self._file and self._file.name == segment:
+            self._close_segment()
+        self._segments.remove(segment)
+        self.size -= os.path.getsize(segment)
+        os.remove(segment)
+
+    def close(self):
+        """Closes the segment that is being appended to."""
+        if self._file:
+            self._close_segment()
+
+    def _close_segment(self):
+        """Closes the segment that is being appended to."""
+        self._file.close()
+        self._file = None
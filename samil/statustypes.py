@@ -1,6 +1,13 @@
 """Defines all types of status values that may be returned by the inverter."""
 from collections import OrderedDict
 from decimal import Decimal
+from functools import lru_cache
+from operator import itemgetter
+from struct import Struct
+from typing import Callable, Dict, Optional, Sequence
+
+# Converts the unpacked status payload words to a status value
+Converter = Callable[[Sequence[int]], object]
 
 
 class StatusType:
@@ -23,6 +30,22 @@ class StatusType:
         """
         raise NotImplementedError("Abstract method")
 
+    def compile(self, status_format) -> Optional[Converter]:
+        """Resolves this status type for a fixed status format.
+
+        The returned converter takes the status payload unpacked as a sequence
+        of unsigned 16-bit big-endian integers, one for each byte in the
+        status format, and returns the same value as get_value would.
+
+        Args:
+            status_format: The status format byte-string as provided by the
+                inverter.
+
+        Returns:
+            The converter or None if the value is not present in this format.
+        """
+        raise NotImplementedError("Abstract method")
+
 
 class BytesStatusType(StatusType):
     """Gets the bytes at given type ID positions."""
@@ -45,6 +68,23 @@ class BytesStatusType(StatusType):
         values = [status_payload[i * 2:i * 2 + 2] for i in indices]
         return b''.join(values)
 
+    def indices(self, status_format) -> Optional[Sequence[int]]:
+        """Returns the position of each type ID in the format or None if any is missing."""
+        indices = [status_format.find(type_id) for type_id in self.type_ids]
+        if -1 in indices:
+            return None
+        return indices
+
+    def compile(self, status_format) -> Optional[Converter]:
+        """See base class."""
+        indices = self.indices(status_format)
+        if indices is None:
+            return None
+        getter = itemgetter(*indices)
+        if len(indices) == 1:
+            return lambda words: getter(words).to_bytes(2, byteorder='big')
+        return lambda words: b''.join(w.to_bytes(2, byteorder='big') for w in getter(words))
+
 
 class IntStatusType(BytesStatusType):
     """Returns the value as an integer."""
@@ -68,6 +108,29 @@ class IntStatusType(BytesStatusType):
             return None
         return int.from_bytes(sequence, byteorder='big', signed=self.signed)
 
+    def compile(self, status_format) -> Optional[Converter]:
+        """See base class."""
+        indices = self.indices(status_format)
+        if indices is None:
+            return None
+        if len(indices) == 1:
+            index = indices[0]
+            if not self.signed:
+                return itemgetter(index)
+            return lambda words: words[index] - 0x10000 if words[index] & 0x8000 else words[index]
+
+        getter = itemgetter(*indices)
+        bits = 16 * len(indices)
+
+        def convert(words):
+            val = 0
+            for w in getter(words):
+                val = val << 16 | w
+            if self.signed and val >> (bits - 1):
+                val -= 1 << bits
+            return val
+        return convert
+
 
 class DecimalStatusType(IntStatusType):
     """Status type that scales the result and returns a Decimal value."""
@@ -91,6 +154,14 @@ class DecimalStatusType(IntStatusType):
             return None
         return Decimal(int_val).scaleb(self.scale)
 
+    def compile(self, status_format) -> Optional[Converter]:
+        """See base class."""
+        int_converter = super().compile(status_format)
+        if int_converter is None:
+            return None
+        scale = self.scale
+        return lambda words: Decimal(int_converter(words)).scaleb(scale)
+
 
 class OperationModeStatusType(IntStatusType):
     """Returns the operation mode as a string.
@@ -99,6 +170,8 @@ class OperationModeStatusType(IntStatusType):
     off. This corresponds to the value displayed in SolarPower Browser V3.
     """
 
+    operating_modes = {0: 'Wait', 1: 'Normal', 2: 'Fault', 3: 'Permanent fault', 4: 'Check', 5: 'PV power off'}
+
     def __init__(self):
         """Constructor."""
         super().__init__(0x0c)
@@ -106,8 +179,15 @@ class OperationModeStatusType(IntStatusType):
     def get_value(self, status_format, status_payload):
         """See base class."""
         int_val = super().get_value(status_format, status_payload)
-        operating_modes = {0: 'Wait', 1: 'Normal', 2: 'Fault', 3: 'Permanent fault', 4: 'Check', 5: 'PV power off'}
-        return operating_modes[int_val]
+        return self.operating_modes[int_val]
+
+    def compile(self, status_format) -> Optional[Converter]:
+        """See base class."""
+        int_converter = super().compile(status_format)
+        if int_converter is None:
+            return None
+        operating_modes = self.operating_modes
+        return lambda words: operating_modes[int_converter(words)]
 
 
 class OneOfStatusType(StatusType):
@@ -133,6 +213,18 @@ class OneOfStatusType(StatusType):
                 return val
         return None
 
+    def compile(self, status_format) -> Optional[Converter]:
+        """See base class.
+
+        A compiled status type always returns a value, so the first status
+        type that is present in the format is the one that is used.
+        """
+        for status_type in self.status_types:
+            converter = status_type.compile(status_format)
+            if converter is not None:
+                return converter
+        return None
+
 
 class IfPresentStatusType(BytesStatusType):
     """Filters status type based on presence of another type ID."""
@@ -158,6 +250,13 @@ class IfPresentStatusType(BytesStatusType):
             return self.status_type.get_value(status_format, status_payload)
         return None
 
+    def compile(self, status_format) -> Optional[Converter]:
+        """See base class."""
+        actual_presence = self.indices(status_format) is not None
+        if self.presence == actual_presence:
+            return self.status_type.compile(status_format)
+        return None
+
 
 status_types = OrderedDict(
     operation_mode=OperationModeStatusType(),
@@ -186,3 +285,62 @@ status_types = OrderedDict(
     internal_temperature=DecimalStatusType(0x00, signed=True, scale=-1),
     heatsink_temperature=DecimalStatusType(0x2f, signed=True, scale=-1),
 )
+
+
+class StatusDecoder:
+    """Decodes status payloads for one specific status format.
+
+    All type ID lookups are done once on construction, decoding a payload is
+    then a single struct unpack followed by the precomputed conversions. Use
+    get_status_decoder to obtain a (shared) instance.
+    """
+
+    def __init__(self, status_format: bytes, types: Dict[str, StatusType] = None):
+        """Constructor.
+
+        Args:
+            status_format: The status format byte-string as provided by the
+                inverter.
+            types: The status types to decode, defaults to status_types.
+        """
+        if types is None:
+            types = status_types
+        self.status_format = bytes(status_format)
+        self.types = types
+        self.converters = []
+        for name, type_def in types.items():
+            converter = type_def.compile(self.status_format)
+            if converter is not None:
+                self.converters.append((name, converter))
+        self.struct = Struct('>{}H'.format(len(self.status_format)))
+
+    def decode(self, status_payload) -> Dict:
+        """Returns the status values for a status payload.
+
+        The result is the same as calling get_value for each status type.
+        Values that are not present are left out.
+        """
+        if len(status_payload) < self.struct.size:
+            # Payload is too short, let the status types deal with it
+            return self.decode_slow(status_payload)
+        words = self.struct.unpack_from(status_payload)
+        return OrderedDict([(name, converter(words)) for name, converter in self.converters])
+
+    def decode_slow(self, status_payload) -> Dict:
+        """Returns the status values by calling get_value for each status type."""
+        status_values = OrderedDict()
+        for name, type_def in self.types.items():
+            val = type_def.get_value(self.status_format, status_payload)
+            if val is not None:
+                status_values[name] = val
+        return status_values
+
+
+@lru_cache(maxsize=32)
+def get_status_decoder(status_format: bytes) -> StatusDecoder:
+    """Returns the decoder for the given status format.
+
+    Decoders are cached by format, inverters using the same format share the
+    decoder.
+    """
+    return StatusDecoder(status_format)
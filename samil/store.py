@@ -0,0 +1,349 @@
+"""Local time series store for inverter status samples.
+
+Each inverter has a directory with a file per UTC day. A file consists of a
+header followed by fixed-width records, one per sample, with the time and a
+column for each status field. The status values are stored as the raw
+integers sent by the inverter, so a sample takes 61 bytes: about 190 MB per
+year at a 10-second interval. Records are appended in time order, so the
+time column is the index: range queries search it with bisection on the
+memory-mapped file.
+"""
+import logging
+import mmap
+import os
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from struct import Struct
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from samil.statustypes import OperationModeStatusType
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'SAMILTS\x01'
+_HEADER = Struct('<8sI')  # Magic and record size
+_PARTITION_NAME = re.compile(r'^(\d{8})\.ts$')
+_SERIAL_NUMBER = re.compile(r'^[A-Za-z0-9_-]+$')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Stored status fields with struct format and decimal scale. Values with scale
+# None are integers. The maximum value of the format means the field is
+# missing.
+COLUMNS = (
+    ('operation_mode', 'B', None),
+    ('total_operation_time', 'I', None),
+    ('pv1_input_power', 'H', 0),
+    ('pv2_input_power', 'H', 0),
+    ('pv1_voltage', 'H', -1),
+    ('pv2_voltage', 'H', -1),
+    ('pv1_current', 'H', -1),
+    ('pv2_current', 'H', -1),
+    ('output_power', 'H', 0),
+    ('energy_today', 'H', -2),
+    ('energy_total', 'I', -1),
+    ('grid_voltage', 'H', -1),
+    ('grid_current', 'H', -1),
+    ('grid_frequency', 'H', -2),
+    ('grid_voltage_r_phase', 'H', -1),
+    ('grid_current_r_phase', 'H', -1),
+    ('grid_frequency_r_phase', 'H', -2),
+    ('grid_voltage_s_phase', 'H', -1),
+    ('grid_current_s_phase', 'H', -1),
+    ('grid_frequency_s_phase', 'H', -2),
+    ('grid_voltage_t_phase', 'H', -1),
+    ('grid_current_t_phase', 'H', -1),
+    ('grid_frequency_t_phase', 'H', -2),
+    ('internal_temperature', 'h', -1),
+    ('heatsink_temperature', 'h', -1),
+)
+
+_MISSING = {'B': 0xff, 'H': 0xffff, 'I': 0xffffffff, 'h': -0x8000}
+_RECORD = Struct('<d' + ''.join(code for name, code, scale in COLUMNS))
+_TIME = Struct('<d')
+_OPERATION_MODES = OperationModeStatusType.operating_modes
+_OPERATION_MODE_CODES = {v: k for k, v in _OPERATION_MODES.items()}
+
+
+def _timestamp(time: datetime) -> float:
+    """Returns seconds since epoch, naive datetimes are taken as UTC."""
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return (time - _EPOCH).total_seconds()
+
+
+def _encode(status: Dict) -> List[int]:
+    """Returns the raw column values of a status."""
+    values = []
+    for name, code, scale in COLUMNS:
+        value = status.get(name)
+        if value is None:
+            values.append(_MISSING[code])
+        elif name == 'operation_mode':
+            values.append(_OPERATION_MODE_CODES[value])
+        elif scale is None:
+            values.append(value)
+        else:
+            values.append(int(Decimal(value).scaleb(-scale)))
+    return values
+
+
+class _TimeColumn:
+    """Sequence of the record times of a memory-mapped partition, for bisection."""
+
+    def __init__(self, buffer, count: int):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i: int) -> float:
+        return _TIME.unpack_from(self._buffer, _HEADER.size + i * _RECORD.size)[0]
+
+
+class _Partition:
+    """The file with the records of one inverter on one day."""
+
+    def __init__(self, path: str):
+        """Opens the file, creates it when it does not exist.
+
+        Raises:
+            ValueError: When the file has another format.
+        """
+        self.path = path
+        self._file = open(path, 'a+b')
+        self._file.seek(0)
+        header = self._file.read(_HEADER.size)
+        if not header:
+            self._file.write(_HEADER.pack(_MAGIC, _RECORD.size))
+            self._file.flush()
+        elif len(header) < _HEADER.size or _HEADER.unpack(header) != (_MAGIC, _RECORD.size):
+            self._file.close()
+            raise ValueError("Not a time series partition or another format: {}".format(path))
+        size = os.fstat(self._file.fileno()).st_size
+        complete = _HEADER.size + (size - _HEADER.size) // _RECORD.size * _RECORD.size
+        if size != complete:
+            logger.warning("Removing incomplete record at end of %s", path)
+            self._file.truncate(complete)
+        self.count = (complete - _HEADER.size) // _RECORD.size
+        self._map = None  # type: Optional[mmap.mmap]
+        self._mapped_count = 0
+
+    def close(self):
+        """Closes the file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def append(self, record: bytes):
+        """Appends a record and flushes it to the operating system."""
+        self._file.write(record)
+        self._file.flush()
+        self.count += 1
+
+    def last_time(self) -> Optional[float]:
+        """Returns the time of the last record, or None when there are none."""
+        return _TimeColumn(self._buffer(), self.count)[self.count - 1] if self.count else None
+
+    def _buffer(self) -> mmap.mmap:
+        """Returns the memory map of the file, mapped again when records were added."""
+        if self._map is None or self._mapped_count != self.count:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), _HEADER.size + self.count * _RECORD.size,
+                                  access=mmap.ACCESS_READ)
+            self._mapped_count = self.count
+        return self._map
+
+    def read(self, start: float, end: float) -> Iterator[tuple]:
+        """Returns the unpacked records with a time from start up to end."""
+        if not self.count:
+            return iter(())
+        buffer = self._buffer()
+        times = _TimeColumn(buffer, self.count)
+        first = bisect_left(times, start)
+        last = bisect_left(times, end, first)
+        return _RECORD.iter_unpack(buffer[_HEADER.size + first * _RECORD.size:_HEADER.size + last * _RECORD.size])
+
+
+class TimeSeriesStore:
+    """Append-only store of status samples, partitioned by inverter and day.
+
+    Samples of an inverter need to be appended in time order. Queries see
+    the appended samples directly. Not thread-safe, other processes can read
+    the files while a single process appends.
+
+    Needs to be closed after use, or used as context manager.
+    """
+
+    def __init__(self, directory: str, retention: timedelta = None):
+        """Constructor.
+
+        Args:
+            directory: Directory for the files, created if it does not exist.
+            retention: When given, days that are older are removed when a new
+                day is started. Removal is by whole days, so up to a day more
+                is kept.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.retention = retention
+        self._partitions = OrderedDict()  # type: Dict[Tuple[str, str], _Partition]  # By serial number and day
+        self._last_times = {}  # type: Dict[str, Optional[float]]  # Time of the last sample by serial number
+
+    def __enter__(self):
+        """Returns self."""
+        return self
+
+    def __exit__(self, *args):
+        """See close method."""
+        self.close()
+
+    def close(self):
+        """Closes all files."""
+        for partition in self._partitions.values():
+            partition.close()
+        self._partitions.clear()
+
+    def serial_numbers(self) -> List[str]:
+        """Returns the serial numbers of the inverters with samples."""
+        return sorted(name for name in os.listdir(self.directory)
+                      if _SERIAL_NUMBER.match(name) and os.path.isdir(os.path.join(self.directory, name)))
+
+    def days(self, serial_number: str) -> List[str]:
+        """Returns the days with samples of an inverter, formatted as YYYYMMDD."""
+        directory = os.path.join(self.directory, serial_number)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(m.group(1) for m in map(_PARTITION_NAME.match, os.listdir(directory)) if m)
+
+    def append(self, serial_number: str, time: datetime, status: Dict):
+        """Stores a status sample.
+
+        Fields that are not in COLUMNS are not stored.
+
+        Raises:
+            ValueError: When the time is before the last sample of the
+                inverter, or when the serial number contains other characters
+                than letters, digits, '-' and '_'.
+        """
+        timestamp = _timestamp(time)
+        last_time = self._last_time(serial_number)
+        if last_time is not None and timestamp < last_time:
+            raise ValueError("Sample time {} is before the last sample of inverter {}".format(time, serial_number))
+        self._partition(serial_number, timestamp).append(_RECORD.pack(timestamp, *_encode(status)))
+        self._last_times[serial_number] = timestamp
+
+    def query(self, serial_number: str, start: datetime, end: datetime = None,
+              fields: Sequence[str] = None) -> List[Tuple[datetime, Dict]]:
+        """Returns the samples of an inverter in a time range.
+
+        Args:
+            serial_number: The inverter.
+            start: Start of the range.
+            end: End of the range (exclusive), now when not given.
+            fields: The status fields to return, all when not given.
+
+        Returns:
+            A list of time and status tuples, in time order. The statuses
+            have the same values as those of Inverter.status, without fields
+            that were missing.
+        """
+        start_timestamp = _timestamp(start)
+        end_timestamp = _timestamp(end) if end else _timestamp(datetime.now(timezone.utc))
+        columns = [(i + 1, name, scale, _MISSING[code], {}) for i, (name, code, scale) in enumerate(COLUMNS)
+                   if fields is None or name in fields]
+        first_day = _day(start_timestamp)
+        last_day = _day(end_timestamp)
+        samples = []
+        for day in self.days(serial_number):
+            if not first_day <= day <= last_day:
+                continue
+            for record in self._partition(serial_number, day=day).read(start_timestamp, end_timestamp):
+                samples.append((datetime.fromtimestamp(record[0], timezone.utc), _decode(record, columns)))
+        return samples
+
+    def remove_before(self, time: datetime) -> int:
+        """Removes the days that ended before the given time, returns the number of removed files."""
+        day = _day(_timestamp(time))
+        removed = 0
+        for serial_number in self.serial_numbers():
+            for old_day in self.days(serial_number):
+                if old_day >= day:
+                    break
+                partition = self._partitions.pop((serial_number, old_day), None)
+                if partition is not None:
+                    partition.close()
+                os.remove(self._path(serial_number, old_day))
+                removed += 1
+        if removed:
+            logger.info("Removed %s day(s) of samples before %s", removed, day)
+        return removed
+
+    def _last_time(self, serial_number: str) -> Optional[float]:
+        """Returns the time of the last sample of an inverter, or None when there are none."""
+        try:
+            return self._last_times[serial_number]
+        except KeyError:
+            pass
+        days = self.days(serial_number)
+        last_time = self._partition(serial_number, day=days[-1]).last_time() if days else None
+        self._last_times[serial_number] = last_time
+        return last_time
+
+    def _partition(self, serial_number: str, timestamp: float = None, day: str = None) -> _Partition:
+        """Returns the partition for a time or day, opens or creates it when needed."""
+        if not _SERIAL_NUMBER.match(serial_number):
+            raise ValueError("Invalid serial number: {}".format(serial_number))
+        day = day or _day(timestamp)
+        try:
+            return self._partitions[(serial_number, day)]
+        except KeyError:
+            pass
+        path = self._path(serial_number, day)
+        if self.retention is not None and not os.path.exists(path):
+            self.remove_before(datetime.now(timezone.utc) - self.retention)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partition = self._partitions[(serial_number, day)] = _Partition(path)
+        # Keeps the files of the current and previous day open
+        while len(self._partitions) > 2 * len({k[0] for k in self._partitions}):
+            self._partitions.popitem(last=False)[1].close()
+        return partition
+
+    def _path(self, serial_number: str, day: str) -> str:
+        """Returns the file path of a partition."""
+        return os.path.join(self.directory, serial_number, day + '.ts')
+
+
+def _day(timestamp: float) -> str:
+    """Returns the UTC day of a time, formatted as YYYYMMDD."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%d')
+
+
+def _decode(record: tuple, columns: Sequence[Tuple[int, str, Optional[int], int, Dict]]) -> Dict:
+    """Returns the status for a record.
+
+    The columns are index in the record, name, scale, missing value and a
+    cache of the decoded values by raw value. Samples usually have few
+    distinct values, using the cache is much faster than creating Decimals.
+    """
+    status = OrderedDict()
+    for i, name, scale, missing, cache in columns:
+        value = record[i]
+        if value == missing:
+            continue
+        try:
+            status[name] = cache[value]
+        except KeyError:
+            if name == 'operation_mode':
+                decoded = _OPERATION_MODES[value]
+            elif scale is None:
+                decoded = value
+            else:
+                decoded = Decimal(value).scaleb(scale)
+            status[name] = cache[value] = decoded
+    return status
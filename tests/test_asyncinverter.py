@@ -0,0 +1,113 @@
+"""Test cases for asyncinverter.py."""
+import asyncio
+from decimal import Decimal
+from socket import socketpair
+from unittest import TestCase
+
+from samil.asyncinverter import AsyncInverter
+from samil.inverter import construct_message, InverterEOFError, read_message
+
+model_payload = b'1  4500V1.30River 4500TL-D\x00 SamilPower\x00     DW413B8080\x00\x00\x00\x00\x00\x00V1.30V1.302'
+format_payload = bytes.fromhex("00 01 02 04 05 09 0a 0c 11 17 18 1b 1c 1d 1e 1f 20 21 22 27 28 31 32 33 34 35 36")
+status_payload = bytes.fromhex("01 77 0b 9f 0b f6 00 15 00 14 00 00 28 40 00 01 01 da 00 00 00 00 00 00 00 " +
+                               "00 00 00 00 00 00 00 00 00 00 00 00 00 02 88 02 6f 00 37 09 14 13 86 04 ee " +
+                               "00 01 b1 cc")
+
+
+class AsyncInverterTestCase(TestCase):
+    """Runs requests against a socket that mimics the inverter."""
+
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        local_sock, self.sock = socketpair()
+        self.sock.settimeout(1.0)
+        self.inverter = self.loop.run_until_complete(AsyncInverter.from_socket(local_sock, None, timeout=1.0))
+
+    def tearDown(self) -> None:
+        self.loop.run_until_complete(self.inverter.disconnect())
+        self.loop.close()
+        self.sock.close()
+
+    def respond(self, responses):
+        """Answers each request that is received with the next list of response messages."""
+        with self.sock.makefile('rb') as f:
+            for messages in responses:
+                read_message(f)
+                self.sock.send(b''.join(construct_message(identifier, payload) for identifier, payload in messages))
+
+    def run_with_responses(self, coro, responses):
+        async def run():
+            remote = self.loop.run_in_executor(None, self.respond, responses)
+            result = await coro
+            await remote
+            return result
+        return self.loop.run_until_complete(run())
+
+    def test_model(self):
+        model = self.run_with_responses(self.inverter.model(), [[(b'\x01\x83\x00', model_payload)]])
+        self.assertEqual("DW413B8080", model['serial_number'])
+        self.assertEqual("Single-phase inverter", model['device_type'])
+
+    def test_status(self):
+        status = self.run_with_responses(self.inverter.status(), [[(b'\x01\x80\x00', format_payload)],
+                                                                  [(b'\x01\x82\x00', status_payload)]])
+        self.assertEqual('Normal', status['operation_mode'])
+        self.assertEqual(Decimal('232.4'), status['grid_voltage'])
+
+    def test_unexpected_response(self):
+        ident, payload = self.run_with_responses(self.inverter.request(b'\x01\x00\x02', b'', b'\x01\x80'),
+                                                 [[(b'\x01\x82\x00', b''), (b'\x01\x80\x00', b'\x01')]])
+        self.assertEqual(b'\x01\x80\x00', ident)
+        self.assertEqual(b'\x01', payload)
+
+    def test_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.inverter.timeout = 0.01
+            self.loop.run_until_complete(self.inverter.request(b'\x01\x00\x02', b'', b'\x01\x80'))
+
+    def test_concurrent_inverters(self):
+        """Requests on multiple inverters run concurrently."""
+        local_sock, remote_sock = socketpair()
+        remote_sock.settimeout(1.0)
+        other = self.loop.run_until_complete(AsyncInverter.from_socket(local_sock, None, timeout=1.0))
+
+        # The blocking recv calls are done in the loop thread after the requests are scheduled
+        async def main():
+            requests = asyncio.gather(self.inverter.status_format(), other.status_format())
+            await asyncio.sleep(0.01)
+            self.assertTrue(self.sock.recv(4096).startswith(b'\x55\xaa\x01\x00\x02'))
+            self.assertTrue(remote_sock.recv(4096).startswith(b'\x55\xaa\x01\x00\x02'))
+            self.sock.send(construct_message(b'\x01\x80\x00', b'\x01'))
+            remote_sock.send(construct_message(b'\x01\x80\x00', b'\x02'))
+            return await requests
+
+        self.assertEqual([b'\x01', b'\x02'], self.loop.run_until_complete(main()))
+        self.loop.run_until_complete(other.disconnect())
+        remote_sock.close()
+
+    def test_gather(self):
+        """Tests if concurrent requests on one inverter get the matching responses."""
+        async def main():
+            requests = asyncio.gather(self.inverter.model(), self.inverter.status())
+            await asyncio.sleep(0.01)
+            # All three requests are in flight, answer in reverse order
+            self.sock.send(construct_message(b'\x01\x82\x00', status_payload) +
+                           construct_message(b'\x01\x80\x00', format_payload) +
+                           construct_message(b'\x01\x83\x00', model_payload))
+            return await requests
+
+        model, status = self.loop.run_until_complete(main())
+        self.assertEqual("DW413B8080", model['serial_number'])
+        self.assertEqual('Normal', status['operation_mode'])
+        self.assertEqual(3, self.sock.recv(4096).count(b'\x55\xaa'))
+
+    def test_eof(self):
+        self.sock.close()
+        with self.assertRaises(InverterEOFError):
+            self.loop.run_until_complete(self.inverter.receive())
+
+    def test_disconnect(self):
+        """Tests if disconnecting twice is allowed and closes the connection."""
+        self.loop.run_until_complete(self.inverter.disconnect())
+        self.loop.run_until_complete(self.inverter.disconnect())
+        self.assertEqual(b'', self.sock.recv(4096))
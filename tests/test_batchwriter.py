@@ -0,0 +1,155 @@
+"""Test cases for batchwriter.py."""
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import sleep
+from unittest import TestCase
+
+from samil.batchwriter import BatchWriter
+from samil.spool import Spool
+
+
+class BatchWriterTestCase(TestCase):
+    def setUp(self) -> None:
+        self.batches = []
+
+    def write(self, batch):
+        self.batches.append(batch)
+
+    def test_batch_size(self):
+        """Tests if a full batch is written directly."""
+        with BatchWriter(self.write, batch_size=3, flush_interval=10.0) as writer:
+            for i in range(7):
+                writer.write(i)
+            sleep(0.05)
+            self.assertEqual([[0, 1, 2], [3, 4, 5]], self.batches)
+        # Remaining record is written on close
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], self.batches)
+        self.assertEqual(7, writer.written)
+
+    def test_flush_interval(self):
+        """Tests if records are written after the flush interval."""
+        with BatchWriter(self.write, batch_size=100, flush_interval=0.05) as writer:
+            writer.write(1)
+            sleep(0.02)
+            self.assertEqual([], self.batches)
+            sleep(0.1)
+            self.assertEqual([[1]], self.batches)
+
+    def test_queue_full(self):
+        """Tests if the oldest records are dropped when the queue is full."""
+        blocked = Event()
+
+        def write(batch):
+            blocked.wait()
+            self.batches.append(batch)
+
+        with BatchWriter(write, batch_size=1, flush_interval=0.0, queue_size=2) as writer:
+            writer.write(1)
+            sleep(0.02)  # Record 1 is being written
+            for i in range(2, 6):
+                writer.write(i)
+            blocked.set()
+        self.assertEqual([[1], [4], [5]], self.batches)
+        self.assertEqual(2, writer.dropped)
+
+    def test_retry(self):
+        """Tests if a failed write is retried."""
+        failures = [OSError("Unreachable"), OSError("Unreachable")]
+
+        def write(batch):
+            if failures:
+                raise failures.pop()
+            self.batches.append(batch)
+
+        with BatchWriter(write, batch_size=1, retry_interval=0.01) as writer:
+            writer.write(1)
+            sleep(0.1)
+            self.assertEqual([[1]], self.batches)
+
+    def test_retries_exhausted(self):
+        """Tests if a batch is dropped after all retries have failed."""
+        def write(batch):
+            raise OSError("Unreachable")
+
+        with BatchWriter(write, batch_size=1, max_retries=2, retry_interval=0.01) as writer:
+            writer.write(1)
+            sleep(0.1)
+            self.assertEqual(1, writer.dropped)
+
+    def test_close_during_retry(self):
+        """Tests if a batch that is backing off gets a final attempt on close."""
+        failures = [OSError("Unreachable")]
+
+        def write(batch):
+            if failures:
+                raise failures.pop()
+            self.batches.append(batch)
+
+        with BatchWriter(write, batch_size=1, retry_interval=60.0) as writer:
+            writer.write(1)
+            sleep(0.05)  # Backing off
+        self.assertEqual([[1]], self.batches)
+        self.assertEqual(0, writer.dropped)
+
+
+class BatchWriterSpoolTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp = TemporaryDirectory()
+        self.spool = Spool(self.tmp.name)
+        self.batches = []
+        self.available = True
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write(self, batch):
+        if not self.available:
+            raise OSError("Unreachable")
+        self.batches.append(batch)
+
+    def test_spool_and_replay(self):
+        """Tests if failed batches are spooled and written after recovery."""
+        self.available = False
+        with BatchWriter(self.write, batch_size=1, retry_interval=0.05, spool=self.spool,
+                         replay_interval=0.0) as writer:
+            writer.write(b'a')
+            sleep(0.02)
+            writer.write(b'b')  # Goes directly to the spool during the backoff
+            sleep(0.02)
+            self.assertEqual(2, writer.spooled)
+            self.assertEqual([], self.batches)
+            self.available = True
+            sleep(0.05)  # Backoff has ended, spool is written
+            writer.write(b'c')
+            sleep(0.05)
+            self.assertEqual([b'a', b'b', b'c'], sorted(r for batch in self.batches for r in batch))
+            self.assertEqual(2, writer.replayed)
+        self.assertEqual(0, len(self.spool))
+
+    def test_replay_existing(self):
+        """Tests if records spooled by a previous process are written."""
+        self.spool.append([b'a', b'b'])
+        self.spool.close()
+        with BatchWriter(self.write, spool=Spool(self.tmp.name)) as writer:
+            sleep(0.05)
+            self.assertEqual([[b'a', b'b']], self.batches)
+            self.assertEqual(2, writer.replayed)
+
+    def test_replay_interval(self):
+        """Tests if spool segments are written one per replay interval."""
+        spool = Spool(self.tmp.name, segment_size=1)
+        spool.append([b'a'])
+        spool.append([b'b'])
+        with BatchWriter(self.write, spool=spool, replay_interval=0.1):
+            sleep(0.05)
+            self.assertEqual([[b'a']], self.batches)
+            sleep(0.1)
+            self.assertEqual([[b'a'], [b'b']], self.batches)
+
+    def test_close_spools(self):
+        """Tests if remaining records are spooled on close when the write fails."""
+        self.available = False
+        with BatchWriter(self.write, batch_size=10, spool=self.spool) as writer:
+            writer.write(b'a')
+        self.assertEqual(1, writer.spooled)
+        self.assertEqual([b'a'], Spool(self.tmp.name).read(self.spool.oldest()))
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import TestCase
+
+from samil.influx import LineProtocolEncoder, status_to_point
+
+
+class LineProtocolEncoderTestCase(TestCase):
+    def setUp(self) -> None:
+        self.status = {
+            'operation_mode': 'Normal',
+            'total_operation_time': 45,
+            'pv1_input_power': Decimal('2822'),
+            'pv1_voltage': Decimal('586.5'),
+            'pv2_voltage': Decimal('0'),
+            'output_power': Decimal('0'),
+            'energy_today': Decimal('21.20'),
+            'energy_total': Decimal('77.0'),
+        }
+        self.timestamp = datetime(2021, 6, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+    def test_same_as_point(self):
+        """Tests if the output equals the line protocol of status_to_point."""
+        tags = {'serial_number': 'DW413B8080', 'site': 'roof top'}
+        encoder = LineProtocolEncoder('samil', tags=tags)
+        line = encoder.encode(self.status, self.timestamp)
+        point = status_to_point('samil', self.status, tags=tags, timestamp=self.timestamp)
+        self.assertEqual(point.to_line_protocol().encode(), line)
+
+    def test_encode(self):
+        line = LineProtocolEncoder('samil').encode(self.status, 1622550615123456000)
+        self.assertEqual(b'samil energy_today=21.20,energy_total=77,operation_mode="Normal",output_power=0,'
+                         b'pv1_input_power=2822,pv1_voltage=586.5,total_operation_time=45i 1622550615123456000',
+                         line)
+
+    def test_escaping(self):
+        encoder = LineProtocolEncoder('my measurement', tags={'a,b': 'c=d'})
+        line = encoder.encode({'operation_mode': 'Say "hi"', 'x y': 1})
+        self.assertEqual(b'my\\ measurement,a\\,b=c\\=d operation_mode="Say \\"hi\\"",x\\ y=1i', line)
+
+    def test_power_off(self):
+        self.status['operation_mode'] = 'PV power off'
+        self.assertIsNone(LineProtocolEncoder('samil').encode(self.status))
+
+    def test_encode_many(self):
+        off = dict(self.status, operation_mode='PV power off')
+        encoder = LineProtocolEncoder('samil')
+        data = encoder.encode_many([(self.status, 1), (off, 2), (self.status, 3)])
+        lines = data.split(b'\n')
+        self.assertEqual(2, len(lines))
+        self.assertEqual(encoder.encode(self.status, 1), lines[0])
+        self.assertEqual(encoder.encode(self.status, 3), lines[1])
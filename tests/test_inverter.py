@@ -1,13 +1,15 @@
 """Test cases for inverter.py."""
+from decimal import Decimal
 from io import BytesIO
 from queue import Queue
 from socket import socketpair, create_connection
-from threading import Thread
+from threading import Thread, active_count
 from time import sleep
 from unittest import TestCase
 
-from samil.inverter import calculate_checksum, construct_message, Inverter, InverterEOFError, InverterFinder, \
-    InverterNotFoundError, read_message, KeepAliveInverter
+from samil.inverter import calculate_checksum, construct_message, decode_history, HistoryRecord, Inverter, \
+    InverterEOFError, InverterFinder, InverterNotFoundError, read_message, KeepAliveInverter, KeepAliveScheduler, \
+    FrameParser
 
 
 class MessageTestCase(TestCase):
@@ -33,10 +35,123 @@ class MessageTestCase(TestCase):
         self.assertEqual(b"\x06\x01\x02", ident)
         self.assertEqual(b"\x10\x10", payload)
 
+    def test_read_invalid_checksum(self):
+        """Tests read_message function with an invalid checksum."""
+        f = BytesIO(bytes.fromhex("55 aa 06 01 02 00 02 10 10 01 2b"))
+        with self.assertRaises(ValueError):
+            read_message(f)
+
+
+class FrameParserTestCase(TestCase):
+    """Tests for FrameParser class."""
+
+    def test_byte_by_byte(self):
+        """Tests if a message is parsed when it arrives in parts."""
+        parser = FrameParser()
+        data = bytes.fromhex("55 aa 06 01 02 00 02 10 10 01 2a")
+        for b in data[:-1]:
+            parser.feed(bytes([b]))
+            self.assertIsNone(parser.next_message())
+        parser.feed(data[-1:])
+        ident, payload = parser.next_message()
+        self.assertEqual(b"\x06\x01\x02", ident)
+        self.assertEqual(b"\x10\x10", payload)
+        self.assertIsNone(parser.next_message())
+        self.assertEqual(0, len(parser))
+
+    def test_multiple(self):
+        """Tests multiple messages in a single chunk."""
+        parser = FrameParser()
+        parser.feed(construct_message(b"\x01\x02\x03", b"\x01") + construct_message(b"\x04\x05\x06", b""))
+        self.assertEqual((b"\x01\x02\x03", b"\x01"), tuple(bytes(v) for v in parser.next_message()))
+        self.assertEqual((b"\x04\x05\x06", b""), tuple(bytes(v) for v in parser.next_message()))
+        self.assertIsNone(parser.next_message())
+
+    def test_recv_into(self):
+        """Tests receiving into the buffer with a socket."""
+        parser = FrameParser(buffer_size=64)
+        local, remote = socketpair()
+        message = construct_message(b"\x01\x02\x03", bytes(range(100)))
+        remote.send(message * 3)
+        messages = []
+        while len(messages) < 3:
+            msg = parser.next_message()
+            if msg:
+                messages.append(bytes(msg[1]))
+            else:
+                self.assertGreater(parser.recv_into(local.recv_into), 0)
+        self.assertEqual([bytes(range(100))] * 3, messages)
+        local.close()
+        remote.close()
+
+    def test_invalid(self):
+        """Tests if invalid messages raise ValueError."""
+        for data in ["55 ab 06 01 02 00 02 10 10 01 2a", "55 aa 06 01 02 ff ff 10 10 01 2a",
+                     "55 aa 06 01 02 00 02 10 10 01 2b"]:
+            parser = FrameParser()
+            parser.feed(bytes.fromhex(data))
+            with self.assertRaises(ValueError):
+                parser.next_message()
+
+    def test_resync_garbage(self):
+        """Tests if garbage before a message is skipped."""
+        parser = FrameParser(max_errors=1)
+        parser.feed(b"\x00\x55\x12\x34\x56\x78\x9a" + construct_message(b"\x01\x02\x03", b"\x10"))
+        ident, payload = parser.next_message()
+        self.assertEqual(b"\x01\x02\x03", ident)
+        self.assertEqual(7, parser.discarded_bytes)
+        self.assertEqual(1, parser.format_errors)
+        self.assertEqual(0, parser.errors)
+
+    def test_resync_checksum(self):
+        """Tests if a message with invalid checksum is skipped."""
+        parser = FrameParser(max_errors=1)
+        corrupt = bytearray(construct_message(b"\x01\x02\x03", b"\x10\x20"))
+        corrupt[-1] ^= 0xff
+        parser.feed(bytes(corrupt) + construct_message(b"\x04\x05\x06", b""))
+        with self.assertLogs('samil.inverter', 'WARNING') as cm:
+            ident, payload = parser.next_message()
+        self.assertIn("Checksum invalid for message 55aa01020300021020)", cm.output[0])
+        self.assertEqual(b"\x04\x05\x06", ident)
+        self.assertEqual(len(corrupt), parser.discarded_bytes)
+        self.assertEqual(1, parser.checksum_errors)
+
+    def test_resync_partial_marker(self):
+        """Tests if a marker that is split over two chunks is found."""
+        parser = FrameParser(max_errors=1)
+        msg = construct_message(b"\x01\x02\x03", b"")
+        parser.feed(b"\x00" * 10 + msg[:1])
+        self.assertIsNone(parser.next_message())
+        parser.feed(msg[1:])
+        self.assertEqual(b"\x01\x02\x03", parser.next_message()[0])
+        self.assertEqual(10, parser.discarded_bytes)
+
+    def test_error_budget(self):
+        """Tests if ValueError is raised when the error budget is spent."""
+        parser = FrameParser(max_errors=2)
+        bad = b"\x55\xaa\x01\x02\x03\x00\x00\x00\x00"
+        parser.feed(bad + bad + construct_message(b"\x01\x02\x03", b""))
+        self.assertIsNotNone(parser.next_message())
+        parser.feed(bad * 3)
+        with self.assertRaises(ValueError):
+            parser.next_message()
+
 
 message = b"\x55\xaa\x00\x01\x02\x00\x00\x01\x02"  # Sample inverter message
 
 
+class DecodeHistoryTestCase(TestCase):
+    def test_decode(self):
+        payload = bytes.fromhex("15 00 00 01 2c") + bytes(20)
+        records = decode_history(payload)
+        self.assertEqual(12, len(records))
+        self.assertEqual(HistoryRecord(2021, 2, Decimal('30.0')), records[1])
+
+    def test_short(self):
+        self.assertEqual([HistoryRecord(2021, 1, Decimal('0.5'))], decode_history(bytes.fromhex("15 00 05 00")))
+        self.assertEqual([], decode_history(b""))
+
+
 class InverterConnectionTestCase(TestCase):
     """Test low-level send/receive inverter messages over a socket connection.
 
@@ -106,6 +221,57 @@ class InverterConnectionTestCase(TestCase):
         self.assertEqual(b"\x00\x01\x02", ident)
         self.assertEqual(b"", payload)
 
+    def test_corrupt_message(self):
+        """Tests if a corrupt message is skipped."""
+        self.sock.send(b"\x55\xaa\x00\x01\x02\x00\x00\x01\x03" + message)
+        ident, payload = self.inverter.receive()
+        self.assertEqual(b"\x00\x01\x02", ident)
+        self.assertEqual(1, self.inverter.parser.checksum_errors)
+
+    def test_pipeline(self):
+        """Tests if responses are routed to the matching requests."""
+        # Responses arrive in a different order than the requests, with an unrelated message in between
+        self.sock.send(construct_message(b"\x01\x83\x00", b"model") +
+                       construct_message(b"\x04\x80\x00", b"") +
+                       construct_message(b"\x01\x80\x00", b"format"))
+        responses = self.inverter.pipeline([(b"\x01\x00\x02", b"", b"\x01\x80"),
+                                            (b"\x01\x03\x02", b"", b"\x01\x83")])
+        self.assertEqual([(b"\x01\x80\x00", b"format"), (b"\x01\x83\x00", b"model")], responses)
+        # Both requests were sent
+        self.assertEqual(construct_message(b"\x01\x00\x02", b"") + construct_message(b"\x01\x03\x02", b""),
+                         self.sock.recv(4096))
+
+    def test_status_max_age(self):
+        """Tests if an unrequested status response is used by status()."""
+        status_format = bytes.fromhex("00 0c")
+        self.sock.send(construct_message(b"\x01\x80\x00", status_format) +
+                       construct_message(b"\x01\x82\x00", bytes.fromhex("00 c8 00 01")))
+        self.assertEqual('Normal', self.inverter.status()['operation_mode'])
+        # Status response arriving while waiting for another response
+        self.sock.send(construct_message(b"\x01\x82\x00", bytes.fromhex("00 c8 00 05")) +
+                       construct_message(b"\x01\x83\x00", b""))
+        self.inverter.request(b"\x01\x03\x02", b"", b"\x01\x83")
+        self.assertEqual('PV power off', self.inverter.status(max_age=10.0)['operation_mode'])
+        self.sock.recv(4096)
+        # Too old, does a new request
+        sleep(0.05)
+        self.sock.send(construct_message(b"\x01\x82\x00", bytes.fromhex("00 c8 00 04")))
+        self.assertEqual('Check', self.inverter.status(max_age=0.02)['operation_mode'])
+
+    def test_history(self):
+        """Tests if history records are yielded per year."""
+        months = b"".join(i.to_bytes(2, 'big') for i in range(1, 13))
+        self.sock.send(construct_message(b"\x06\x81\x00", b"\x13" + months))
+        records = self.inverter.history(2019, 2020)
+        first = next(records)
+        self.assertEqual(HistoryRecord(2019, 1, Decimal('0.1')), first)
+        # Only the first year is requested so far
+        self.assertEqual(construct_message(b"\x06\x01\x02", b"\x13\x13"), self.sock.recv(4096))
+        self.sock.send(construct_message(b"\x06\x81\x00", b"\x14" + months))
+        records = [first] + list(records)
+        self.assertEqual(24, len(records))
+        self.assertEqual(HistoryRecord(2020, 12, Decimal('1.2')), records[-1])
+
     def test_send(self):
         """Tests whether a message from the app will arrive at the receiver."""
         self.inverter.send(b"\x00\x01\x02", b"")
@@ -225,3 +391,50 @@ class KeepAliveInverterTestCase(TestCase):
         """Tests if the keep-alive messages will stop cleanly."""
         self.inverter.disconnect()
         sleep(0.02)
+
+
+class KeepAliveSchedulerTestCase(TestCase):
+    """Tests for KeepAliveScheduler class."""
+
+    def test_many_inverters(self):
+        """Tests if keep-alive messages are sent for many inverters without a thread per inverter."""
+        scheduler = KeepAliveScheduler(workers=2)
+        pairs = [socketpair() for i in range(20)]
+        threads_before = active_count()
+        inverters = [KeepAliveInverter(local, None, keep_alive=0.05, scheduler=scheduler) for local, remote in pairs]
+        try:
+            for local, remote in pairs:
+                remote.settimeout(1.0)
+                msg = remote.recv(4096)
+                self.assertTrue(msg.startswith(b"\x55\xaa\x01\x02\x02"))
+                remote.send(bytes.fromhex("55 aa 01 82 00 00 00 01 82"))
+            # One scheduler thread and at most 2 workers
+            self.assertLessEqual(active_count() - threads_before, 3)
+        finally:
+            for i in inverters:
+                i.disconnect()
+            for local, remote in pairs:
+                remote.close()
+
+    def test_no_threads_per_request(self):
+        """Tests if sending does not create new threads."""
+        scheduler = KeepAliveScheduler()
+        local, remote = socketpair()
+        inverter = KeepAliveInverter(local, None, scheduler=scheduler)
+        threads_before = active_count()
+        for i in range(10):
+            inverter.send(b"\x01\x02\x03", b"")
+        self.assertEqual(threads_before, active_count())
+        inverter.disconnect()
+        remote.close()
+
+    def test_register_twice(self):
+        """Tests if starting keep-alive twice raises an error."""
+        local, remote = socketpair()
+        inverter = KeepAliveInverter(local, None, scheduler=KeepAliveScheduler())
+        with self.assertRaises(RuntimeError):
+            inverter.start_keep_alive()
+        inverter.stop_keep_alive()
+        inverter.start_keep_alive()
+        inverter.disconnect()
+        remote.close()
@@ -0,0 +1,128 @@
+"""Test cases for inverterutil.py."""
+from socket import create_connection
+from threading import Thread
+from time import time, sleep
+from unittest import TestCase
+
+from samil.inverter import construct_message, InverterFinder, InverterNotFoundError, read_message
+from samil.inverterutil import find_inverters, StatusPoller
+
+
+def fake_inverter(serial_number: str):
+    """Connects to the finder and answers the model request, then waits for the connection to close."""
+    model = b'1  4500V1.30River 4500TL-D\x00 SamilPower\x00     ' + serial_number.encode().ljust(16, b'\x00') + \
+        b'V1.30V1.302'
+    with create_connection(('127.0.0.1', 1200)) as sock:
+        sock.settimeout(2.0)
+        with sock.makefile('rwb') as f:
+            try:
+                while True:
+                    ident, payload = read_message(f)
+                    if ident == b'\x01\x03\x02':
+                        f.write(construct_message(b'\x01\x83\x00', model))
+                        f.flush()
+            except Exception:
+                pass  # Connection closed
+
+
+class FindInvertersTestCase(TestCase):
+    def start_inverters(self, *serial_numbers):
+        threads = [Thread(target=fake_inverter, args=(s,)) for s in serial_numbers]
+        for t in threads:
+            t.start()
+        return threads
+
+    def test_multiple(self):
+        """Tests if all inverters are found in parallel and their model is kept."""
+        with InverterFinder() as finder:
+            threads = self.start_inverters("A1", "A2", "A3")
+            start = time()
+            inverters = find_inverters(finder, 3, timeout=5.0, handshake_delay=0.2)
+            duration = time() - start
+        self.assertEqual({"A1", "A2", "A3"}, {i.serial_number for i in inverters})
+        self.assertEqual({"A1", "A2", "A3"}, {i.last_model['serial_number'] for i in inverters})
+        # Handshakes did not happen one after another
+        self.assertLess(duration, 0.5)
+        for i in inverters:
+            i.disconnect()
+        for t in threads:
+            t.join()
+
+    def test_serial_numbers(self):
+        """Tests if only inverters with the given serial numbers are returned."""
+        with InverterFinder() as finder:
+            threads = self.start_inverters("A1", "A2", "A3")
+            inverters = find_inverters(finder, serial_numbers=["A3", "A1"], timeout=5.0, handshake_delay=0.01)
+        self.assertEqual({"A1", "A3"}, {i.serial_number for i in inverters})
+        for i in inverters:
+            i.disconnect()
+        for t in threads:
+            t.join()
+
+    def test_not_found(self):
+        """Tests if InverterNotFoundError is raised when not all inverters connect."""
+        with InverterFinder() as finder:
+            threads = self.start_inverters("A1")
+            with self.assertRaises(InverterNotFoundError):
+                find_inverters(finder, 2, timeout=0.5, interval=0.1, handshake_delay=0.01)
+        for t in threads:
+            t.join()
+
+
+class SlowInverter:
+    """Mimics an inverter that takes some time to respond."""
+
+    def __init__(self, delay: float, name: str):
+        self.delay = delay
+        self.addr = name
+        self.requests = 0
+        self.max_age = None
+
+    def status(self, max_age: float = None):
+        self.requests += 1
+        self.max_age = max_age
+        if self.delay < 0:
+            raise OSError("Connection lost")
+        sleep(self.delay)
+        return {'name': self.addr}
+
+
+class StatusPollerTestCase(TestCase):
+    def test_parallel(self):
+        """Tests if all inverters are requested at once."""
+        with StatusPoller([SlowInverter(0.2, "A"), SlowInverter(0.2, "B"), SlowInverter(0.2, "C")]) as poller:
+            start = time()
+            result = poller.poll(timeout=1.0)
+            self.assertLess(time() - start, 0.5)
+        self.assertEqual([{'name': "A"}, {'name': "B"}, {'name': "C"}], result)
+
+    def test_deadline(self):
+        """Tests if an inverter that is too late is skipped and not requested twice."""
+        slow = SlowInverter(0.3, "B")
+        with StatusPoller([SlowInverter(0.0, "A"), slow]) as poller:
+            self.assertEqual([{'name': "A"}, None], poller.poll(timeout=0.1))
+            # The pending request is reused
+            self.assertEqual([{'name': "A"}, {'name': "B"}], poller.poll(timeout=1.0))
+            self.assertEqual(1, slow.requests)
+
+    def test_late_result(self):
+        """Tests if a request that finished after the deadline is used by the next poll."""
+        slow = SlowInverter(0.1, "B")
+        with StatusPoller([SlowInverter(0.0, "A"), slow]) as poller:
+            self.assertEqual([{'name': "A"}, None], poller.poll(timeout=0.01))
+            sleep(0.2)
+            self.assertEqual([{'name': "A"}, {'name': "B"}], poller.poll(timeout=1.0))
+            self.assertEqual(1, slow.requests)
+
+    def test_max_age(self):
+        """Tests if the max age is passed to the inverters."""
+        inverter = SlowInverter(0.0, "A")
+        with StatusPoller([inverter]) as poller:
+            poller.poll(max_age=5.0)
+        self.assertEqual(5.0, inverter.max_age)
+
+    def test_exception(self):
+        """Tests if a failed request raises an exception."""
+        with StatusPoller([SlowInverter(0.0, "A"), SlowInverter(-1.0, "B")]) as poller:
+            with self.assertRaises(OSError):
+                poller.poll()
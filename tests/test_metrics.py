@@ -0,0 +1,89 @@
+"""Test cases for metrics.py."""
+import socket
+from socket import socketpair
+from unittest import TestCase
+
+from samil.inverter import construct_message, Inverter, KeepAliveInverter
+from samil.metrics import Histogram, Metrics, MetricsCollector
+
+model_response = construct_message(b"\x01\x83\x00", b"1  4500V1.30River 4500TL-D\x00 SamilPower\x00     "
+                                                    b"DW413B8080\x00\x00\x00\x00\x00\x00V1.30V1.302")
+
+
+class HistogramTestCase(TestCase):
+    def test_cumulative(self):
+        """Tests if values are counted in the first bucket with a bound that is not lower."""
+        histogram = Histogram([0.1, 1.0])
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual([(0.1, 2), (1.0, 3), (float('inf'), 4)], histogram.cumulative())
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(2.65, histogram.sum)
+
+
+class MetricsCollectorTestCase(TestCase):
+    def setUp(self) -> None:
+        local, self.sock = socketpair()
+        local.settimeout(1.0)
+        self.metrics = MetricsCollector()
+        self.inverter = Inverter(local, ('192.168.1.2', 1234), metrics=self.metrics)
+
+    def tearDown(self) -> None:
+        self.inverter.disconnect()
+        self.sock.close()
+
+    def test_request(self):
+        """Tests if round-trip times and bytes are recorded by serial number."""
+        self.sock.send(model_response)
+        self.inverter.model()
+        stats = self.metrics.snapshot()['DW413B8080']
+        self.assertEqual(1, stats.requests[b"\x01\x03\x02"].count)
+        self.assertEqual(9, stats.bytes_sent)
+        self.assertEqual(len(model_response), stats.bytes_received)
+
+    def test_address(self):
+        """Tests if the network address is used while the serial number is not known."""
+        self.sock.send(construct_message(b"\x01\x80\x00", b""))
+        self.inverter.status_format()
+        self.assertEqual(["('192.168.1.2', 1234)"], list(self.metrics.snapshot()))
+
+    def test_errors(self):
+        """Tests if discarded frames, unexpected responses and timeouts are counted."""
+        self.sock.send(b"\x55\xaa\x00\x01\x02\x00\x00\x01\x03" + construct_message(b"\x04\x80\x00", b"") +
+                       construct_message(b"\x01\x80\x00", b""))
+        self.inverter.status_format()
+        self.inverter.sock.settimeout(0.01)
+        with self.assertRaises(socket.timeout):
+            self.inverter.status_format()
+        stats = list(self.metrics.snapshot().values())[0]
+        self.assertEqual(1, stats.frames_discarded)
+        self.assertEqual(1, stats.unexpected_responses)
+        self.assertEqual(1, stats.timeouts)
+
+    def test_keep_alive(self):
+        """Tests if the keep-alive time is recorded, and not as status request."""
+        inverter = KeepAliveInverter(self.inverter.sock, None, keep_alive=60.0, metrics=self.metrics)
+        inverter.stop_keep_alive()
+        self.sock.send(construct_message(b"\x01\x82\x00", b""))
+        inverter.keep_alive()
+        stats = list(self.metrics.snapshot().values())[0]
+        self.assertEqual(1, stats.keep_alives.count)
+        self.assertEqual({}, stats.requests)
+
+    def test_snapshot_copy(self):
+        """Tests if a snapshot does not change afterwards."""
+        self.sock.send(model_response + model_response)
+        self.inverter.model()
+        snapshot = self.metrics.snapshot()
+        self.inverter.model()
+        self.assertEqual(1, snapshot['DW413B8080'].requests[b"\x01\x03\x02"].count)
+
+
+class MetricsTestCase(TestCase):
+    def test_noop(self):
+        """Tests if the base class can be used as a no-op receiver."""
+        local, remote = socketpair()
+        with Inverter(local, None, metrics=Metrics()) as inverter:
+            remote.send(model_response)
+            inverter.model()
+        remote.close()
@@ -0,0 +1,169 @@
+from collections import namedtuple
+from decimal import Decimal
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import TestCase
+
+from samil.mqtt import BufferedPublisher, DeadbandFilter
+from samil.spool import Spool
+
+
+class DeadbandFilterTestCase(TestCase):
+    def setUp(self) -> None:
+        self.status = {
+            'operation_mode': 'Normal',
+            'output_power': Decimal('2589'),
+            'pv1_voltage': Decimal('586.5'),
+            'energy_today': Decimal('21.2'),
+        }
+
+    def test_first(self):
+        """Tests if all fields are selected the first time."""
+        self.assertEqual(self.status, DeadbandFilter().filter(self.status))
+
+    def test_unchanged(self):
+        f = DeadbandFilter()
+        f.filter(self.status)
+        self.assertEqual({}, f.filter(self.status))
+
+    def test_no_deadband(self):
+        f = DeadbandFilter()
+        f.filter(self.status)
+        self.status['energy_today'] = Decimal('21.3')
+        self.status['operation_mode'] = 'PV power off'
+        self.assertEqual({'energy_today': Decimal('21.3'), 'operation_mode': 'PV power off'}, f.filter(self.status))
+
+    def test_deadband(self):
+        f = DeadbandFilter({'output_power': Decimal(5)})
+        f.filter(self.status)
+        self.status['output_power'] = Decimal('2594')
+        self.assertEqual({}, f.filter(self.status))
+        self.status['output_power'] = Decimal('2595')
+        self.assertEqual({'output_power': Decimal('2595')}, f.filter(self.status))
+
+    def test_drift(self):
+        """Tests if slow changes are compared with the last selected value."""
+        f = DeadbandFilter({'output_power': Decimal(5)})
+        f.filter(self.status)
+        for power in ('2586', '2585', '2584'):
+            self.status['output_power'] = Decimal(power)
+            self.assertEqual({}, f.filter(self.status))
+        self.status['output_power'] = Decimal('2583.9')
+        self.assertEqual({'output_power': Decimal('2583.9')}, f.filter(self.status))
+
+    def test_pattern(self):
+        f = DeadbandFilter({'pv1_voltage': Decimal('0.5'), '*_voltage': Decimal('0.1'), '*': Decimal(1)})
+        self.assertEqual(Decimal('0.5'), f.deadband('pv1_voltage'))
+        self.assertEqual(Decimal('0.1'), f.deadband('grid_voltage'))
+        self.assertEqual(Decimal(1), f.deadband('output_power'))
+
+    def test_refresh(self):
+        f = DeadbandFilter(refresh_interval=3)
+        f.filter(self.status)
+        self.assertEqual({}, f.filter(self.status))
+        self.assertEqual({}, f.filter(self.status))
+        self.assertEqual(self.status, f.filter(self.status))
+        self.assertEqual({}, f.filter(self.status))
+
+
+MessageInfo = namedtuple('MessageInfo', ['rc', 'mid'])
+
+
+class FakeClient:
+    """Records published messages, fails when disconnected like paho does for QoS 0."""
+
+    def __init__(self):
+        self.messages = []
+        self.connected = False
+        self.on_connect = self.on_disconnect = self.on_publish = None
+
+    def publish(self, topic, payload, qos=0):
+        if not self.connected:
+            return MessageInfo(4, len(self.messages))  # MQTT_ERR_NO_CONN
+        self.messages.append((topic, payload))
+        self.on_publish(self, None, len(self.messages))
+        return MessageInfo(0, len(self.messages))
+
+    def connect(self):
+        self.connected = True
+        self.on_connect(self, None, {}, 0)
+
+    def disconnect(self):
+        self.connected = False
+        self.on_disconnect(self, None, 7)
+
+
+class BufferedPublisherTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = FakeClient()
+
+    def test_connected(self):
+        with BufferedPublisher(self.client) as publisher:
+            self.client.connect()
+            publisher.publish('a', '1')
+            self.assertEqual([('a', '1')], self.client.messages)
+            self.assertEqual(1, publisher.acked)
+            self.assertEqual(0, publisher.queued)
+
+    def test_queue_and_drain(self):
+        """Tests if messages are queued while disconnected and published in order after connecting."""
+        with BufferedPublisher(self.client) as publisher:
+            publisher.publish('a', '1')
+            publisher.publish('a', '2')
+            self.assertEqual(2, publisher.queued)
+            self.client.connect()
+            sleep(0.05)
+            publisher.publish('a', '3')
+            sleep(0.05)
+            self.assertEqual([('a', '1'), ('a', '2'), ('a', '3')], self.client.messages)
+            self.assertEqual(3, publisher.published)
+
+    def test_disconnect(self):
+        """Tests if a failed publish is queued."""
+        with BufferedPublisher(self.client) as publisher:
+            self.client.connect()
+            self.client.connected = False  # Connection lost, not yet noticed
+            publisher.publish('a', '1')
+            self.assertEqual(1, publisher.queued)
+            self.client.connect()
+            sleep(0.05)
+            self.assertEqual([('a', '1')], self.client.messages)
+
+    def test_queue_full(self):
+        with BufferedPublisher(self.client, queue_size=2) as publisher:
+            for i in range(4):
+                publisher.publish('a', str(i))
+            self.assertEqual(2, publisher.dropped)
+            self.client.connect()
+            sleep(0.05)
+            self.assertEqual([('a', '2'), ('a', '3')], self.client.messages)
+
+    def test_spool(self):
+        """Tests if messages overflow to the spool and are published in order."""
+        with TemporaryDirectory() as tmp:
+            with BufferedPublisher(self.client, queue_size=2, spool=Spool(tmp)) as publisher:
+                for i in range(5):
+                    publisher.publish('a', str(i))
+                self.assertEqual(0, publisher.dropped)
+                self.client.connect()
+                sleep(0.05)
+                self.assertEqual([('a', str(i)) for i in range(5)], self.client.messages)
+                self.assertEqual(0, len(publisher.spool))
+
+    def test_close_spools(self):
+        """Tests if queued messages are kept in the spool on close."""
+        with TemporaryDirectory() as tmp:
+            with BufferedPublisher(self.client, spool=Spool(tmp)) as publisher:
+                publisher.publish('a', '1')
+            with BufferedPublisher(self.client, spool=Spool(tmp)):
+                self.client.connect()
+                sleep(0.05)
+                self.assertEqual([('a', '1')], self.client.messages)
+
+    def test_max_rate(self):
+        with BufferedPublisher(self.client, max_rate=20) as publisher:
+            for i in range(3):
+                publisher.publish('a', str(i))
+            self.client.connect()
+            sleep(0.075)
+            self.assertEqual(2, len(self.client.messages))
@@ -0,0 +1,95 @@
+"""Test cases for prometheus.py."""
+from decimal import Decimal
+from http.client import HTTPConnection
+from socket import socketpair
+from unittest import TestCase
+
+from samil.inverter import construct_message, Inverter
+from samil.metrics import MetricsCollector
+from samil.prometheus import CONTENT_TYPE, MetricsServer, StatusCache
+
+model_response = construct_message(b"\x01\x83\x00", b"1  4500V1.30River 4500TL-D\x00 SamilPower\x00     "
+                                                    b"DW413B8080\x00\x00\x00\x00\x00\x00V1.30V1.302")
+
+
+class StatusCacheTestCase(TestCase):
+    def test_status(self):
+        """Tests if numeric fields are gauges and the operation mode is a label."""
+        cache = StatusCache()
+        cache.update('DW413B8080', {'operation_mode': 'Normal', 'output_power': Decimal('2589.0'),
+                                    'total_operation_time': 45}, 1500000000.0)
+        lines = cache.render().decode().splitlines()
+        self.assertIn('samil_up{serial_number="DW413B8080"} 1', lines)
+        self.assertIn('samil_output_power{serial_number="DW413B8080"} 2589.0', lines)
+        self.assertIn('samil_total_operation_time{serial_number="DW413B8080"} 45', lines)
+        self.assertIn('samil_operation_mode{mode="Normal",serial_number="DW413B8080"} 1', lines)
+        self.assertIn('samil_last_status_timestamp_seconds{serial_number="DW413B8080"} 1500000000.0', lines)
+        self.assertIn('# TYPE samil_output_power gauge', lines)
+
+    def test_missed(self):
+        """Tests if a missed poll keeps the status and marks the inverter down."""
+        cache = StatusCache()
+        cache.update('A', {'output_power': Decimal('10.0')}, 0.0)
+        cache.missed('A')
+        cache.missed('A')
+        lines = cache.render().decode().splitlines()
+        self.assertIn('samil_up{serial_number="A"} 0', lines)
+        self.assertIn('samil_poll_missed_total{serial_number="A"} 2', lines)
+        self.assertIn('samil_output_power{serial_number="A"} 10.0', lines)
+
+    def test_poll_duration(self):
+        """Tests the poll duration histogram."""
+        cache = StatusCache()
+        cache.poll_completed(1.2)
+        lines = cache.render().decode().splitlines()
+        self.assertIn('samil_poll_duration_seconds_bucket{le="1.0"} 0', lines)
+        self.assertIn('samil_poll_duration_seconds_bucket{le="1.5"} 1', lines)
+        self.assertIn('samil_poll_duration_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('samil_poll_duration_seconds_count 1', lines)
+
+    def test_escape(self):
+        """Tests if label values are escaped."""
+        cache = StatusCache()
+        cache.missed('a"b\\c')
+        self.assertIn(b'samil_up{serial_number="a\\"b\\\\c"} 0', cache.render())
+
+    def test_communication(self):
+        """Tests if the request durations and counters of the collector are included."""
+        local, remote = socketpair()
+        metrics = MetricsCollector()
+        with Inverter(local, None, metrics=metrics) as inverter:
+            remote.send(model_response)
+            inverter.model()
+        remote.close()
+        lines = StatusCache(metrics).render().decode().splitlines()
+        self.assertIn('samil_request_duration_seconds_count{request="010302",serial_number="DW413B8080"} 1', lines)
+        self.assertIn('samil_bytes_sent_total{serial_number="DW413B8080"} 9', lines)
+        self.assertIn('samil_receive_timeouts_total{serial_number="DW413B8080"} 0', lines)
+
+
+class MetricsServerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.cache = StatusCache()
+        self.cache.update('A', {'output_power': Decimal('10.0')}, 0.0)
+        self.server = MetricsServer(self.cache, '127.0.0.1', 0)
+        self.server.start()
+        self.connection = HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5.0)
+
+    def tearDown(self) -> None:
+        self.connection.close()
+        self.server.close()
+
+    def test_metrics(self):
+        """Tests if the rendered cache is served on /metrics."""
+        self.connection.request('GET', '/metrics')
+        response = self.connection.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertEqual(CONTENT_TYPE, response.getheader('Content-Type'))
+        self.assertEqual(self.cache.render(), response.read())
+
+    def test_not_found(self):
+        """Tests if other paths are not found."""
+        self.connection.request('GET', '/')
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(404, response.status)
@@ -0,0 +1,154 @@
+"""Test cases for proxy.py."""
+import os
+import socket
+import tempfile
+from threading import Event, Thread
+from unittest import skipUnless, TestCase
+
+from samil.inverter import Inverter, InverterEOFError
+from samil.proxy import connect, InverterProxy, parse_address, ProxyServer, response_identifier
+from samil.simulator import VirtualInverter
+
+
+class FakeInverter:
+    """Answers requests like a virtual inverter, counts them and optionally blocks until released."""
+
+    addr = ('192.168.1.2', 1234)
+
+    def __init__(self):
+        self.virtual = VirtualInverter('DW413B8080')
+        self.requests = []
+        self.release = Event()
+        self.release.set()
+
+    def request(self, identifier: bytes, payload: bytes, expected_response_id=b""):
+        self.requests.append(identifier)
+        self.release.wait(5.0)
+        response = self.virtual.respond(identifier, payload)
+        assert response[0].startswith(expected_response_id)
+        return response
+
+
+class InverterProxyTestCase(TestCase):
+    def setUp(self) -> None:
+        self.inverter = FakeInverter()
+        self.proxy = InverterProxy(self.inverter, max_age=60.0)
+
+    def test_coalesce(self):
+        """Tests if concurrent status requests cause a single inverter request."""
+        self.inverter.release.clear()
+        responses = []
+        threads = [Thread(target=lambda: responses.append(self.proxy.request(b'\x01\x02\x02', b'')))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        while self.proxy.requests < 5:
+            pass  # Wait until all requests are waiting
+        self.inverter.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual([b'\x01\x02\x02'], self.inverter.requests)
+        self.assertEqual(5, len(responses))
+        self.assertEqual(1, len(set(responses)))
+
+    def test_cache(self):
+        """Tests if a fresh response is reused and a stale one is not."""
+        self.proxy.request(b'\x01\x02\x02', b'')
+        self.proxy.request(b'\x01\x02\x02', b'')
+        self.assertEqual(1, self.proxy.forwarded)
+        self.proxy.max_age = 0.0
+        self.proxy.request(b'\x01\x02\x02', b'')
+        self.proxy.request(b'\x01\x03\x02', b'')
+        self.proxy.request(b'\x01\x03\x02', b'')
+        self.assertEqual([b'\x01\x02\x02', b'\x01\x02\x02', b'\x01\x03\x02'], self.inverter.requests)
+
+    def test_forward(self):
+        """Tests if other requests are always forwarded."""
+        self.proxy.request(b'\x06\x01\x02', b'\x0a\x0a')
+        self.proxy.request(b'\x06\x01\x02', b'\x0a\x0a')
+        self.assertEqual(2, self.proxy.forwarded)
+
+    def test_error(self):
+        """Tests if waiting requests get the exception of the inverter request."""
+        def request(*args):
+            raise OSError
+
+        self.inverter.request = request
+        with self.assertRaises(OSError):
+            self.proxy.request(b'\x01\x02\x02', b'')
+        with self.assertRaises(OSError):
+            self.proxy.request(b'\x01\x02\x02', b'')
+
+
+class ProxyServerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.inverter = FakeInverter()
+        self.proxy = InverterProxy(self.inverter)
+
+    def assertClientsShare(self, address):
+        """Connects two clients and checks that they share the inverter requests."""
+        clients = [Inverter(connect(address), address) for i in range(2)]
+        try:
+            for client in clients:
+                self.assertEqual('DW413B8080', client.model()['serial_number'])
+                self.assertIn('output_power', client.status())
+        finally:
+            for client in clients:
+                client.disconnect()
+        self.assertEqual(6, self.proxy.requests)
+        self.assertEqual(3, self.proxy.forwarded)
+
+    def test_tcp(self):
+        """Tests if multiple TCP clients can use the inverter."""
+        with ProxyServer(self.proxy, ('127.0.0.1', 0)) as server:
+            self.assertClientsShare(server.server_address)
+
+    def assertRequestFails(self, error: Exception):
+        """Lets an inverter request fail and checks that the client is disconnected."""
+        def request(*args):
+            raise error
+
+        self.inverter.request = request
+        with ProxyServer(self.proxy, ('127.0.0.1', 0)) as server:
+            client = Inverter(connect(server.server_address), server.server_address)
+            try:
+                with self.assertRaises(InverterEOFError):
+                    client.model()
+            finally:
+                client.disconnect()
+        return server
+
+    def test_request_error(self):
+        """Tests if a failed request only disconnects the client."""
+        with self.assertLogs('samil.proxy'):
+            server = self.assertRequestFails(socket.timeout())
+        self.assertIsNone(server.error)
+
+    def test_connection_lost(self):
+        """Tests if the error is set when the inverter connection is lost."""
+        with self.assertLogs('samil.proxy'):
+            server = self.assertRequestFails(InverterEOFError())
+        self.assertIsInstance(server.error, InverterEOFError)
+
+    @skipUnless(hasattr(socket, 'AF_UNIX'), "Unix sockets are not supported")
+    def test_unix(self):
+        """Tests if multiple Unix socket clients can use the inverter."""
+        from samil.proxy import UnixProxyServer
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inverter.sock')
+            with UnixProxyServer(self.proxy, path):
+                self.assertClientsShare(path)
+            self.assertFalse(os.path.exists(path))
+
+
+class FunctionsTestCase(TestCase):
+    def test_response_identifier(self):
+        """Tests the response identifier of a request."""
+        self.assertEqual(b'\x01\x82', response_identifier(b'\x01\x02\x02'))
+        self.assertEqual(b'\x06\x81', response_identifier(b'\x06\x01\x02'))
+
+    def test_parse_address(self):
+        """Tests if host and port are split and other values are Unix socket paths."""
+        self.assertEqual(('localhost', 1201), parse_address('localhost:1201'))
+        self.assertEqual(('127.0.0.1', 1201), parse_address(':1201'))
+        self.assertEqual('/run/samil/DW413B8080.sock', parse_address('/run/samil/DW413B8080.sock'))
@@ -1,7 +1,15 @@
+import socket
+from datetime import datetime, timedelta
 from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from time import time
 from unittest import TestCase
+from urllib.parse import parse_qs
 
-from samil.pvoutput import aggregate_statuses
+from samil.pvoutput import aggregate_statuses, PVOutputClient, PVOutputError, RequestBudget, StatusQueue, \
+    StatusUploader, UploadScheduler
 
 
 class AggregateStatusesTestCase(TestCase):
@@ -66,3 +74,178 @@ class AggregateStatusesTestCase(TestCase):
             'temp': Decimal('21.1'),
             'voltage': Decimal('451.8'),
         }, r)
+
+
+class FakePVOutputHandler(BaseHTTPRequestHandler):
+    """Handles addbatchstatus requests, responds with the responses of the server."""
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.requests.append((self.path, parse_qs(body), self.client_address))
+        status, text = self.server.responses.pop(0) if self.server.responses else (200, None)
+        if text is None:
+            # Add all statuses
+            text = ';'.join(','.join(item.split(',')[:2] + ['1'])
+                            for item in parse_qs(body)['data'][0].split(';'))
+        data = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Rate-Limit-Remaining', str(self.server.remaining))
+        self.send_header('X-Rate-Limit-Reset', str(int(time()) + 600))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakePVOutputServer(ThreadingMixIn, HTTPServer):
+    """Handles each keep-alive connection in a separate thread."""
+    daemon_threads = True
+
+
+class PVOutputTestCase(TestCase):
+    def setUp(self) -> None:
+        self.server = FakePVOutputServer(('127.0.0.1', 0), FakePVOutputHandler)
+        self.server.requests = []
+        self.server.responses = []
+        self.server.remaining = 59
+        Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.client = PVOutputClient('123', 'key', url='http://127.0.0.1:{}'.format(self.server.server_port))
+        self.date = datetime.now().replace(second=0, microsecond=0)
+        self.status = {'energy_gen': 5670, 'power_gen': 170, 'temp': Decimal('21.1'), 'voltage': Decimal('228.5')}
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_add_batch_status(self):
+        date2 = self.date + timedelta(minutes=5)
+        self.server.responses.append((200, '{0:%Y%m%d,%H:%M},1;{1:%Y%m%d,%H:%M},0'.format(self.date, date2)))
+        added = self.client.add_batch_status([(self.date, self.status), (date2, self.status)])
+        self.assertEqual([True, False], added)
+        path, data, addr = self.server.requests[0]
+        self.assertEqual('/service/r2/addbatchstatus.jsp', path)
+        self.assertEqual('{0:%Y%m%d,%H:%M},5670,170,,,21.1,228.5;{1:%Y%m%d,%H:%M},5670,170,,,21.1,228.5'.format(
+            self.date, date2), data['data'][0])
+
+    def test_keep_alive(self):
+        """Tests if the connection is reused."""
+        self.client.add_batch_status([(self.date, self.status)])
+        self.client.add_batch_status([(self.date, self.status)])
+        self.assertEqual(self.server.requests[0][2], self.server.requests[1][2])
+
+    def test_stale_connection(self):
+        """Tests if a request is retried on a new connection and counts once in the budget."""
+        self.client.add_batch_status([(self.date, self.status)])
+        self.client._connection.sock.shutdown(socket.SHUT_RDWR)
+        self.client.add_batch_status([(self.date, self.status)])
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual(58, self.client.budget.available())
+
+    def test_error(self):
+        self.server.responses.append((400, 'Bad request 400: Invalid date'))
+        with self.assertRaises(PVOutputError) as cm:
+            self.client.add_batch_status([(self.date, self.status)])
+        self.assertEqual(400, cm.exception.status)
+
+    def test_rate_limit(self):
+        self.client.budget.limit = 2
+        self.assertEqual(0, self.client.wait_time())
+        self.client.add_batch_status([(self.date, self.status)])
+        self.client.add_batch_status([(self.date, self.status)])
+        self.assertGreater(self.client.wait_time(), 3500)
+
+    def test_rate_limit_header(self):
+        self.server.remaining = 0
+        self.client.add_batch_status([(self.date, self.status)])
+        self.assertGreater(self.client.wait_time(), 500)
+
+    def test_uploader_batches(self):
+        uploader = StatusUploader(self.client, batch_size=2)
+        for i in range(5):
+            uploader.add(self.date - timedelta(minutes=5 * i), self.status)
+        self.assertEqual(5, uploader.flush())
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(0, len(uploader.queue))
+
+    def test_uploader_backfill(self):
+        """Tests if statuses stay queued when the upload fails."""
+        uploader = StatusUploader(self.client)
+        self.server.responses.append((503, 'Service unavailable'))
+        uploader.add(self.date - timedelta(minutes=5), self.status)
+        self.assertEqual(0, uploader.flush())
+        uploader.add(self.date, self.status)
+        self.assertEqual(2, uploader.flush())
+        self.assertEqual(2, len(self.server.requests[1][1]['data'][0].split(';')))
+
+    def test_uploader_rejected(self):
+        """Tests if a rejected batch is dropped."""
+        uploader = StatusUploader(self.client)
+        self.server.responses.append((400, 'Bad request 400: Invalid date'))
+        uploader.add(self.date, self.status)
+        self.assertEqual(0, uploader.flush())
+        self.assertEqual(0, len(uploader.queue))
+
+    def test_uploader_rejected_status(self):
+        """Tests if only the rejected status of a batch is dropped."""
+        uploader = StatusUploader(self.client)
+        self.server.responses += [(400, 'Bad request 400: Invalid power'), (200, None),
+                                  (400, 'Bad request 400: Invalid power'), (400, 'Bad request 400: Invalid power')]
+        for i in range(4):
+            uploader.add(self.date + timedelta(minutes=5 * i), self.status)
+        self.assertEqual(3, uploader.flush())
+        sizes = [len(data['data'][0].split(';')) for path, data, addr in self.server.requests]
+        self.assertEqual([4, 2, 2, 1, 1], sizes)
+        self.assertEqual(0, len(uploader.queue))
+
+    def test_scheduler_shared_budget(self):
+        """Tests if systems with the same API key share the budget evenly."""
+        budget = RequestBudget(3)
+        url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        uploaders = [StatusUploader(PVOutputClient(system_id, 'key', url=url, budget=budget), batch_size=1)
+                     for system_id in ('1', '2')]
+        for uploader in uploaders:
+            for i in range(2):
+                uploader.add(self.date - timedelta(minutes=5 * i), self.status)
+        scheduler = UploadScheduler(uploaders)
+        self.assertEqual(3, scheduler.flush())
+        self.assertEqual([0, 1], sorted(len(u.queue) for u in uploaders))
+        self.assertEqual(0, budget.available())
+        self.assertEqual(0, scheduler.flush())
+        for uploader in uploaders:
+            uploader.client.close()
+
+    def test_scheduler_separate_budgets(self):
+        url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        uploaders = [StatusUploader(PVOutputClient(system_id, key, url=url, rate_limit=1), batch_size=1)
+                     for system_id, key in (('1', 'a'), ('2', 'b'))]
+        for uploader in uploaders:
+            uploader.add(self.date, self.status)
+        self.assertEqual(2, UploadScheduler(uploaders).flush())
+        for uploader in uploaders:
+            uploader.client.close()
+
+
+class StatusQueueTestCase(TestCase):
+    def test_order(self):
+        queue = StatusQueue()
+        date = datetime(2021, 6, 1, 12, 0)
+        queue.put(date + timedelta(minutes=5), {'power_gen': 2})
+        queue.put(date, {'power_gen': 1})
+        queue.put(date, {'power_gen': 3, 'temp': Decimal('21.1')})  # Replaces
+        self.assertEqual(2, len(queue))
+        self.assertEqual([(date, {'power_gen': 3, 'temp': '21.1'}), (date + timedelta(minutes=5), {'power_gen': 2})],
+                         queue.peek(10))
+        queue.remove([date])
+        self.assertEqual(1, len(queue))
+
+    def test_remove_before(self):
+        queue = StatusQueue()
+        date = datetime(2021, 6, 1, 12, 0)
+        queue.put(date, {})
+        queue.put(date + timedelta(days=1), {})
+        self.assertEqual(1, queue.remove_before(date + timedelta(hours=1)))
+        self.assertEqual(1, len(queue))
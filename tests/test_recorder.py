@@ -0,0 +1,118 @@
+"""Test cases for recorder.py."""
+import os
+import socket
+from io import BytesIO
+from socket import socketpair
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+from unittest import TestCase
+
+from samil.inverter import construct_message, Inverter, InverterEOFError
+from samil.recorder import FrameRecorder, read_recording, RECEIVED, ReplaySocket, SENT
+
+model_response = construct_message(b"\x01\x83\x00", b"14500".ljust(71, b"\x00"))
+status_format = construct_message(b"\x01\x80\x00", bytes.fromhex("00 0c"))
+status_response = construct_message(b"\x01\x82\x00", bytes.fromhex("00 c8 00 01"))
+
+
+class FrameRecorderTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp = TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'session.rec')
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return list(read_recording(f))
+
+    def test_record(self):
+        """Tests if sent and received data is recorded in order with increasing times."""
+        with FrameRecorder(self.path) as recorder:
+            recorder.sent(b"abc")
+            recorder.received(b"")
+            recorder.received(b"de")
+        records = self.read()
+        self.assertEqual([(SENT, b"abc"), (RECEIVED, b""), (RECEIVED, b"de")],
+                         [(r.direction, r.data) for r in records])
+        self.assertLessEqual(records[0].time, records[2].time)
+
+    def test_incomplete_record(self):
+        """Tests if a partly written record at the end is left out."""
+        with FrameRecorder(self.path) as recorder:
+            recorder.sent(b"abc")
+            recorder.sent(b"def")
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        self.assertEqual([b"abc"], [r.data for r in self.read()])
+
+    def test_not_a_recording(self):
+        """Tests if a file with another format is rejected."""
+        with self.assertRaises(ValueError):
+            list(read_recording(BytesIO(b"55aa")))
+
+    def test_inverter(self):
+        """Tests if the traffic of an inverter connection is recorded."""
+        local, remote = socketpair()
+        remote.send(model_response[:10])  # Arrives in two chunks
+        with FrameRecorder(self.path) as recorder, Inverter(local, None, recorder=recorder) as inverter:
+            inverter.send(b"\x01\x03\x02", b"")
+            inverter.sock.settimeout(0.01)
+            with self.assertRaises(socket.timeout):
+                inverter.receive()
+            remote.send(model_response[10:])
+            inverter.receive()
+        remote.close()
+        self.assertEqual([(SENT, construct_message(b"\x01\x03\x02", b"")),
+                          (RECEIVED, model_response[:10]),
+                          (RECEIVED, model_response[10:])],
+                         [(r.direction, r.data) for r in self.read()])
+
+
+class ReplaySocketTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp = TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'session.rec')
+        # Record a session with a fake inverter
+        local, remote = socketpair()
+        with FrameRecorder(self.path) as recorder, Inverter(local, None, recorder=recorder) as inverter:
+            remote.send(model_response)
+            self.model = inverter.model()
+            sleep(0.1)
+            remote.send(status_format + status_response[:5])
+            sleep(0.01)
+            remote.send(status_response[5:])
+            self.status = inverter.status()
+        remote.close()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_as_fast_as_possible(self):
+        """Tests if a replayed session gives the same results."""
+        start = monotonic()
+        with Inverter(ReplaySocket(self.path, speed=None), None) as inverter:
+            self.assertEqual(self.model, inverter.model())
+            self.assertEqual(self.status, inverter.status())
+            with self.assertRaises(InverterEOFError):
+                inverter.receive()
+        self.assertLess(monotonic() - start, 0.05)
+
+    def test_real_speed(self):
+        """Tests if received data is replayed at the recorded times."""
+        start = monotonic()
+        with Inverter(ReplaySocket(self.path), None) as inverter:
+            inverter.model()
+            inverter.status()
+        self.assertGreaterEqual(monotonic() - start, 0.1)
+
+    def test_timeout(self):
+        """Tests if a chunk that is due later than the timeout raises a timeout and is kept."""
+        with Inverter(ReplaySocket(self.path), None) as inverter:
+            inverter.model()
+            inverter.sock.settimeout(0.01)
+            with self.assertRaises(socket.timeout):
+                inverter.status()
+            inverter.sock.settimeout(1.0)
+            self.assertEqual(self.status, inverter.status())
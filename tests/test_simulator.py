@@ -0,0 +1,197 @@
+"""Test cases for simulator.py."""
+import asyncio
+import socket
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+
+from samil.asyncinverter import AsyncInverter
+from samil.inverter import construct_message, decode_model, decode_status
+from samil.simulator import create_fleet, Faults, LAKE, parse_latency, RIVER, Simulator, VirtualInverter
+
+
+def local_time(hour: int) -> float:
+    return datetime(2020, 6, 1, hour).timestamp()
+
+
+class VirtualInverterTestCase(TestCase):
+    def test_model(self):
+        """Tests if the serial number is set in the model."""
+        inverter = VirtualInverter('SIM000001', LAKE)
+        model = decode_model(inverter.model)
+        self.assertEqual('SIM000001', model['serial_number'])
+        self.assertEqual('SolarLake17K', model['model_name'])
+
+    def test_diurnal_curve(self):
+        """Tests if the power peaks at noon and the inverter is off at night."""
+        inverter = VirtualInverter('SIM000001', RIVER, peak_power=4000, sunrise=6.0, sunset=18.0)
+        night = decode_status(RIVER.status_format, inverter.status(local_time(3)))
+        self.assertEqual('PV power off', night['operation_mode'])
+        self.assertEqual(0, night['output_power'])
+        morning = decode_status(RIVER.status_format, inverter.status(local_time(9)))
+        noon = decode_status(RIVER.status_format, inverter.status(local_time(12)))
+        evening = decode_status(RIVER.status_format, inverter.status(local_time(21)))
+        self.assertEqual('Normal', noon['operation_mode'])
+        self.assertEqual(4000, noon['output_power'])
+        self.assertLess(morning['output_power'], noon['output_power'])
+        # Energy of the half sine: 4 kW * 12 h * 2 / pi = 30.56 kWh
+        self.assertEqual(Decimal('15.28'), noon['energy_today'])
+        self.assertEqual(Decimal('30.56'), evening['energy_today'])
+
+    def test_energy_total(self):
+        """Tests if the 32-bit energy total includes the energy of today."""
+        inverter = VirtualInverter('SIM000001', LAKE, energy_total=100000.0, clock=lambda: local_time(23))
+        ident, payload = inverter.respond(b'\x01\x02\x02', b'')
+        status = decode_status(LAKE.status_format, payload)
+        self.assertEqual(Decimal('100151.5'), status['energy_total'])  # 17 kW * 14 h * 2 / pi = 151.52 kWh
+
+    def test_unknown_request(self):
+        """Tests if there is no response for an unknown identifier."""
+        self.assertIsNone(VirtualInverter('SIM000001').respond(b'\x09\x09\x09', b''))
+
+
+class FaultsTestCase(TestCase):
+    def test_choose(self):
+        """Tests if faults are chosen with the given probabilities."""
+        self.assertEqual('drop', Faults(drop=1.0).choose())
+        self.assertIsNone(Faults().choose())
+        faults = Faults(corrupt=0.2, silence=0.1, seed=1)
+        for i in range(1000):
+            faults.choose()
+        self.assertAlmostEqual(200, faults.injected['corrupt'], delta=50)
+        self.assertAlmostEqual(100, faults.injected['silence'], delta=40)
+        self.assertNotIn('drop', faults.injected)
+
+    def test_invalid_probabilities(self):
+        with self.assertRaises(ValueError):
+            Faults(drop=0.6, corrupt=0.6)
+
+    def test_parse_latency(self):
+        self.assertEqual(0.5, parse_latency('0.5'))
+        self.assertTrue(1 <= parse_latency('uniform:1,2')() <= 2)
+        self.assertGreaterEqual(parse_latency('exp:0.1')(), 0)
+        self.assertGreaterEqual(parse_latency('normal:0,1')(), 0)
+        for spec in ('exp:0', 'uniform:1', 'pareto:1', 'fast'):
+            with self.assertRaises(ValueError):
+                parse_latency(spec)
+
+
+class SimulatorTestCase(TestCase):
+    """Connects virtual inverters to an asyncio server."""
+
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.connections = asyncio.Queue()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.accept, '127.0.0.1', 0))
+        self.server_port = self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self) -> None:
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def accept(self, reader, writer):
+        await self.connections.put(AsyncInverter(reader, writer, None, timeout=1.0))
+
+    def test_requests(self):
+        """Tests if a connected virtual inverter answers requests."""
+        async def run():
+            inverter = VirtualInverter('SIM000001', latency=0.01)
+            task = asyncio.ensure_future(inverter.connect('127.0.0.1', self.server_port))
+            client = await asyncio.wait_for(self.connections.get(), 1.0)
+            model = await client.model()
+            status = await client.status()
+            await client.disconnect()
+            await asyncio.wait_for(task, 1.0)
+            return inverter, model, status
+        inverter, model, status = self.loop.run_until_complete(run())
+        self.assertEqual('SIM000001', model['serial_number'])
+        self.assertIn('output_power', status)
+        self.assertEqual(3, inverter.requests)  # Model, status format and status
+        self.assertFalse(inverter.connected)
+
+    def test_advertisement(self):
+        """Tests if all inverters connect after an advertisement."""
+        async def run():
+            simulator = Simulator(create_fleet(20), host='127.0.0.1', port=0, server_port=self.server_port,
+                                  connect_jitter=0.05)
+            await simulator.start()
+            port = simulator.transport.get_extra_info('sockname')[1]
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.sendto(b'garbage', ('127.0.0.1', port))
+                s.sendto(construct_message(b'\x00\x40\x02', b'I AM SERVER'), ('127.0.0.1', port))
+            clients = [await asyncio.wait_for(self.connections.get(), 1.0) for i in range(20)]
+            serials = {(await c.model())['serial_number'] for c in clients}
+            connected = simulator.connected
+            for c in clients:
+                await c.disconnect()
+            await simulator.close()
+            return serials, connected
+        serials, connected = self.loop.run_until_complete(run())
+        self.assertEqual({'SIM{:06d}'.format(i) for i in range(20)}, serials)
+        self.assertEqual(20, connected)
+
+    def connect(self, inverter: VirtualInverter):
+        """Connects the inverter and returns the client side."""
+        async def run():
+            asyncio.ensure_future(inverter.connect('127.0.0.1', self.server_port))
+            client = await asyncio.wait_for(self.connections.get(), 1.0)
+            client.timeout = 0.1
+            return client
+        return self.loop.run_until_complete(run())
+
+    def test_corrupt(self):
+        """Tests if corrupt responses are skipped by the client."""
+        inverter = VirtualInverter('SIM000001', faults=Faults(corrupt=1.0))
+        client = self.connect(inverter)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(client.model())
+        self.assertEqual(1, client.parser.checksum_errors)
+        self.loop.run_until_complete(client.disconnect())
+
+    def test_truncate(self):
+        """Tests if the client resynchronizes on the next response after a truncated one."""
+        inverter = VirtualInverter('SIM000001', faults=Faults(truncate=1.0, seed=1))
+        client = self.connect(inverter)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(client.model())
+        inverter.faults = None
+        self.assertEqual('SIM000001', self.loop.run_until_complete(client.model())['serial_number'])
+        self.loop.run_until_complete(client.disconnect())
+
+    def test_unexpected(self):
+        """Tests if a response with an unexpected identifier is not taken as the response."""
+        inverter = VirtualInverter('SIM000001', faults=Faults(unexpected=1.0))
+        client = self.connect(inverter)
+        with self.assertLogs('samil.asyncinverter', 'WARNING'), self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(client.model())
+        self.loop.run_until_complete(client.disconnect())
+
+    def test_silence(self):
+        """Tests if a silent inverter keeps the connection open without responding."""
+        faults = Faults(silence=1.0)
+        inverter = VirtualInverter('SIM000001', faults=faults)
+        client = self.connect(inverter)
+        for i in range(2):
+            with self.assertRaises(asyncio.TimeoutError):
+                self.loop.run_until_complete(client.model())
+        faults.probabilities['silence'] = 0.0
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(client.model())
+        self.assertTrue(inverter.connected)
+        self.assertEqual(1, faults.injected['silence'])
+        self.loop.run_until_complete(client.disconnect())
+
+    def test_latency_distribution(self):
+        """Tests if the latency function is called for each response."""
+        delays = []
+
+        def latency():
+            delays.append(0.01)
+            return 0.01
+        client = self.connect(VirtualInverter('SIM000001', latency=latency))
+        self.loop.run_until_complete(client.status())
+        self.assertEqual(2, len(delays))
+        self.loop.run_until_complete(client.disconnect())
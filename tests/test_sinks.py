@@ -0,0 +1,105 @@
+"""Test cases for sinks.py."""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Event
+from unittest import TestCase
+
+from samil.sinks import FanOut, Sample, Sink, SinkWorker
+
+
+def sample(i: int) -> Sample:
+    """Returns a sample with a single status."""
+    return Sample(datetime.now(timezone.utc), OrderedDict([('A', {'output_power': i})]))
+
+
+class ListSink(Sink):
+    """Keeps the samples, optionally blocks until released."""
+
+    def __init__(self, blocked: bool = False):
+        self.samples = []
+        self.opened = False
+        self.closed = False
+        self.release = Event()
+        if not blocked:
+            self.release.set()
+
+    def open(self):
+        self.opened = True
+
+    def handle(self, sample: Sample):
+        self.release.wait(5.0)
+        self.samples.append(sample)
+
+    def close(self):
+        self.closed = True
+
+
+class SinkWorkerTestCase(TestCase):
+    def test_deliver(self):
+        """Tests if samples are delivered in order and the sink is closed."""
+        sink = ListSink()
+        worker = SinkWorker(sink)
+        samples = [sample(i) for i in range(3)]
+        for s in samples:
+            worker.put(s)
+        worker.close()
+        self.assertTrue(sink.opened)
+        self.assertTrue(sink.closed)
+        self.assertEqual(samples, sink.samples)
+        self.assertEqual(3, worker.handled)
+
+    def test_full(self):
+        """Tests if the oldest samples are dropped when the queue is full."""
+        sink = ListSink(blocked=True)
+        worker = SinkWorker(sink, queue_size=2)
+        samples = [sample(i) for i in range(5)]
+        worker.put(samples[0])
+        while len(worker):
+            pass  # Wait until the first sample is being handled
+        for s in samples[1:]:
+            worker.put(s)
+        sink.release.set()
+        worker.close()
+        self.assertEqual([samples[0], samples[3], samples[4]], sink.samples)
+        self.assertEqual(2, worker.dropped)
+
+    def test_handle_error(self):
+        """Tests if a failing sample is skipped."""
+        class FailingSink(ListSink):
+            def handle(self, sample: Sample):
+                if sample.statuses['A']['output_power'] == 0:
+                    raise ValueError
+                super().handle(sample)
+
+        sink = FailingSink()
+        worker = SinkWorker(sink)
+        worker.put(sample(0))
+        worker.put(sample(1))
+        with self.assertLogs('samil.sinks'):
+            worker.close()
+        self.assertEqual(1, len(sink.samples))
+        self.assertEqual(1, worker.failed)
+
+    def test_open_error(self):
+        """Tests if an exception of open is raised by the constructor."""
+        class FailingSink(Sink):
+            def open(self):
+                raise OSError
+
+        with self.assertRaises(OSError):
+            SinkWorker(FailingSink())
+
+
+class FanOutTestCase(TestCase):
+    def test_slow_sink(self):
+        """Tests if a blocked sink does not delay the other sinks."""
+        slow = ListSink(blocked=True)
+        fast = ListSink()
+        with FanOut([slow, fast]) as fanout:
+            fanout.put(sample(0))
+            fanout.put(sample(1))
+            fanout.workers[1].close()
+            self.assertEqual(2, len(fast.samples))
+            self.assertEqual([], slow.samples)
+            slow.release.set()
+        self.assertEqual(2, len(slow.samples))
@@ -0,0 +1,77 @@
+"""Test cases for spool.py."""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from samil.spool import Spool
+
+
+class SpoolTestCase(TestCase):
+    def setUp(self) -> None:
+        tmp = TemporaryDirectory()
+        # Cleanups run in reverse order, so the spools are closed before the directory is removed
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def spool(self, **kwargs) -> Spool:
+        """Returns a spool in the temporary directory, which is closed after the test."""
+        spool = Spool(self.dir, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_empty(self):
+        spool = self.spool()
+        self.assertEqual(0, len(spool))
+        self.assertIsNone(spool.oldest())
+
+    def test_append_read(self):
+        spool = self.spool()
+        spool.append([b'a', b'b'])
+        spool.append([b'c'])
+        segment = spool.oldest()
+        self.assertEqual([b'a', b'b', b'c'], spool.read(segment))
+        spool.remove(segment)
+        self.assertEqual(0, len(spool))
+        self.assertEqual(0, spool.size)
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_rotation(self):
+        spool = self.spool(segment_size=4)
+        spool.append([b'a'])
+        spool.append([b'b', b'c'])
+        spool.append([b'd'])
+        self.assertEqual(2, len(spool))
+        self.assertEqual([b'a', b'b', b'c'], spool.read(spool.oldest()))
+
+    def test_oldest_closes_segment(self):
+        """Tests if new lines go to a new segment after the oldest is taken."""
+        spool = self.spool()
+        spool.append([b'a'])
+        segment = spool.oldest()
+        spool.append([b'b'])
+        self.assertEqual([b'a'], spool.read(segment))
+        self.assertEqual(2, len(spool))
+
+    def test_max_size(self):
+        spool = self.spool(segment_size=1, max_size=4)
+        for line in (b'a', b'b', b'c'):
+            spool.append([line])
+        self.assertEqual(2, len(spool))
+        self.assertEqual([b'b'], spool.read(spool.oldest()))
+
+    def test_reopen(self):
+        """Tests if segments of a previous instance are picked up."""
+        spool = self.spool()
+        spool.append([b'a'])
+        spool.close()
+        spool = self.spool()
+        spool.append([b'b'])
+        self.assertEqual(2, len(spool))
+        self.assertEqual([b'a'], spool.read(spool.oldest()))
+
+    def test_incomplete_line(self):
+        with open(os.path.join(self.dir, '000000000000.spool'), 'wb') as f:
+            f.write(b'a\nb')
+        spool = self.spool()
+        with self.assertLogs('samil.spool', 'WARNING'):
+            self.assertEqual([b'a'], spool.read(spool.oldest()))
@@ -3,7 +3,8 @@ from unittest import TestCase
 
 from samil.inverter import decode_string
 from samil.statustypes import DecimalStatusType, \
-    OperationModeStatusType, OneOfStatusType, BytesStatusType, IfPresentStatusType
+    OperationModeStatusType, OneOfStatusType, BytesStatusType, IfPresentStatusType, IntStatusType, StatusDecoder, \
+    get_status_decoder
 
 
 class BytesStatusTypeTestCase(TestCase):
@@ -24,6 +25,25 @@ class BytesStatusTypeTestCase(TestCase):
         t = BytesStatusType(0x02, 0x01)
         self.assertEqual(b'\x0b\xe1\x0b\xac', t.get_value(self.status_format, self.status_message))
 
+    def test_compile(self):
+        words = StatusDecoder(self.status_format).struct.unpack(self.status_message)
+        self.assertIsNone(BytesStatusType(0x03, 0x04).compile(self.status_format))
+        self.assertEqual(b'\x0b\xac', BytesStatusType(0x01).compile(self.status_format)(words))
+        self.assertEqual(b'\x0b\xe1\x0b\xac', BytesStatusType(0x02, 0x01).compile(self.status_format)(words))
+
+
+class IntStatusTypeTestCase(TestCase):
+    status_format = bytes.fromhex("00 01 02")
+    status_payload = bytes.fromhex("ff 38 00 01 ff fe")
+
+    def test_compile(self):
+        words = StatusDecoder(self.status_format).struct.unpack(self.status_payload)
+        for type_ids in [(0x00,), (0x01,), (0x02, 0x00), (0x01, 0x02)]:
+            for signed in [False, True]:
+                t = IntStatusType(*type_ids, signed=signed)
+                self.assertEqual(t.get_value(self.status_format, self.status_payload),
+                                 t.compile(self.status_format)(words))
+
 
 class DecimalStatusTypeTestCase(TestCase):
     status_format = bytes.fromhex("00 01 02 04 05 09 0a 0c 11 17 18 1b 1c 1d 1e 1f 20 21 22 27 28 31 32 33 34 35 36")
@@ -95,3 +115,38 @@ class IfPresentStatusTypeTestCase(TestCase):
         # If not present and actually not present
         t = IfPresentStatusType(0x01, False, status_type)
         self.assertEqual(b'\x12\x34', t.get_value(status_format, status_payload))
+
+
+class StatusDecoderTestCase(TestCase):
+    # SolarRiver 4500 TL-D
+    river_format = bytes.fromhex("00 01 02 04 05 09 0a 0c 11 17 18 1b 1c 1d 1e 1f 20 21 22 27 28 31 32 33 34 35 36")
+    river_payload = bytes.fromhex("01 77 0b 9f 0b f6 00 15 00 14 00 00 28 40 00 01 01 da 00 00 00 00 00 00 00 " +
+                                  "00 00 00 00 00 00 00 00 00 00 00 00 00 02 88 02 6f 00 37 09 14 13 86 04 ee " +
+                                  "00 01 b1 cc")
+    # SolarLake17K
+    lake_format = bytes.fromhex("00 01 02 04 05 07 08 09 0a 0b 0c 11 17 18 19 1a 1b 1c 1d 1e 21 22 27 28 2f 31 " +
+                                "32 33 51 52 53 71 72 73")
+    lake_payload = bytes.fromhex("01 5e 16 e9 00 43 00 30 00 01 00 00 03 02 00 00 00 2d 0a 1d 00 01 08 48 00 00 " +
+                                 "00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 0b 06 00 00 02 12 00 24 " +
+                                 "09 7a 13 89 00 25 09 8d 13 89 00 24 09 79 13 89")
+
+    def test_river(self):
+        decoder = StatusDecoder(self.river_format)
+        self.assertEqual(decoder.decode_slow(self.river_payload), decoder.decode(self.river_payload))
+        self.assertEqual(Decimal('232.4'), decoder.decode(self.river_payload)['grid_voltage'])
+
+    def test_lake(self):
+        decoder = StatusDecoder(self.lake_format)
+        status = decoder.decode(self.lake_payload)
+        self.assertEqual(decoder.decode_slow(self.lake_payload), status)
+        self.assertEqual(list(decoder.decode_slow(self.lake_payload)), list(status))
+        self.assertEqual(Decimal('242.6'), status['grid_voltage_r_phase'])
+        self.assertNotIn('grid_voltage', status)
+
+    def test_short_payload(self):
+        decoder = StatusDecoder(self.river_format)
+        payload = self.river_payload[:-4]
+        self.assertEqual(decoder.decode_slow(payload), decoder.decode(payload))
+
+    def test_cached(self):
+        self.assertIs(get_status_decoder(self.river_format), get_status_decoder(bytes(self.river_format)))
@@ -0,0 +1,109 @@
+"""Test cases for store.py."""
+import os
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import TestCase
+
+from samil.store import TimeSeriesStore
+
+status = OrderedDict([
+    ('operation_mode', 'Normal'),
+    ('total_operation_time', 45),
+    ('pv1_input_power', Decimal('2822')),
+    ('pv1_voltage', Decimal('586.5')),
+    ('output_power', Decimal('2589')),
+    ('energy_today', Decimal('21.20')),
+    ('energy_total', Decimal('77.0')),
+    ('grid_frequency', Decimal('50.01')),
+    ('internal_temperature', Decimal('-3.5')),
+])
+
+t0 = datetime(2020, 6, 1, 23, 59, 50, tzinfo=timezone.utc)
+
+
+class TimeSeriesStoreTestCase(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = TimeSeriesStore(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.directory.cleanup()
+
+    def append(self, n: int, serial_number='DW413B8080'):
+        """Appends n samples, 10 seconds apart from t0, with output power 0, 1, 2, etc."""
+        for i in range(n):
+            self.store.append(serial_number, t0 + timedelta(seconds=10 * i),
+                              OrderedDict(status, output_power=Decimal(i)))
+
+    def test_round_trip(self):
+        """Tests if the stored status equals the original status."""
+        self.store.append('DW413B8080', t0, status)
+        self.assertEqual([(t0, status)], self.store.query('DW413B8080', t0, t0 + timedelta(seconds=1)))
+
+    def test_range(self):
+        """Tests if the start is inclusive and the end is exclusive, across days."""
+        self.append(5)
+        samples = self.store.query('DW413B8080', t0 + timedelta(seconds=10), t0 + timedelta(seconds=40))
+        self.assertEqual([t0 + timedelta(seconds=10 * i) for i in (1, 2, 3)], [t for t, s in samples])
+        self.assertEqual(['20200601', '20200602'], self.store.days('DW413B8080'))
+
+    def test_fields(self):
+        """Tests if only the given fields are returned."""
+        self.append(2)
+        samples = self.store.query('DW413B8080', t0, t0 + timedelta(days=1), fields=['output_power', 'grid_voltage'])
+        self.assertEqual([OrderedDict(output_power=Decimal(0)), OrderedDict(output_power=Decimal(1))],
+                         [s for t, s in samples])
+
+    def test_order(self):
+        """Tests if a sample before the last sample is rejected."""
+        self.append(2)
+        with self.assertRaises(ValueError):
+            self.store.append('DW413B8080', t0, status)
+
+    def test_serial_number(self):
+        """Tests if serial numbers that are not safe as file name are rejected."""
+        with self.assertRaises(ValueError):
+            self.store.append('../DW413B8080', t0, status)
+
+    def test_reopen(self):
+        """Tests if samples are kept and an incomplete last record is removed."""
+        self.append(3)
+        self.store.close()
+        path = os.path.join(self.directory.name, 'DW413B8080', '20200602.ts')
+        with open(path, 'ab') as f:
+            f.write(b'\x00' * 10)
+        with self.assertLogs('samil.store', 'WARNING'):
+            store = TimeSeriesStore(self.directory.name)
+            samples = store.query('DW413B8080', t0, t0 + timedelta(days=1))
+        self.assertEqual(3, len(samples))
+        with self.assertRaises(ValueError):
+            store.append('DW413B8080', t0, status)
+        store.close()
+
+    def test_invalid_file(self):
+        """Tests if a file of another format is not used."""
+        os.mkdir(os.path.join(self.directory.name, 'DW413B8080'))
+        with open(os.path.join(self.directory.name, 'DW413B8080', '20200601.ts'), 'wb') as f:
+            f.write(b'something else')
+        with self.assertRaises(ValueError):
+            self.store.append('DW413B8080', t0, status)
+
+    def test_remove_before(self):
+        """Tests if only days that ended are removed."""
+        self.append(3)
+        self.append(3, serial_number='DW413B8081')
+        self.assertEqual(0, self.store.remove_before(t0))
+        self.assertEqual(2, self.store.remove_before(t0 + timedelta(seconds=20)))
+        self.assertEqual(['20200602'], self.store.days('DW413B8080'))
+        self.assertEqual(2, len(self.store.query('DW413B8081', t0, t0 + timedelta(days=1))))
+
+    def test_retention(self):
+        """Tests if old days are removed when a new day is started."""
+        self.append(1)
+        store = TimeSeriesStore(self.directory.name, retention=timedelta(days=7))
+        store.append('DW413B8080', datetime.now(timezone.utc), status)
+        store.close()
+        self.assertEqual(1, len(self.store.days('DW413B8080')))